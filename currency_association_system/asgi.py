@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'currency_association_system.settings')
 
 application = get_asgi_application()
+
+# Daily membership expiry, in the server process so it runs without any separate worker
+from main_app.expiry import start_expiry_runner  # noqa: E402
+
+start_expiry_runner()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import shutil
 # import sentry_sdk
 from pathlib import Path
 
@@ -61,6 +62,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main_app.middleware.MemberMiddleware',
+    'main_app.middleware.ExpiredMemberMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -147,6 +150,10 @@ STATIC_ROOT = os.path.join(BASE_DIR,'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT =  os.path.join(BASE_DIR, 'media')
 
+# Generated PDFs and card export ZIPs hold CNICs and addresses, so they are stored here, outside
+# MEDIA_ROOT, and only served by views that check who is asking
+PRIVATE_MEDIA_ROOT = os.environ.get('PRIVATE_MEDIA_ROOT') or os.path.join(BASE_DIR, 'private_media')
+
 CSS_LOCATION = os.path.join(BASE_DIR,'static')
 
 # Default primary key field type
@@ -155,6 +162,59 @@ CSS_LOCATION = os.path.join(BASE_DIR,'static')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# How many currency association IDs each worker process reserves per database round trip.
+# 1 keeps IDs gapless; larger blocks make concurrent signups cheaper but leave gaps on restart.
+CURRENCY_ASSOCIATION_ID_BLOCK_SIZE = 1
+
+# Holds the reference data (main_app/reference_data.py) and the tehsil map. Locmem is per
+# process: with several server processes set CACHE_DIR so they share a file-based cache and
+# see each other's invalidations, or REDIS_URL (needs the redis package) for a shared cache
+# whose add and incr are atomic across processes, which the login attempt counter relies on.
+if os.environ.get('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                          'LOCATION': os.environ['REDIS_URL']}}
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': os.environ['CACHE_DIR']}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Failed member logins allowed per currency association ID in each LOGIN_ATTEMPT_WINDOW seconds
+# window (fixed windows counted from the epoch)
+LOGIN_ATTEMPT_LIMIT = 5
+LOGIN_ATTEMPT_WINDOW = 15 * 60
+
+# wkhtmltopdf binary used by the PDF worker (manage.py pdf_worker); found on PATH when unset
+WKHTMLTOPDF_CMD = os.environ.get('WKHTMLTOPDF_CMD') or shutil.which('wkhtmltopdf') or 'wkhtmltopdf'
+
+# How the receipts and member details users download are rendered, see main_app/pdf_renderers.py
+PDF_RENDERER = {
+    'BACKEND': 'main_app.pdf_renderers.WkhtmltopdfRenderer',
+    'OPTIONS': {},
+}
+
+# Renderer for bulk card exports (manage.py export_member_cards), PDF_RENDERER when None. Only
+# here 'main_app.pdf_renderers.CardLayoutRenderer' may be used: pure Python, no wkhtmltopdf, but
+# a plain layout without the CSS, images and Urdu text. 'main_app.pdf_renderers.ProcessPoolRenderer'
+# (OPTIONS {'processes': 2}) renders with it in long-lived processes beside the export.
+CARD_EXPORT_PDF_RENDERER = None
+
+# Seconds between the server's checks whether today's membership expiry sweep is due, see
+# main_app/expiry.py; 0 turns the in-process runner off (manage.py expire_members --every instead)
+EXPIRY_SWEEP_INTERVAL = int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 15 * 60))
+
+# Seconds a PDF job waits for a pdf_worker before the request asking for it renders it itself;
+# 0 renders every PDF in the request (no worker running)
+PDF_WORKER_WAIT = int(os.environ.get('PDF_WORKER_WAIT', 10))
+
+# Seconds after which a PDF job still marked running is assumed lost and handed out again
+PDF_JOB_TIMEOUT = 300
+
+# Seconds a finished card export ZIP, and a cached PDF, are kept before the PDF worker deletes
+# them; a deleted PDF is rendered again when it is next asked for
+CARD_EXPORT_MAX_AGE = 7 * 24 * 60 * 60
+PDF_MAX_AGE = 30 * 24 * 60 * 60
+
 ENCRYPTION_KEY = "b'UMw7arSwW802Bey6_hvkQeHa0GSZtqBMaNeXt39c-Dc='"
 
 #DEPLOYMENT SETTING
@@ -1,21 +1,101 @@
 from django.contrib import admin
 from django import forms
 # Register your models here.
+from django.contrib import messages
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 from import_export.admin import ImportExportModelAdmin
 
+from .approvals import approve_change_requests, reject_change_requests
+from .expiry import calculate_member_till
+from .exports import member_export_response
+from .forms import MemberImportUploadForm
+from .member_import import MemberImporter, read_rows
 from .models import *
 
 # Register Member model
 from .resources import TehsilResource, DistrictResource
+from .search import filter_search
 
 
 @admin.register(Member)
 class MemberAdmin(admin.ModelAdmin):
-    list_display = ('full_name', 'cnic', 'dob', 'gender', 'nic_type', 'country_of_stay', 'dual_citizen', 'business_name')
+    list_display = ('full_name', 'cnic', 'dob', 'gender', 'nic_type', 'country_of_stay', 'dual_citizen', 'business_name', 'tehsil')
     search_fields = ('full_name', 'cnic', 'business_name')
     list_filter = ('gender', 'nic_type', 'country_of_stay', 'dual_citizen')
     readonly_fields = ('cnic_last_digits',)
+
+    actions = ['export_member_cards', 'export_csv', 'export_xlsx']
+    change_list_template = 'admin/member_change_list.html'
+
+    def get_queryset(self, request):
+        # The change form needs every column, so only join the related rows here
+        return super().get_queryset(request).with_related()
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index instead of LIKE '%term%' over every row, see search.py
+        if not search_term.strip():
+            return queryset, False
+        return filter_search(queryset, search_term), False
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_members), name='main_app_member_import'),
+        ] + super().get_urls()
+
+    def import_members(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = MemberImportUploadForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            importer = MemberImporter(payment=form.cleaned_data['payment'], approve=form.cleaned_data['approve'],
+                                      dry_run=form.cleaned_data['dry_run'])
+            result = importer.run(read_rows(upload, upload.name))
+            verb = "would be created" if importer.dry_run else "created"
+            self.message_user(request, f"{result.created} members and {result.fees} fees {verb}.")
+            if result.errors:
+                # The report holds CNICs, so it is handed over directly instead of being stored
+                self.message_user(request, f"{result.failed} rows failed, see the downloaded error report.",
+                                  messages.WARNING)
+                response = HttpResponse(content_type='text/csv; charset=utf-8')
+                response['Content-Disposition'] = 'attachment; filename="member-import-errors.csv"'
+                result.write_report(response)
+                return response
+            if not importer.dry_run:
+                return redirect('admin:main_app_member_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Import members",
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/member_import.html', context)
+
+    @admin.action(description="Export selected members (CSV)")
+    def export_csv(self, request, queryset):
+        return member_export_response(queryset, request.user, 'csv')
+
+    @admin.action(description="Export selected members (XLSX)")
+    def export_xlsx(self, request, queryset):
+        return member_export_response(queryset, request.user, 'xlsx')
+
+    @admin.action(description="Export membership cards (ZIP)")
+    def export_member_cards(self, request, queryset):
+        # Rendering thousands of PDFs does not fit in a request, the PDF worker builds the ZIP
+        member_ids = list(queryset.order_by('id').values_list('id', flat=True))
+        export = CardExport.objects.create(member_ids=member_ids, total=len(member_ids), requested_by=request.user)
+        url = reverse('admin:main_app_cardexport_change', args=[export.id])
+        self.message_user(request, format_html(
+            'Card export {} queued for {} members. <a href="{}">Follow its progress</a>.', export.id, len(member_ids), url,
+        ))
     # fieldsets = (
     #     ('Personal Information', {
     #         'fields': ('full_name', 'father_name', 'cnic', 'dob', 'gender', 'nic_type', 'country_of_stay',
@@ -37,14 +117,23 @@ class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
         (None, {'fields': ('role', 'currency_association_id')}),
     )
+class GeodataImportAdmin(ImportExportModelAdmin):
+    def process_dataset(self, dataset, form, request, **kwargs):
+        result = super().process_dataset(dataset, form, request, **kwargs)
+        # Shown on the preview and again after the import is confirmed
+        for line in getattr(result, 'diff_summary', []):
+            messages.info(request, line)
+        return result
+
+
 @admin.register(Tehsil)
-class TehsilAdmin(ImportExportModelAdmin):
+class TehsilAdmin(GeodataImportAdmin):
     resource_class = TehsilResource
     list_display = ('name', 'district', 'latitude', 'longitude')  # Customize columns displayed in admin
 admin.site.register(User, CustomUserAdmin)
 
 @admin.register(District)
-class DistrictAdmin(ImportExportModelAdmin):
+class DistrictAdmin(GeodataImportAdmin):
     resource_class = DistrictResource
     list_display = ('name',)  # Customize columns displayed in admin
 
@@ -57,4 +146,79 @@ class FeeAdmin(admin.ModelAdmin):
 admin.site.register(Fee, FeeAdmin)
 
 admin.site.register(Payment)
-admin.site.register(MemberChangeRequest)
+
+
+# Requests that were not approved or rejected listed one by one after a bulk review
+REVIEW_MESSAGES = 20
+
+
+@admin.register(MemberChangeRequest)
+class MemberChangeRequestAdmin(admin.ModelAdmin):
+    list_display = ('application_id', 'member', 'submission_date', 'is_approved', 'is_rejected', 'admin_reviewed_at')
+    list_filter = ('is_approved', 'is_rejected')
+    search_fields = ('application_id', 'member__full_name', 'member__cnic')
+    list_select_related = ('member',)
+    actions = ['approve_selected', 'reject_selected']
+
+    def _report(self, request, result):
+        level = messages.WARNING if set(result.counts) - {'approved', 'rejected'} else messages.SUCCESS
+        self.message_user(request, f"Change requests: {result.summary()}.", level)
+        problems = [(request_id, outcome, message) for request_id, (outcome, message) in result.outcomes.items()
+                    if outcome not in ('approved', 'rejected')]
+        for request_id, outcome, message in problems[:REVIEW_MESSAGES]:
+            self.message_user(request, f"#{request_id}: {outcome}. {message}", messages.WARNING)
+        if len(problems) > REVIEW_MESSAGES:
+            self.message_user(request, f"… and {len(problems) - REVIEW_MESSAGES} more.", messages.WARNING)
+
+    @admin.action(description="Approve selected change requests and their fees")
+    def approve_selected(self, request, queryset):
+        ids = list(queryset.values_list('id', flat=True))
+        self._report(request, approve_change_requests(ids, calculate_member_till(timezone.now()).date()))
+
+    @admin.action(description="Reject selected change requests")
+    def reject_selected(self, request, queryset):
+        self._report(request, reject_change_requests(list(queryset.values_list('id', flat=True))))
+
+
+@admin.register(PdfJob)
+class PdfJobAdmin(admin.ModelAdmin):
+    list_display = ('member', 'kind', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    list_select_related = ('member',)
+    readonly_fields = ('content_hash', 'error', 'attempts', 'started_at', 'finished_at')
+    # The file has no public URL; members and staff open it through the receipt and detail views
+    exclude = ('html', 'file')
+
+
+@admin.register(CardExport)
+class CardExportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'progress', 'requested_by', 'created_at', 'finished_at', 'download')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'total', 'done', 'skipped', 'download', 'error', 'requested_by', 'started_at',
+                       'finished_at')
+    exclude = ('member_ids', 'file')
+
+    def has_add_permission(self, request):
+        # Exports are started from the member list
+        return False
+
+    def progress(self, obj):
+        return f"{obj.done + obj.skipped}/{obj.total}"
+
+    @admin.display(description="ZIP")
+    def download(self, obj):
+        # The file is not under MEDIA_URL, it is served by a staff-only view
+        if not obj.file:
+            return '-'
+        return format_html('<a href="{}">Download</a>', reverse('download_card_export', args=[obj.id]))
+
+
+@admin.register(ExpirySweep)
+class ExpirySweepAdmin(admin.ModelAdmin):
+    list_display = ('cutoff', 'status', 'expired', 'batches', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('cutoff', 'status', 'expired', 'batches', 'error', 'started_at', 'finished_at')
+
+    def has_add_permission(self, request):
+        # Sweeps are run by the expire_members command and the PDF worker
+        return False
@@ -0,0 +1,131 @@
+from collections import Counter
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .autocomplete import AUTOCOMPLETE_FIELDS, members_changed
+from .maps import invalidate_tehsils_map
+from .models import Fee, Member, MemberChangeRequest
+from .stats import record_member_transitions
+
+# Change requests reviewed per transaction
+REVIEW_CHUNK_SIZE = 500
+
+
+class ReviewResult:
+    def __init__(self):
+        self.outcomes = {}  # change request id -> (outcome, message)
+
+    def add(self, request_id, outcome, message=''):
+        self.outcomes[request_id] = (outcome, message)
+
+    @property
+    def counts(self):
+        return dict(Counter(outcome for outcome, _ in self.outcomes.values()))
+
+    def summary(self):
+        return ', '.join(f"{count} {outcome}" for outcome, count in sorted(self.counts.items())) or "Nothing selected"
+
+    def as_list(self):
+        return [{'id': request_id, 'outcome': outcome, 'message': message}
+                for request_id, (outcome, message) in self.outcomes.items()]
+
+
+def _chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _review(ids, review_chunk, chunk_size):
+    result = ReviewResult()
+    # Keep the selection order, once per id
+    ids = list(dict.fromkeys(int(request_id) for request_id in ids))
+    for chunk in _chunks(ids, chunk_size):
+        try:
+            with transaction.atomic():
+                change_requests = {
+                    change_request.id: change_request
+                    for change_request in MemberChangeRequest.objects.select_related('member', 'fee')
+                    .select_for_update().filter(id__in=chunk)
+                }
+                pending = []
+                for request_id in chunk:
+                    change_request = change_requests.get(request_id)
+                    if change_request is None:
+                        result.add(request_id, 'not found', "No such change request.")
+                    elif change_request.is_approved or change_request.is_rejected:
+                        result.add(request_id, 'skipped', "Already reviewed.")
+                    else:
+                        pending.append(change_request)
+                review_chunk(pending, result)
+        except DatabaseError as e:
+            # The chunk was rolled back; earlier chunks stay committed
+            for request_id in chunk:
+                result.add(request_id, 'failed', str(e))
+    result.outcomes = {request_id: result.outcomes[request_id] for request_id in ids}
+    return result
+
+
+def approve_change_requests(ids, member_till, chunk_size=REVIEW_CHUNK_SIZE):
+    """
+    Approve the pending change requests ``ids`` and their fees, apply the proposed changes
+    and extend each member to ``member_till`` (reactivating expired members), ``chunk_size``
+    requests per transaction.
+
+    A chunk is read with one query and written with one bulk_update per table. The member
+    update covers the union of the columns changed in the chunk; a member whose request
+    did not change one of them gets its current value written back.
+    """
+    map_changed = False
+
+    def approve_chunk(change_requests, result):
+        nonlocal map_changed
+        now = timezone.now()
+        members = {}
+        member_fields = {'member_till'}
+        for change_request in change_requests:
+            # Several requests of one member are applied to the same instance, in order
+            change_request.member = members.setdefault(change_request.member_id, change_request.member)
+            changed = change_request.stage_changes()
+            change_request.member.member_till = member_till
+            member_fields.update(changed)
+            map_changed = map_changed or 'tehsil_id' in changed
+            if change_request.member.status == 'expired':
+                # The renewed membership runs again
+                change_request.member.status = 'active'
+                member_fields.add('status')
+                map_changed = True
+            change_request.is_approved = True
+            change_request.admin_reviewed_at = now
+            change_request.fee.is_approved = True
+            result.add(change_request.id, 'approved',
+                       f"{len(changed)} fields changed." if changed else "No changes to apply.")
+        MemberChangeRequest.objects.bulk_update(change_requests, ['is_approved', 'admin_reviewed_at'])
+        Fee.objects.bulk_update([change_request.fee for change_request in change_requests], ['is_approved'])
+        Member.objects.bulk_update(list(members.values()), sorted(member_fields))
+        record_member_transitions(members.values())
+        if member_fields.intersection(AUTOCOMPLETE_FIELDS):
+            members_changed(members)
+
+    result = _review(ids, approve_chunk, chunk_size)
+    if map_changed:
+        # bulk_update sends no post_save signals; the stats rows were moved per chunk
+        invalidate_tehsils_map()
+    return result
+
+
+def reject_change_requests(ids, reason='', chunk_size=REVIEW_CHUNK_SIZE):
+    """
+    Reject the pending change requests ``ids`` with ``reason``. Their fees stay unapproved
+    and the members are not touched.
+    """
+    def reject_chunk(change_requests, result):
+        now = timezone.now()
+        for change_request in change_requests:
+            change_request.is_rejected = True
+            change_request.rejection_reason = reason
+            change_request.admin_reviewed_at = now
+            result.add(change_request.id, 'rejected')
+        MemberChangeRequest.objects.bulk_update(change_requests, ['is_rejected', 'rejection_reason', 'admin_reviewed_at'])
+
+    return _review(ids, reject_chunk, chunk_size)
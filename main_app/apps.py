@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MainAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import repair_member_search_index
+
+        # Migrations that rebuild the member or user table drop the search index triggers
+        post_migrate.connect(repair_member_search_index, sender=self)
@@ -1,21 +1,93 @@
+import hashlib
+import time
+
+from django.conf import settings
 from django.contrib.auth.backends import BaseBackend
-from .models import User, Member
+from django.core.cache import cache
+
+from .models import User
+
+# Seconds a user loaded by get_user stays cached; saving or deleting the user drops it sooner
+USER_CACHE_TIMEOUT = 300
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
 
 class CustomBackend(BaseBackend):
     def authenticate(self, request, currency_association_id=None, last_4_cnic_digits=None):
+        # An empty value would match every CNIC
+        if not currency_association_id or not last_4_cnic_digits or len(last_4_cnic_digits) != 4:
+            return None
         try:
-            # Fetch user based on currency_association_id
-            user = User.objects.get(currency_association_id=currency_association_id)
-            # Get the related member
-            member = Member.objects.get(user=user)
-            # Check if the last 4 digits of the CNIC match
-            if member.cnic and member.cnic.endswith(last_4_cnic_digits):
-                return user
-        except (User.DoesNotExist, Member.DoesNotExist):
+            # The user and its member in one query; the view reads ``user.member`` without another
+            user = User.objects.select_related('member').get(currency_association_id=currency_association_id)
+            member = user.member
+        except (User.DoesNotExist, User.member.RelatedObjectDoesNotExist):
             return None
+        # Check if the last 4 digits of the CNIC match
+        if member.cnic and member.cnic.endswith(last_4_cnic_digits):
+            return user
+        return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+        # Runs on every authenticated request, so the user is kept in the cache between requests
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+
+def normalize_currency_association_id(value):
+    """
+    The ID failed logins are counted under. Case and surrounding spaces do not give a
+    fresh set of guesses; the login itself still looks the ID up exactly as submitted.
+    """
+    return (value or '').strip().upper()
+
+
+def _attempts_key(currency_association_id, now=None):
+    # One counter per ID and window, numbered from the epoch, so it is created with add and counted
+    # with incr, both atomic in the shared cache, and the next window starts from a fresh key.
+    # Hashed so any submitted value makes a valid cache key
+    window = int((time.time() if now is None else now) // settings.LOGIN_ATTEMPT_WINDOW)
+    digest = hashlib.md5(currency_association_id.encode()).hexdigest()
+    return f'login_attempts:{window}:{digest}'
+
+
+def login_retry_after(currency_association_id):
+    """
+    Seconds until ``currency_association_id`` (normalized) may try to log in again, or 0.
+    Checked before authenticating, so a throttled ID costs no query.
+    """
+    now = time.time()
+    if (cache.get(_attempts_key(currency_association_id, now)) or 0) < settings.LOGIN_ATTEMPT_LIMIT:
+        return 0
+    window = settings.LOGIN_ATTEMPT_WINDOW
+    return max(1, int(window - now % window))
+
+
+def record_failed_login(currency_association_id):
+    now = time.time()
+    key = _attempts_key(currency_association_id, now)
+    timeout = max(1, int(settings.LOGIN_ATTEMPT_WINDOW - now % settings.LOGIN_ATTEMPT_WINDOW))
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between add and incr, at the very end of the window
+        cache.add(key, 1, timeout)
+
+
+def reset_login_attempts(currency_association_id):
+    cache.delete(_attempts_key(currency_association_id))
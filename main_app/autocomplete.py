@@ -0,0 +1,193 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Member
+
+AUTOCOMPLETE_JOURNAL_KEY = 'member_autocomplete_journal'
+
+# Journal entries a process replays before it rebuilds its index instead; a process that
+# has not looked anything up for a day rebuilds too
+MAX_JOURNAL_REPLAY = 500
+JOURNAL_ENTRY_TIMEOUT = 24 * 60 * 60
+
+# Each changed member shifts the sorted keys once per key, so past this many a rebuild is faster
+MAX_INCREMENTAL_CHANGES = 500
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Member fields the index lists; a change to one of them is recorded with members_changed
+AUTOCOMPLETE_FIELDS = ('full_name', 'cnic', 'status')
+
+INDEX_FIELDS = ('id', 'full_name', 'cnic', 'user__currency_association_id', 'status')
+
+# The index of this process and the journal entry it is complete up to
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def normalize(text):
+    """Case-folded ``text`` with single spaces; CNICs typed with dashes or spaces lose them, as they are stored."""
+    text = ' '.join(text.casefold().split())
+    if re.fullmatch(r'[\d -]+', text):
+        text = re.sub(r'[ -]', '', text)
+    return text
+
+
+def member_keys(full_name, cnic, currency_association_id):
+    """
+    Keys a member is found by: the association ID and its number without leading zeros,
+    the CNIC, and the name from each of its words on, so "ali" finds "Muhammad Ali Khan".
+    """
+    keys = {normalize(cnic or ''), normalize(currency_association_id or '')}
+    number = re.search(r'\d+$', currency_association_id or '')
+    if number:
+        keys.add(number.group().lstrip('0'))
+    words = normalize(full_name or '').split(' ')
+    keys.update(' '.join(words[start:]) for start in range(len(words)))
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """Sorted ``(key, member id)`` pairs searched with bisect, and what each member is listed as."""
+
+    def __init__(self, rows=()):
+        self.members = {}
+        self.keys = []
+        for row in rows:
+            self.members[row[0]] = row
+            self.keys.extend((key, row[0]) for key in member_keys(*row[1:4]))
+        self.keys.sort()
+
+    def remove(self, member_id):
+        row = self.members.pop(member_id, None)
+        if row is not None:
+            for key in member_keys(*row[1:4]):
+                position = bisect_left(self.keys, (key, member_id))
+                if position < len(self.keys) and self.keys[position] == (key, member_id):
+                    del self.keys[position]
+
+    def add(self, row):
+        self.remove(row[0])
+        self.members[row[0]] = row
+        for key in member_keys(*row[1:4]):
+            self.keys.insert(bisect_left(self.keys, (key, row[0])), (key, row[0]))
+
+    def lookup(self, prefix, limit):
+        """Up to ``limit`` ``(id, full_name, cnic, currency_association_id, status)`` rows with a key starting with ``prefix``."""
+        found = {}
+        position = bisect_left(self.keys, (prefix,))
+        while len(found) < limit and position < len(self.keys):
+            key, member_id = self.keys[position]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(member_id, self.members[member_id])
+            position += 1
+        return list(found.values())
+
+
+def journal_version():
+    # Starts from a timestamp, so a journal evicted from the cache never repeats a number
+    cache.add(AUTOCOMPLETE_JOURNAL_KEY, time.time_ns(), None)
+    return cache.get(AUTOCOMPLETE_JOURNAL_KEY)
+
+
+def _journal_entry_key(version):
+    return f'{AUTOCOMPLETE_JOURNAL_KEY}:{version}'
+
+
+def _load_rows(member_ids=None):
+    members = Member.objects.order_by()
+    if member_ids is not None:
+        members = members.filter(id__in=member_ids)
+    return list(members.values_list(*INDEX_FIELDS))
+
+
+def _refresh(index, member_ids):
+    rows = {row[0]: row for row in _load_rows(member_ids)}
+    for member_id in member_ids:
+        if member_id in rows:
+            index.add(rows[member_id])
+        else:
+            index.remove(member_id)
+
+
+def _catch_up(version):
+    """Replay the journal entries this process has not seen, or rebuild if that is not possible."""
+    global _index, _index_version
+    if _index is not None and 0 < version - _index_version <= MAX_JOURNAL_REPLAY:
+        entries = cache.get_many([_journal_entry_key(number) for number in range(_index_version + 1, version + 1)])
+        changed = set()
+        for number in range(_index_version + 1, version + 1):
+            member_ids = entries.get(_journal_entry_key(number))
+            # An evicted or not yet written entry, or a change to every member
+            if member_ids is None:
+                break
+            changed.update(member_ids)
+            if len(changed) > MAX_INCREMENTAL_CHANGES:
+                break
+        else:
+            _refresh(_index, changed)
+            _index_version = version
+            return
+    _index = PrefixIndex(_load_rows())
+    _index_version = version
+
+
+def autocomplete_members(query, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Members whose association ID, CNIC or name (from any word on) starts with ``query``,
+    as ``(id, full_name, cnic, currency_association_id, status)`` rows in key order.
+
+    The lookup is a bisect over the sorted keys held in this process. The index is built
+    with one query on first use and then kept current from the change journal, so a lookup
+    costs one cache read unless members changed in the meantime.
+    """
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    version = journal_version()
+    with _lock:
+        if _index_version != version:
+            _catch_up(version)
+        return _index.lookup(prefix, limit)
+
+
+def _record_changes(member_ids):
+    global _index_version
+    try:
+        version = cache.incr(AUTOCOMPLETE_JOURNAL_KEY)
+    except ValueError:
+        # The journal was evicted, every process rebuilds
+        journal_version()
+        return
+    cache.set(_journal_entry_key(version), member_ids, JOURNAL_ENTRY_TIMEOUT)
+    with _lock:
+        # Applied here directly when this process was up to date, otherwise its next lookup catches up
+        if _index is not None and _index_version == version - 1:
+            if member_ids is None:
+                _catch_up(version)
+            else:
+                _refresh(_index, member_ids)
+                _index_version = version
+
+
+def members_changed(member_ids=None):
+    """
+    Record that the names, CNICs, association IDs or statuses of ``member_ids`` (every
+    member when None, or when there are too many to apply one by one) changed, once the
+    current transaction commits. Signals call it for single saves; bulk writes call it
+    themselves.
+    """
+    member_ids = None if member_ids is None else sorted(set(member_ids))
+    if member_ids is not None and len(member_ids) > MAX_INCREMENTAL_CHANGES:
+        member_ids = None
+    if member_ids != []:
+        transaction.on_commit(lambda: _record_changes(member_ids))
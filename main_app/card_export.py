@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import CardExport, Fee, Member
+from .pdfs import PdfNotAvailable, render_html, render_pdf
+
+logger = logging.getLogger(__name__)
+
+# Members rendered per pool task, and tasks in flight per process; together they bound
+# how many PDFs are held in memory at once
+CHUNK_SIZE = 20
+TASKS_PER_PROCESS = 2
+
+
+def render_cards(member_ids):
+    """
+    Render the member detail PDF of every member in ``member_ids``. Runs in a pool process
+    and returns ``([(filename, pdf bytes), ...], skipped)``.
+    """
+    members = list(
+        Member.objects.with_related().filter(id__in=member_ids).prefetch_related(
+            Prefetch('fee_set', queryset=Fee.objects.filter(fee_type='new registration').order_by('id'),
+                     to_attr='registration_fees'),
+        )
+    )
+    cards = []
+    for member in members:
+        try:
+            html = render_html(member, 'member_detail')
+        except PdfNotAvailable:
+            continue
+        cards.append((f'{member.id}-{slugify(member.full_name) or "member"}.pdf',
+                      render_pdf(html, 'CARD_EXPORT_PDF_RENDERER')))
+    # Members that do not qualify or were deleted since the export was requested
+    return cards, len(member_ids) - len(cards)
+
+
+def export_member_cards(member_ids, output, processes=None, progress=None):
+    """
+    Render the member detail PDF of each id in ``member_ids`` (any iterable, it is read
+    lazily) in a process pool and write them into the ZIP file ``output`` (a path or a
+    binary file) as they finish. Returns ``(written, skipped)``.
+
+    Only ``processes * TASKS_PER_PROCESS`` chunks are in flight at a time, so memory does
+    not grow with the number of members. ``progress(written, skipped)`` is called after
+    every chunk.
+    """
+    processes = processes or os.cpu_count() or 1
+    ids = iter(member_ids)
+    written = skipped = 0
+
+    def collect(finished):
+        nonlocal written, skipped
+        for future in finished:
+            cards, chunk_skipped = future.result()
+            for filename, pdf in cards:
+                archive.writestr(filename, pdf)
+            written += len(cards)
+            skipped += chunk_skipped
+            if progress:
+                progress(written, skipped)
+
+    # Spawned processes get their own database connections instead of sharing the parent's
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=django.setup) as executor, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        in_flight = set()
+        while chunk := list(islice(ids, CHUNK_SIZE)):
+            in_flight.add(executor.submit(render_cards, chunk))
+            if len(in_flight) >= processes * TASKS_PER_PROCESS:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(wait(in_flight).done)
+    return written, skipped
+
+
+def claim_next_export():
+    """Mark the oldest pending export as running and return it, or None when there is none."""
+    for export_id in CardExport.objects.filter(status='pending').order_by('created_at', 'id').values_list('id', flat=True)[:10]:
+        if CardExport.objects.filter(id=export_id, status='pending').update(status='running', started_at=timezone.now()):
+            return CardExport.objects.get(id=export_id)
+    return None
+
+
+def run_card_export(export, processes=None):
+    def progress(written, skipped):
+        CardExport.objects.filter(id=export.id).update(done=written, skipped=skipped)
+
+    # Build the ZIP on local disk and copy it into the media storage once complete
+    handle, path = tempfile.mkstemp(suffix='.zip')
+    os.close(handle)
+    fields = ['status', 'error', 'finished_at']
+    try:
+        export.done, export.skipped = export_member_cards(export.member_ids, path, processes, progress)
+        with open(path, 'rb') as archive:
+            # Stored under a random name in the private storage, see CardExport.file
+            export.file.save('member-cards.zip', File(archive), save=False)
+        export.status = 'done'
+        fields += ['done', 'skipped', 'file']
+    except Exception as exc:
+        logger.exception("Card export %s failed", export.id)
+        export.status = 'failed'
+        export.error = str(exc)
+    finally:
+        os.remove(path)
+    export.finished_at = timezone.now()
+    export.save(update_fields=fields)
+    return export
+
+
+def delete_expired_exports():
+    """Delete the ZIPs of exports finished more than ``CARD_EXPORT_MAX_AGE`` seconds ago, keeping the rows."""
+    cutoff = timezone.now() - timedelta(seconds=settings.CARD_EXPORT_MAX_AGE)
+    expired = CardExport.objects.filter(finished_at__lt=cutoff).exclude(file='').exclude(file=None)
+    for export in expired:
+        export.file.delete(save=False)
+        export.error = "Expired, the ZIP was deleted."
+        export.save(update_fields=['file', 'error'])
+    return len(expired)
@@ -0,0 +1,138 @@
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.dateparse import parse_date
+from django_countries import countries
+from django_countries.fields import CountryField
+
+from .models import Member, MemberChangeRequest
+from .reference_data import get_reference_data
+
+# Member fields a renewal may change. The renewal form posts them as ``new_<field>`` and
+# MemberChangeRequest keeps the proposed values in its ``new_<field>`` columns.
+CHANGE_FIELDS = (
+    'full_name', 'father_name', 'cnic', 'dob', 'gender', 'nic_type', 'country_of_stay',
+    'present_address', 'permanent_address', 'dual_citizen', 'other_citizenship', 'pri_mob',
+    'sec_mob', 'designation', 'business_name', 'business_address', 'district', 'tehsil',
+    'pri_land', 'sec_land', 'employee_number',
+)
+
+
+def _kind(field):
+    if isinstance(field, CountryField):
+        return 'country'
+    if field.is_relation:
+        return 'location'
+    if isinstance(field, models.DateField):
+        return 'date'
+    return 'text'
+
+
+# field -> (kind, Member attribute, MemberChangeRequest attribute), worked out once from the models
+FIELD_SPECS = {
+    name: (
+        _kind(Member._meta.get_field(name)),
+        Member._meta.get_field(name).attname,
+        MemberChangeRequest._meta.get_field(f'new_{name}').attname,
+    )
+    for name in CHANGE_FIELDS
+}
+
+
+def _locations(name):
+    data = get_reference_data()
+    return {row['id']: row for row in (data['districts'] if name == 'district' else data['tehsils'])}
+
+
+def parse_value(name, raw):
+    """
+    Convert posted text to the value stored for field ``name``: a date, an upper-case
+    country code, a district/tehsil id (checked against the cached reference data) or the
+    text itself. Raises ValidationError for values that cannot be stored.
+    """
+    kind = FIELD_SPECS[name][0]
+    if kind == 'date':
+        try:
+            value = parse_date(raw)
+        except ValueError:
+            value = None
+        if value is None:
+            raise ValidationError(f"{name}: '{raw}' is not a valid date.")
+        return value
+    if kind == 'country':
+        code = raw.strip().upper()
+        if not countries.name(code):
+            raise ValidationError(f"{name}: '{raw}' is not a valid country.")
+        return code
+    if kind == 'location':
+        locations = _locations(name)
+        if raw.isdigit() and int(raw) in locations:
+            return int(raw)
+        # Names are accepted too, that is what the review page shows
+        for location_id, location in locations.items():
+            if location['name'].casefold() == raw.strip().casefold():
+                return location_id
+        raise ValidationError(f"{name}: '{raw}' does not exist.")
+    return raw
+
+
+def display_value(name, value):
+    """How a stored value is shown in ``MemberChangeRequest.changes``."""
+    kind = FIELD_SPECS[name][0]
+    if value is None:
+        return None
+    if kind == 'date':
+        return value.isoformat()
+    if kind == 'location':
+        location = _locations(name).get(value)
+        return location['name'] if location else None
+    return str(value)
+
+
+def comparable(name, value):
+    # Country fields hold Country objects, which compare by code
+    if FIELD_SPECS[name][0] == 'country':
+        return str(value) if value else None
+    return value
+
+
+def diff_member(member, data):
+    """
+    Compare the ``new_<field>`` entries of ``data`` (the posted renewal form) with
+    ``member`` in one pass over ``CHANGE_FIELDS``.
+
+    Returns ``(changes, proposed)``: ``changes`` maps each changed field to
+    ``{'previous': ..., 'new': ...}`` display values, ``proposed`` maps every field to
+    the value the member would have after the change. Missing or empty entries leave the
+    field as it is.
+    """
+    changes = {}
+    proposed = {}
+    for name, (kind, member_attname, _) in FIELD_SPECS.items():
+        current = getattr(member, member_attname)
+        if kind == 'country':
+            current = comparable(name, current)
+        raw = data.get(f'new_{name}')
+        if not raw:
+            proposed[name] = current
+            continue
+        value = parse_value(name, raw)
+        proposed[name] = value
+        if value != current:
+            changes[name] = {'previous': display_value(name, current), 'new': display_value(name, value)}
+    return changes, proposed
+
+
+def build_change_request(member, fee, data):
+    """Unsaved MemberChangeRequest for ``member`` holding the changes posted in ``data``."""
+    changes, proposed = diff_member(member, data)
+    change_request = MemberChangeRequest(member=member, fee=fee, changes=changes)
+    for name, value in proposed.items():
+        setattr(change_request, FIELD_SPECS[name][2], value)
+    return change_request
+
+
+def edit_change(change_request, name, raw):
+    """Replace the proposed value of ``name`` with the one an admin typed on the review page."""
+    value = parse_value(name, raw)
+    setattr(change_request, FIELD_SPECS[name][2], value)
+    change_request.changes[name]['new'] = display_value(name, value)
@@ -1,9 +1,11 @@
-from .models import Member
+from .middleware import get_member
 
 
 def member_name(request):
     if request.user.is_authenticated:
-        # Get the authenticated user
-        member = Member.objects.get(user=request.user)
-        return {'member': member}  # Change to member.first_name or other fields as needed
-    return {}
\ No newline at end of file
+        # Lazy and shared with the view, so the member is queried at most once and only if used
+        member = getattr(request, 'member', None)
+        if member is None:
+            member = get_member(request)
+        return {'member': member}
+    return {}
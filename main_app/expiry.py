@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from .autocomplete import members_changed
+from .maps import invalidate_tehsils_map
+from .models import ExpirySweep, Member
+from .stats import apply_stats_deltas, member_stats_groups, membership_stats_drift, rebuild_membership_stats
+
+logger = logging.getLogger(__name__)
+
+# Members expired per UPDATE; every batch commits on its own
+EXPIRY_BATCH_SIZE = 5000
+
+# A sweep still marked running after this long was interrupted, a full sweep takes seconds
+STALE_SWEEP_AFTER = timedelta(minutes=30)
+
+# Day this process last saw a finished sweep, so worker loops check the table once a day
+_swept_on = None
+
+# The thread of start_expiry_runner, once per process
+_runner = None
+
+
+def calculate_member_till(joined_date):
+    """The naive datetime a membership started at ``joined_date`` runs until, ``member_till``."""
+    # Convert to naive datetime for comparison if needed
+    if timezone.is_aware(joined_date):
+        joined_date = timezone.make_naive(joined_date)
+
+    current_year = joined_date.year
+
+    # Define the comparison date as naive datetime
+    cutoff_date = datetime(current_year, 9, 30)
+
+    if current_year % 2 == 0:
+        # If it's an even year
+        if joined_date <= cutoff_date:
+            member_till = datetime(current_year + 2, 10, 31)
+        else:
+            member_till = datetime(current_year + 2, 10, 31)
+    else:
+        # If it's an odd year
+        member_till = datetime(current_year + 1, 10, 31)
+
+    # Return the calculated member till date as a naive datetime
+    return member_till
+
+
+def expired_members(cutoff):
+    """Active members whose membership ran out before ``cutoff``, found through member_status_till_idx."""
+    return Member.objects.filter(status='active', member_till__lt=cutoff)
+
+
+def sweep_expired_members(cutoff=None, batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Set every active member whose ``member_till`` is before ``cutoff`` (today by default)
+    to ``expired`` and record the run as an ExpirySweep.
+
+    Each batch reads the ids of up to ``batch_size`` expired members and sets them to
+    ``expired`` with one ``UPDATE ... WHERE id IN (...) AND status = 'active' AND
+    member_till < cutoff``, committed together with the sweep's counters and the matching
+    MembershipStats changes. The batch holds the write lock (SQLite) or its rows' locks
+    from the read on, so sweeps running at the same time never expire, or count, a member
+    twice. An interrupted sweep keeps the batches it finished and the next run expires
+    the rest.
+    """
+    cutoff = cutoff or timezone.localdate()
+    close_stale_sweeps()
+    sweep = ExpirySweep.objects.create(cutoff=cutoff)
+    try:
+        while True:
+            with transaction.atomic():
+                # Writing first makes SQLite take its write lock before the batch is read
+                ExpirySweep.objects.filter(pk=sweep.pk).update(status='running')
+                ids = list(expired_members(cutoff).select_for_update(skip_locked=True)
+                           .order_by('pk').values_list('pk', flat=True)[:batch_size])
+                members = Member.objects.filter(pk__in=ids, status='active', member_till__lt=cutoff)
+                # The batch's stats rows move from active to expired, grouped before the UPDATE
+                groups = member_stats_groups(members)
+                count = members.update(status='expired')
+                if count != sum(groups.values()):
+                    # Changed in between after all; the rollback keeps the stats right
+                    raise DatabaseError(
+                        f"Expected to expire {sum(groups.values())} members, the UPDATE changed {count}.")
+                deltas = Counter()
+                for (day, district_id, tehsil_id, _), expired in groups.items():
+                    deltas[day, district_id, tehsil_id, 'active'] -= expired
+                    deltas[day, district_id, tehsil_id, 'expired'] += expired
+                apply_stats_deltas(deltas)
+                if count:
+                    sweep.expired += count
+                    sweep.batches += 1
+                    ExpirySweep.objects.filter(pk=sweep.pk).update(expired=sweep.expired, batches=sweep.batches)
+            if len(ids) < batch_size:
+                break
+    except Exception as e:
+        sweep.status = 'failed'
+        sweep.error = str(e)
+        raise
+    else:
+        sweep.status = 'done'
+    finally:
+        sweep.finished_at = timezone.now()
+        sweep.save(update_fields=['status', 'error', 'finished_at'])
+        if sweep.expired:
+            # update() sends no post_save signals
+            invalidate_tehsils_map()
+            members_changed()
+    logger.info("Expired %d members with member_till before %s in %d batches.", sweep.expired, cutoff, sweep.batches)
+    return sweep
+
+
+def close_stale_sweeps():
+    """Mark sweeps left running by a process that died as failed."""
+    return ExpirySweep.objects.filter(status='running', started_at__lt=timezone.now() - STALE_SWEEP_AFTER).update(
+        status='failed', error="Interrupted, the sweep never finished.", finished_at=timezone.now())
+
+
+def sweep_if_due():
+    """
+    Run today's sweep, then refresh_membership_stats, unless one already finished, or another
+    process is running it right now. Cheap enough to call from a loop.
+    """
+    global _swept_on
+    today = timezone.localdate()
+    if _swept_on == today:
+        return None
+    if ExpirySweep.objects.filter(cutoff=today, status='done').exists():
+        _swept_on = today
+        return None
+    if ExpirySweep.objects.filter(cutoff=today, status='running',
+                                  started_at__gte=timezone.now() - STALE_SWEEP_AFTER).exists():
+        # Checked again on the next call, by then it has finished
+        return None
+    try:
+        sweep = sweep_expired_members(today)
+    finally:
+        # A failed sweep is recorded and not retried in a loop; the command can run it again
+        _swept_on = today
+    refresh_membership_stats()
+    return sweep
+
+
+def refresh_membership_stats():
+    """
+    Rebuild the MembershipStats rollup, logging how far it had drifted. Run once a day after
+    the expiry sweep, as writes the member signals miss would otherwise stay in it for good.
+    """
+    drift = membership_stats_drift()
+    if drift:
+        logger.warning("Membership stats drifted from the members table, (rollup, live) per status: %s", drift)
+    rebuild_membership_stats()
+
+
+def _run_periodically(interval):
+    while True:
+        try:
+            sweep_if_due()
+        except Exception:
+            logger.exception("Membership expiry sweep failed")
+        finally:
+            # The thread keeps its connection between checks hours apart
+            close_old_connections()
+        time.sleep(interval)
+
+
+def start_expiry_runner(interval=None):
+    """
+    Check every ``interval`` seconds (EXPIRY_SWEEP_INTERVAL by default, None or 0 disables
+    it) in a daemon thread whether today's sweep is due. The server entry points in wsgi.py
+    and asgi.py start it; calling it again in the same process does nothing.
+    """
+    global _runner
+    interval = settings.EXPIRY_SWEEP_INTERVAL if interval is None else interval
+    if interval and _runner is None:
+        _runner = threading.Thread(target=_run_periodically, args=(interval,), name='expiry-sweep', daemon=True)
+        _runner.start()
+    return _runner
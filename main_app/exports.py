@@ -0,0 +1,225 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Fee
+
+# (header, values_list lookup); the registration fee columns are annotated by member_export_rows
+MEMBER_EXPORT_COLUMNS = (
+    ('ID', 'id'),
+    ('CEA ID', 'user__currency_association_id'),
+    ('Application ID', 'application_id'),
+    ('Full Name', 'full_name'),
+    ('Father Name', 'father_name'),
+    ('CNIC', 'cnic'),
+    ('NIC Type', 'nic_type'),
+    ('Date of Birth', 'dob'),
+    ('Gender', 'gender'),
+    ('Primary Phone', 'pri_mob'),
+    ('Secondary Phone', 'sec_mob'),
+    ('Business Name', 'business_name'),
+    ('Designation', 'designation'),
+    ('Business Address', 'business_address'),
+    ('District', 'district__name'),
+    ('Tehsil', 'tehsil__name'),
+    ('Status', 'status'),
+    ('Approved', 'is_approved'),
+    ('Created', 'created_at'),
+    ('Joined', 'joined_at'),
+    ('Member Till', 'member_till'),
+    ('Registration Fee Submitted', 'registration_amount_submitted'),
+    ('Registration Fee Remaining', 'registration_amount_remaining'),
+    ('Registration Fee Approved', 'registration_fee_approved'),
+)
+CNIC_COLUMN = [lookup for _, lookup in MEMBER_EXPORT_COLUMNS].index('cnic')
+
+EXPORT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def can_see_full_cnic(user):
+    return user.is_superuser or user.role == 'admin'
+
+
+def mask_cnic(cnic):
+    # Same rule as the admin's "CNIC Last 4 Digits" column
+    if not cnic:
+        return cnic
+    return '*' * (len(cnic) - 4) + cnic[-4:]
+
+
+def member_export_rows(queryset, full_cnic=False):
+    """
+    Yield one tuple per member of ``queryset`` with the ``MEMBER_EXPORT_COLUMNS`` values.
+
+    Rows come from ``values_list`` through a chunked server-side iterator, so no model
+    instances are built and memory does not depend on the number of members.
+    """
+    registration_fee = Fee.objects.filter(member=OuterRef('pk'), fee_type='new registration').order_by('id')
+    rows = (
+        queryset
+        .annotate(
+            registration_amount_submitted=Subquery(registration_fee.values('amount_submitted')[:1]),
+            registration_amount_remaining=Subquery(registration_fee.values('amount_remaining')[:1]),
+            registration_fee_approved=Subquery(registration_fee.values('is_approved')[:1]),
+        )
+        .order_by('id')
+        .values_list(*[lookup for _, lookup in MEMBER_EXPORT_COLUMNS])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    for row in rows:
+        if not full_cnic:
+            row = row[:CNIC_COLUMN] + (mask_cnic(row[CNIC_COLUMN]),) + row[CNIC_COLUMN + 1:]
+        yield row
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    """File-like object that hands back what is written, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_text(value):
+    text = _text(value)
+    # Keep spreadsheets from evaluating user-entered text as a formula; numbers, amounts and
+    # dates are written as they are, so a negative amount stays a number
+    if isinstance(value, str) and text[:1] in ('=', '+', '-', '@'):
+        return "'" + text
+    return text
+
+
+def stream_csv(headers, rows):
+    writer = csv.writer(_Echo())
+    # The byte order mark makes Excel read the Urdu names as UTF-8
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([_csv_text(value) for value in row])
+
+
+class _ChunkBuffer:
+    """Write-only, unseekable file that zipfile writes into and the response drains."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Members" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Control characters are not allowed in XML
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', _text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def stream_xlsx(headers, rows, rows_per_chunk=500):
+    """
+    Yield an .xlsx workbook with one sheet in pieces. The sheet XML is deflated straight
+    into an unseekable buffer (zipfile then writes data descriptors instead of seeking
+    back), which is drained every ``rows_per_chunk`` rows.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for number, row in enumerate(chain([headers], rows), start=1):
+                sheet.write(f'<row r="{number}">{"".join(_xlsx_cell(value) for value in row)}</row>'.encode())
+                if number % rows_per_chunk == 0:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+def member_export_response(queryset, user, file_format='csv'):
+    """Streaming download of ``queryset`` as CSV or XLSX, CNIC masked unless ``user`` is an admin."""
+    headers = [header for header, _ in MEMBER_EXPORT_COLUMNS]
+    rows = member_export_rows(queryset, full_cnic=can_see_full_cnic(user))
+    content = stream_xlsx(headers, rows) if file_format == 'xlsx' else stream_csv(headers, rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    filename = f'members-{timezone.localdate():%Y-%m-%d}.{file_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -4,23 +4,12 @@ from .models import *
 from django_countries.fields import CountryField
 from django_countries import countries
 
+from .sequences import currency_association_ids, format_currency_association_id
 
-def generate_currency_association_id():
-    # Get the last user with a currency_association_id starting with 'CEA-'
-    last_user = User.objects.filter(currency_association_id__startswith='CEA-').order_by(
-        'currency_association_id').last()
-
-    if last_user:
-        # Extract the numeric part and increment it
-        last_id = last_user.currency_association_id
-        numeric_part = int(last_id.split('-')[1])
-        new_numeric_part = numeric_part + 1
-        new_currency_association_id = f'CEA-{new_numeric_part:04d}'  # Keep 4 digits
-    else:
-        # Start at CEA-0200 if no users exist
-        new_currency_association_id = 'CEA-0200'
 
-    return new_currency_association_id
+def generate_currency_association_id():
+    # Numbers come from an atomic sequence (see sequences.py), starting at CEA-0200
+    return format_currency_association_id(currency_association_ids.next())
 
 
 class MemberForm(forms.ModelForm):
@@ -190,4 +179,19 @@ class FeeRenewalForm(forms.ModelForm):
 class MemberChangeRequestForm(forms.ModelForm):
     class Meta:
         model = Member
-        fields = '__all__' #  Include fields that can be changed
\ No newline at end of file
+        fields = '__all__' #  Include fields that can be changed
+
+class MemberImportUploadForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX with MemberForm field names as headers, plus district and tehsil "
+                                     "names and optionally submission_method, amount_submitted, amount_remaining "
+                                     "and transaction_id for the registration fee.")
+    payment = forms.ModelChoiceField(queryset=Payment.objects.all(), required=False,
+                                     help_text="Payment account the imported fees were paid into.")
+    approve = forms.BooleanField(required=False, help_text="Import the members as approved and active.")
+    dry_run = forms.BooleanField(required=False, initial=True, help_text="Only validate, save nothing.")
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Upload a .csv or .xlsx file.")
+        return upload
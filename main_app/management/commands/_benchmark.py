@@ -0,0 +1,81 @@
+"""Helpers shared by the benchmark_* management commands."""
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.utils import timezone
+
+from main_app.models import District, Fee, Member, MemberChangeRequest, Payment, Tehsil, User
+from main_app.stats import rebuild_membership_stats
+
+SEED_PREFIX = 'BENCH-'
+
+
+def seed_members(count, batch_size=5000, districts=10, tehsils_per_district=8, stdout=None):
+    """
+    Bulk insert ``count`` members (with users, a registration fee and a change request for
+    every tenth member) spread over generated districts and tehsils, and rebuild the
+    MembershipStats rollup for them. Meant to run inside a transaction that the benchmark
+    rolls back.
+    """
+    rng = random.Random(42)
+    now = timezone.now()
+    payment = Payment.objects.create(submission_method='cash', title='Benchmark')
+    district_objs = District.objects.bulk_create([District(name=f'{SEED_PREFIX}District {i}') for i in range(districts)])
+    tehsil_objs = Tehsil.objects.bulk_create([
+        Tehsil(name=f'{SEED_PREFIX}Tehsil {d}-{t}', district=district,
+               latitude=33 + rng.random(), longitude=73 + rng.random())
+        for d, district in enumerate(district_objs) for t in range(tehsils_per_district)
+    ])
+
+    for start in range(0, count, batch_size):
+        numbers = range(start, min(start + batch_size, count))
+        users = User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}{n}', currency_association_id=f'{SEED_PREFIX}{n}', role='member')
+            for n in numbers
+        ])
+        members = []
+        for n, user in zip(numbers, users):
+            tehsil = rng.choice(tehsil_objs)
+            status = rng.choices(['active', 'pending', 'suspended'], weights=[80, 15, 5])[0]
+            created_at = now - timedelta(days=rng.randint(0, 5 * 365))
+            joined_at = created_at + timedelta(days=rng.randint(0, 30)) if status != 'pending' else None
+            members.append(Member(
+                user=user, full_name=f'Member {n}', father_name=f'Father {n}', cnic=f'9{n:012d}',
+                dob=date(1960, 1, 1) + timedelta(days=rng.randint(0, 15000)), gender='male', nic_type='cnic',
+                present_address='-', permanent_address='-', pri_mob='03000000000', business_name=f'Business {n}',
+                business_address='-', employee_number='1', tehsil=tehsil, district_id=tehsil.district_id,
+                status=status, is_approved=status != 'pending', joined_at=joined_at, created_at=created_at,
+                member_till=(joined_at.date() + timedelta(days=730)) if joined_at else None,
+            ))
+        created = [member.created_at for member in members]
+        members = Member.objects.bulk_create(members)
+        # created_at is auto_now_add, which bulk_create overwrites, so put the spread back
+        for member, created_at in zip(members, created):
+            member.created_at = created_at
+        Member.objects.bulk_update(members, ['created_at'], batch_size=500)
+        fees = Fee.objects.bulk_create([
+            Fee(member=member, fee_type='new registration', submission_method='cash', amount_submitted=45000,
+                amount_remaining=0, payment=payment, is_approved=member.status != 'pending')
+            for member in members
+        ])
+        MemberChangeRequest.objects.bulk_create([
+            MemberChangeRequest(member=member, fee=fee, is_approved=rng.random() < 0.7)
+            for member, fee in zip(members[::10], fees[::10])
+        ])
+        if stdout:
+            stdout.write(f"Seeded {min(start + batch_size, count)}/{count} members")
+    # bulk_create sends no signals, so the rollup the dashboard and the map read is still empty
+    rebuild_membership_stats()
+    return district_objs, tehsil_objs
+
+
+def time_call(func, repeat=5):
+    """Run ``func`` ``repeat`` times and return the median duration in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
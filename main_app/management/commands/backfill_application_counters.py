@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_app.models import ApplicationIdCounter
+from main_app.sequences import application_ids_in_use, parse_application_id
+
+
+class Command(BaseCommand):
+    help = "Seed the per fee type, per year application ID counters from existing application IDs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report the counters without saving them.")
+
+    def handle(self, *args, **options):
+        highest = {}
+        skipped = 0
+        for application_id in application_ids_in_use():
+            parsed = parse_application_id(application_id)
+            if parsed is None:
+                skipped += 1
+                continue
+            fee_code, year, number = parsed
+            highest[fee_code, year] = max(highest.get((fee_code, year), 0), number)
+
+        with transaction.atomic():
+            existing = {
+                (counter.fee_code, counter.year): counter
+                for counter in ApplicationIdCounter.objects.select_for_update()
+            }
+            to_create, to_update = [], []
+            for (fee_code, year), number in sorted(highest.items()):
+                counter = existing.get((fee_code, year))
+                if counter is None:
+                    to_create.append(ApplicationIdCounter(fee_code=fee_code, year=year, last_value=number))
+                elif counter.last_value < number:
+                    # Never move a counter backwards
+                    counter.last_value = number
+                    to_update.append(counter)
+                self.stdout.write(f"{fee_code}-{year}: {number}")
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            else:
+                ApplicationIdCounter.objects.bulk_create(to_create)
+                ApplicationIdCounter.objects.bulk_update(to_update, ['last_value'])
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {skipped} application IDs in an unknown format."))
+        action = "Would create" if options['dry_run'] else "Created"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {len(to_create)} counters and {'would update' if options['dry_run'] else 'updated'} "
+            f"{len(to_update)}."
+        ))
@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main_app.maps import build_tehsils_geojson, tehsil_member_counts
+from main_app.models import Fee, Member, MemberChangeRequest, MembershipStats
+from main_app.stats import add_months, month_start, monthly_status_counts, monthly_status_totals
+
+from ._benchmark import seed_members, time_call
+
+INDEXED_MODELS = (Member, Fee, MemberChangeRequest, MembershipStats)
+
+
+class Command(BaseCommand):
+    help = ("Seed members into a rolled-back transaction and report query plans and timings of the "
+            "hot queries with and without the indexes declared on Member, Fee, MemberChangeRequest and "
+            "MembershipStats.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def hot_queries(self):
+        today = date.today()
+        member = Member.objects.order_by('id').last()
+        tehsil_id = member.tehsil_id
+        return {
+            'dashboard counters': (
+                lambda: monthly_status_counts(today - timedelta(days=31), today),
+                # The query monthly_status_counts runs for that range
+                monthly_status_totals(month_start(today - timedelta(days=31)), add_months(month_start(today), 1)),
+            ),
+            'member table, active, newest first': (
+                lambda: list(Member.objects.filter(status='active').order_by('-created_at', '-id')[:25]),
+                Member.objects.filter(status='active').order_by('-created_at', '-id')[:25],
+            ),
+            'active members of a tehsil': (
+                lambda: Member.objects.filter(status='active', tehsil_id=tehsil_id).count(),
+                Member.objects.filter(status='active', tehsil_id=tehsil_id),
+            ),
+            'tehsils map': (
+                build_tehsils_geojson,
+                tehsil_member_counts(),
+            ),
+            'registration fee of a member': (
+                lambda: Fee.objects.filter(fee_type='new registration', member=member).first(),
+                Fee.objects.filter(fee_type='new registration', member=member),
+            ),
+            'approved renewal fees': (
+                lambda: Fee.objects.filter(fee_type='renewal', is_approved=True).count(),
+                Fee.objects.filter(fee_type='renewal', is_approved=True),
+            ),
+            'pending change requests': (
+                lambda: list(MemberChangeRequest.objects.filter(is_approved=False, is_rejected=False)[:50]),
+                MemberChangeRequest.objects.filter(is_approved=False, is_rejected=False),
+            ),
+        }
+
+    def explain(self, queryset, phase):
+        if connection.vendor != 'sqlite':
+            return queryset.explain()
+        # sqlite3 caches prepared statements by SQL text and would report the plan it made
+        # before the indexes were dropped, so tag the statement with the phase
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql} /* {phase} */', params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def measure(self, repeat, phase):
+        results = {}
+        for name, (run, plan_queryset) in self.hot_queries().items():
+            results[name] = (time_call(run, repeat), self.explain(plan_queryset, phase))
+        return results
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            seed_members(options['members'], stdout=self.stdout)
+            with connection.cursor() as cursor:
+                if connection.vendor == 'sqlite':
+                    cursor.execute('ANALYZE')
+            after = self.measure(options['repeat'], 'indexed')
+            self.drop_indexes()
+            before = self.measure(options['repeat'], 'unindexed')
+            # Nothing seeded or dropped is kept
+            transaction.set_rollback(True)
+
+        for name in after:
+            before_ms, before_plan = before[name]
+            after_ms, after_plan = after[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  without indexes: {before_ms:9.2f} ms  {before_plan}")
+            self.stdout.write(f"  with indexes:    {after_ms:9.2f} ms  {after_plan}")
@@ -0,0 +1,121 @@
+import multiprocessing
+import shutil
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RENDERERS = {
+    'wkhtmltopdf': {'BACKEND': 'main_app.pdf_renderers.WkhtmltopdfRenderer'},
+    'card': {'BACKEND': 'main_app.pdf_renderers.CardLayoutRenderer'},
+    'pool-card': {
+        'BACKEND': 'main_app.pdf_renderers.ProcessPoolRenderer',
+        'OPTIONS': {'backend': 'main_app.pdf_renderers.CardLayoutRenderer'},
+    },
+}
+
+
+def measure(config, documents):
+    # Runs in a fresh process, so the peak RSS belongs to this renderer alone
+    django.setup()
+    started = time.perf_counter()
+    renderer = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    # The first PDF pays for starting the renderer, keep it out of the percentiles
+    renderer.render(documents[0])
+    cold = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    for html in documents[1:]:
+        started = time.perf_counter()
+        renderer.render(html)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    # Tracing slows rendering down, so allocations are measured in a separate pass
+    allocations = []
+    tracemalloc.start()
+    for html in documents[1:21]:
+        tracemalloc.reset_peak()
+        snapshot = tracemalloc.get_traced_memory()[0]
+        renderer.render(html)
+        allocations.append(tracemalloc.get_traced_memory()[1] - snapshot)
+    tracemalloc.stop()
+    renderer.close()
+
+    peak_rss = None
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux; children covers wkhtmltopdf and pool processes
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'cold': cold,
+        'p50': statistics.median(latencies),
+        'p99': statistics.quantiles(latencies, n=100, method='inclusive')[98],
+        'allocated': statistics.median(allocations) / 1024,
+        'peak_rss': peak_rss,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare latency and memory per PDF of the PDF renderers on generated pdf.html documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help="PDFs rendered per renderer.")
+        parser.add_argument('--renderer', action='append', choices=sorted(RENDERERS), dest='renderers',
+                            help="Renderer to measure, can be repeated. Defaults to every available one.")
+
+    def documents(self, count):
+        from main_app.models import District, Fee, Member, Tehsil
+        from main_app.sequences import FEE_TYPE_CODES, format_application_id
+
+        district = District(name='Muzaffarabad')
+        tehsil = Tehsil(name='Muzaffarabad', district=district)
+        documents = []
+        year = timezone.now().year
+        for number in range(count):
+            member = Member(
+                full_name=f'Member {number}', father_name='Father', cnic=f'{number:013d}', dob=date(1990, 1, 1),
+                gender='male', nic_type='cnic', country_of_stay='PK', present_address=f'House {number}, Main Bazar',
+                permanent_address=f'House {number}, Main Bazar', pri_mob='03000000000', business_name='Exchange',
+                business_address='Main Bazar', employee_number='3', tehsil=tehsil, district=district,
+            )
+            fee = Fee(member=member, fee_type='new registration', submission_method='cash',
+                      amount_submitted=Decimal('5000'), amount_remaining=Decimal('0'), transaction_id=f'TX{number}')
+            documents.append(render_to_string('pdf.html', {
+                'member': member, 'fee': fee, 'application_id': format_application_id(FEE_TYPE_CODES[fee.fee_type], year, number + 1),
+                'submission_date': timezone.now(),
+            }))
+        return documents
+
+    def handle(self, *args, **options):
+        names = options['renderers']
+        if not names:
+            names = ['card', 'pool-card']
+            if shutil.which(settings.WKHTMLTOPDF_CMD):
+                names = ['wkhtmltopdf'] + names
+            else:
+                self.stdout.write(f"{settings.WKHTMLTOPDF_CMD} not found, skipping the wkhtmltopdf renderer.")
+
+        documents = self.documents(max(options['count'], 2) + 1)
+        self.stdout.write(f"{'renderer':<18}{'first':>10}{'p50':>10}{'p99':>10}{'alloc/PDF':>12}{'peak RSS':>12}")
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(measure, RENDERERS[name], documents).result()
+            peak_rss = f"{result['peak_rss'] / 1024:.1f} MB" if result['peak_rss'] is not None else '-'
+            self.stdout.write(
+                f"{name:<18}{result['cold']:>7.1f} ms{result['p50']:>7.1f} ms{result['p99']:>7.1f} ms"
+                f"{result['allocated']:>9.0f} KB{peak_rss:>12}"
+            )
@@ -0,0 +1,34 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from main_app.expiry import EXPIRY_BATCH_SIZE, sweep_expired_members, sweep_if_due
+
+
+class Command(BaseCommand):
+    help = "Expire active members whose member_till has passed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cutoff', type=date.fromisoformat,
+                            help="Expire members with member_till before this day (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE, help="Members expired per UPDATE.")
+        parser.add_argument('--every', type=float,
+                            help="Keep running and check every this many seconds whether today's sweep is due.")
+
+    def handle(self, *args, **options):
+        if options['every']:
+            while True:
+                sweep = sweep_if_due()
+                if sweep is not None:
+                    self.report(sweep)
+                time.sleep(options['every'])
+
+        self.report(sweep_expired_members(options['cutoff'], options['batch_size']))
+
+    def report(self, sweep):
+        seconds = (sweep.finished_at - sweep.started_at).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {sweep.expired} members with member_till before {sweep.cutoff} "
+            f"in {sweep.batches} batches ({seconds:.2f}s)."
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from main_app.card_export import export_member_cards
+from main_app.models import Member
+
+
+class Command(BaseCommand):
+    help = "Write the member detail PDFs of the selected members into a ZIP file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the ZIP file to write.")
+        parser.add_argument('--status', default='active', help="Member status to export, 'all' for every member.")
+        parser.add_argument('--district', type=int, help="Only members of this district id.")
+        parser.add_argument('--tehsil', type=int, help="Only members of this tehsil id.")
+        parser.add_argument('--processes', type=int, help="Renderer processes, defaults to the number of CPUs.")
+
+    def handle(self, *args, **options):
+        members = Member.objects.all()
+        if options['status'] != 'all':
+            members = members.filter(status=options['status'])
+        if options['district']:
+            members = members.filter(district_id=options['district'])
+        if options['tehsil']:
+            members = members.filter(tehsil_id=options['tehsil'])
+        total = members.count()
+        member_ids = members.order_by('id').values_list('id', flat=True).iterator(chunk_size=2000)
+
+        reported = 0
+
+        def progress(written, skipped):
+            nonlocal reported
+            if written + skipped - reported >= 500 or written + skipped == total:
+                reported = written + skipped
+                self.stdout.write(f"{reported}/{total} members, {skipped} skipped")
+
+        written, skipped = export_member_cards(member_ids, options['output'], options['processes'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} PDFs to {options['output']}, skipped {skipped} members without an approved registration."
+        ))
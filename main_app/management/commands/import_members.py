@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.member_import import IMPORT_CHUNK_SIZE, MemberImporter, read_rows
+from main_app.models import Payment
+
+
+class Command(BaseCommand):
+    help = "Import members (with their registration fee) from a CSV or XLSX roster."
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="CSV or XLSX file with one member per row and MemberForm field names as headers.")
+        parser.add_argument('--dry-run', action='store_true', help="Validate every row without saving anything.")
+        parser.add_argument('--approve', action='store_true',
+                            help="Import the members as approved and active, and their fees as approved.")
+        parser.add_argument('--payment', type=int, help="Payment account id the imported fees were paid into.")
+        parser.add_argument('--report', help="Where to write the CSV of failed rows, defaults to <file>.errors.csv.")
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        payment = None
+        if options['payment']:
+            try:
+                payment = Payment.objects.get(id=options['payment'])
+            except Payment.DoesNotExist:
+                raise CommandError(f"Payment {options['payment']} does not exist.")
+
+        importer = MemberImporter(payment=payment, approve=options['approve'], dry_run=options['dry_run'],
+                                  chunk_size=options['chunk_size'])
+
+        def progress(result):
+            self.stdout.write(f"{result.created + result.failed} rows, {result.failed} failed")
+
+        with open(options['file'], 'rb') as roster:
+            result = importer.run(read_rows(roster, options['file']), progress=progress)
+
+        verb = "Would create" if options['dry_run'] else "Created"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {result.created} members and {result.fees} fees."))
+        if result.errors:
+            report = options['report'] or f"{os.path.splitext(options['file'])[0]}.errors.csv"
+            with open(report, 'w', newline='', encoding='utf-8') as report_file:
+                result.write_report(report_file)
+            self.stdout.write(self.style.WARNING(f"{result.failed} rows failed, see {report}."))
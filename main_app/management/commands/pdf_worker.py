@@ -0,0 +1,40 @@
+import multiprocessing
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main_app.pdfs import work
+
+
+def run_worker(poll_interval, burst):
+    # Spawned processes (Windows) start without Django set up
+    django.setup()
+    work(poll_interval=poll_interval, burst=burst)
+
+
+class Command(BaseCommand):
+    help = "Render queued PDF jobs and card exports in one or more local worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="Number of worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait before checking an empty queue again.")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            processed = work(poll_interval=options['poll_interval'], burst=options['burst'])
+            self.stdout.write(f"Processed {processed} PDF jobs and card exports.")
+            return
+
+        # Database connections must not be shared with the child processes
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(options['poll_interval'], options['burst']))
+            for _ in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
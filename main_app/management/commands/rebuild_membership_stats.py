@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.stats import membership_stats_drift, rebuild_membership_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the MembershipStats rollup from the members table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only compare the rollup's totals with the members table, fail if they differ.")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = membership_stats_drift()
+            if drift:
+                raise CommandError("Membership stats drifted: " + ', '.join(
+                    f"{status} {rollup} counted, {live} members" for status, (rollup, live) in drift.items()))
+            self.stdout.write(self.style.SUCCESS("Membership stats match the members table."))
+            return
+        rows = rebuild_membership_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt membership stats: {rows} rows."))
@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import Tehsil
+
+TEHSILS_MAP_CACHE_KEY = 'tehsils_map'
+
+
+def tehsil_member_counts():
+    """The tehsils with coordinates and active members, with their ``member_count`` summed from the MembershipStats rollup."""
+    return (
+        Tehsil.objects
+        .filter(latitude__isnull=False, longitude__isnull=False)
+        .annotate(member_count=Sum('membership_stats__count', filter=Q(membership_stats__status='active')))
+        .filter(member_count__gt=0)
+        .values('id', 'name', 'district__name', 'latitude', 'longitude', 'member_count')
+        .order_by('id')
+    )
+
+
+def build_tehsils_geojson():
+    """
+    GeoJSON FeatureCollection of the tehsils with active members, from a single grouped query
+    over the MembershipStats rollup instead of the members table.
+    """
+    tehsils = tehsil_member_counts()
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': tehsil['id'],
+                'geometry': {
+                    'type': 'Point',
+                    # GeoJSON positions are [longitude, latitude]
+                    'coordinates': [float(tehsil['longitude']), float(tehsil['latitude'])],
+                },
+                'properties': {
+                    'name': tehsil['name'],
+                    'district': tehsil['district__name'],
+                    'member_count': tehsil['member_count'],
+                },
+            }
+            for tehsil in tehsils
+        ],
+    }
+
+
+def get_tehsils_map():
+    """
+    Return the cached map payload: ``{'body': bytes, 'etag': str, 'last_modified': datetime}``.
+    It is rebuilt on the first request after ``invalidate_tehsils_map`` runs.
+    """
+    payload = cache.get(TEHSILS_MAP_CACHE_KEY)
+    if payload is None:
+        body = json.dumps(build_tehsils_geojson(), separators=(',', ':')).encode()
+        payload = {
+            'body': body,
+            'etag': hashlib.md5(body).hexdigest(),
+            'last_modified': timezone.now().replace(microsecond=0),
+        }
+        cache.set(TEHSILS_MAP_CACHE_KEY, payload, None)
+    return payload
+
+
+def invalidate_tehsils_map():
+    cache.delete(TEHSILS_MAP_CACHE_KEY)
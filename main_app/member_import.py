@@ -0,0 +1,341 @@
+import csv
+import functools
+import io
+import re
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from django import forms
+from django.db import transaction
+from django.utils import timezone
+from django_countries import countries
+
+from .autocomplete import members_changed
+from .expiry import calculate_member_till
+from .forms import MemberForm
+from .maps import invalidate_tehsils_map
+from .models import District, Fee, Member, Tehsil, User
+from .sequences import (FEE_TYPE_CODES, currency_association_ids, format_application_id,
+                        format_currency_association_id, reserve_application_numbers)
+from .stats import record_member_transitions
+
+# Rows validated and written per transaction
+IMPORT_CHUNK_SIZE = 500
+
+MEMBER_COLUMNS = [field for field in MemberForm.Meta.fields if field not in ('tehsil', 'district')]
+FEE_COLUMNS = ['submission_method', 'amount_submitted', 'amount_remaining', 'transaction_id']
+IMPORT_COLUMNS = MEMBER_COLUMNS + ['district', 'tehsil'] + FEE_COLUMNS
+
+
+@functools.cache
+def country_codes():
+    return frozenset(countries.countries)
+
+
+@functools.cache
+def country_by_name(name):
+    # by_name scans every translated country name
+    return countries.by_name(name)
+
+
+class MemberImportForm(MemberForm):
+    """
+    MemberForm without the per-row database work: locations and uniqueness are checked per
+    batch. Country codes are checked against a set built once, django_countries would build
+    and translate its whole choice list for every field of every row.
+    """
+    country_of_stay = forms.CharField(initial='PK')
+    other_citizenship = forms.CharField(required=False)
+
+    class Meta(MemberForm.Meta):
+        fields = MEMBER_COLUMNS
+
+    def _clean_country(self, name):
+        code = self.cleaned_data[name].upper()
+        if code and code not in country_codes():
+            raise forms.ValidationError(f"Unknown country '{self.cleaned_data[name]}'.")
+        return code or None
+
+    def clean_country_of_stay(self):
+        return self._clean_country('country_of_stay')
+
+    def clean_other_citizenship(self):
+        return self._clean_country('other_citizenship')
+
+    def _get_validation_exclusions(self):
+        # Already checked against country_codes()
+        return super()._get_validation_exclusions() | {'country_of_stay', 'other_citizenship'}
+
+    def validate_unique(self):
+        pass
+
+
+class FeeImportForm(forms.ModelForm):
+    class Meta:
+        model = Fee
+        fields = FEE_COLUMNS
+
+
+# Columns whose choices are stored in lower case
+CHOICE_COLUMNS = ('gender', 'nic_type', 'dual_citizen', 'submission_method')
+
+
+def _normalize(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def prepare_row(row):
+    """Turn the spellings found in rosters (``Male``, ``Pakistan``, Excel dates) into form input."""
+    row = dict(row)
+    for column in CHOICE_COLUMNS:
+        if row.get(column):
+            row[column] = row[column].lower()
+    for column in ('country_of_stay', 'other_citizenship'):
+        if len(row.get(column) or '') > 2:
+            row[column] = country_by_name(row[column]) or row[column]
+    row['country_of_stay'] = row.get('country_of_stay') or 'PK'
+    dob = row.get('dob') or ''
+    if dob.isdigit() and len(dob) <= 5:
+        row['dob'] = (date(1899, 12, 30) + timedelta(days=int(dob))).isoformat()
+    return row
+
+
+# Excel stores dates as days since 1899-12-30 and long numbers like CNICs as floats
+_EXCEL_NUMBER = re.compile(r'^-?\d+(\.\d+)?(E[+-]?\d+)?$', re.IGNORECASE)
+
+
+def _xlsx_value(value):
+    if value and _EXCEL_NUMBER.match(value):
+        number = Decimal(value)
+        if number == number.to_integral_value():
+            return str(int(number))
+    return value
+
+
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_DOC_RELS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _column_index(reference):
+    letters = reference.rstrip('0123456789')
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter.upper()) - ord('A') + 1
+    return index - 1
+
+
+def read_xlsx(fileobj):
+    """Yield the rows of the first sheet of an .xlsx file as lists of strings, parsed incrementally."""
+    with zipfile.ZipFile(fileobj) as archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as part:
+                for _, element in ElementTree.iterparse(part):
+                    if element.tag == f'{_XLSX_NS}si':
+                        shared_strings.append(''.join(text.text or '' for text in element.iter(f'{_XLSX_NS}t')))
+                        element.clear()
+
+        workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        sheet_id = workbook.find(f'{_XLSX_NS}sheets/{_XLSX_NS}sheet').get(f'{_DOC_RELS_NS}id')
+        relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        target = next(rel.get('Target') for rel in relations.iter(f'{_RELS_NS}Relationship') if rel.get('Id') == sheet_id)
+        sheet_path = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+
+        with archive.open(sheet_path) as part:
+            for _, element in ElementTree.iterparse(part):
+                if element.tag != f'{_XLSX_NS}row':
+                    continue
+                row = []
+                for position, cell in enumerate(element.iter(f'{_XLSX_NS}c')):
+                    index = _column_index(cell.get('r')) if cell.get('r') else position
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(f'{_XLSX_NS}t'))
+                    else:
+                        raw = cell.find(f'{_XLSX_NS}v')
+                        value = raw.text if raw is not None and raw.text is not None else ''
+                        if kind == 's':
+                            value = shared_strings[int(value)]
+                        elif kind in (None, 'n'):
+                            value = _xlsx_value(value)
+                    row.extend([''] * (index + 1 - len(row)))
+                    row[index] = value
+                element.clear()
+                yield row
+
+
+def read_rows(fileobj, filename):
+    """Yield ``(row number, {column: value})`` for every data row of a CSV or XLSX file."""
+    if filename.lower().endswith('.xlsx'):
+        rows = read_xlsx(fileobj)
+    else:
+        rows = csv.reader(io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline=''))
+    headers = [_normalize(header).replace(' ', '_') for header in next(rows, [])]
+    for number, values in enumerate(rows, start=2):
+        if not any(str(value).strip() for value in values):
+            continue
+        yield number, {header: str(value).strip() for header, value in zip(headers, values)}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.fees = 0
+        self.errors = []  # (row number, row, {column: [messages]})
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    def write_report(self, fileobj):
+        """CSV with the failed rows as they were read and what is wrong with them, ready to fix and import again."""
+        writer = csv.writer(fileobj)
+        writer.writerow(['row', 'errors'] + IMPORT_COLUMNS)
+        for number, row, errors in self.errors:
+            messages = '; '.join(f'{column}: {" ".join(texts)}' for column, texts in errors.items())
+            writer.writerow([number, messages] + [row.get(column, '') for column in IMPORT_COLUMNS])
+
+
+class MemberImporter:
+    """
+    Create users, members and their registration fees from roster rows, ``IMPORT_CHUNK_SIZE``
+    rows per transaction.
+
+    Each row is cleaned with MemberForm's fields, the district and tehsil names are resolved
+    from lookup tables loaded once, and CNICs are checked against the database with one
+    query per chunk. The valid rows of a chunk get their currency association and
+    application IDs reserved in one round trip each and are written with bulk_create. Rows
+    that fail are collected with their errors; with ``dry_run`` nothing is written.
+    """
+
+    def __init__(self, payment=None, approve=False, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+        self.payment = payment
+        self.approve = approve
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.districts = {_normalize(name): district_id for district_id, name in District.objects.values_list('id', 'name')}
+        self.tehsils = {
+            (district_id, _normalize(name)): tehsil_id
+            for tehsil_id, district_id, name in Tehsil.objects.values_list('id', 'district_id', 'name')
+        }
+        self.seen_cnics = set()
+
+    def run(self, rows, progress=None):
+        result = ImportResult()
+        chunk = []
+        for number, row in rows:
+            chunk.append((number, row))
+            if len(chunk) == self.chunk_size:
+                self._import_chunk(chunk, result)
+                chunk = []
+                if progress:
+                    progress(result)
+        if chunk:
+            self._import_chunk(chunk, result)
+            if progress:
+                progress(result)
+        if result.created and not self.dry_run:
+            # bulk_create sends no post_save signals
+            invalidate_tehsils_map()
+        return result
+
+    def _clean(self, row):
+        row = prepare_row(row)
+        errors = {}
+        member_form = MemberImportForm(data={column: row.get(column, '') for column in MEMBER_COLUMNS})
+        if member_form.is_valid():
+            member = member_form.instance
+        else:
+            errors.update(member_form.errors)
+            member = None
+
+        district_id = self.districts.get(_normalize(row.get('district', '')))
+        tehsil_id = self.tehsils.get((district_id, _normalize(row.get('tehsil', ''))))
+        if district_id is None:
+            errors['district'] = [f"Unknown district '{row.get('district', '')}'."]
+        elif tehsil_id is None:
+            errors['tehsil'] = [f"Unknown tehsil '{row.get('tehsil', '')}' in this district."]
+        elif member is not None:
+            member.district_id, member.tehsil_id = district_id, tehsil_id
+
+        fee = None
+        if row.get('amount_submitted'):
+            fee_form = FeeImportForm(data={column: row.get(column, '') for column in FEE_COLUMNS})
+            if self.payment is None:
+                errors['amount_submitted'] = ["A payment account is needed to import fees."]
+            elif fee_form.is_valid():
+                fee = fee_form.instance
+                fee.fee_type = 'new registration'
+                fee.payment = self.payment
+                fee.is_approved = self.approve
+            else:
+                errors.update(fee_form.errors)
+        return member, fee, errors
+
+    def _import_chunk(self, chunk, result):
+        cleaned = []
+        for number, row in chunk:
+            member, fee, errors = self._clean(row)
+            if member is not None and not errors:
+                if member.cnic in self.seen_cnics:
+                    errors['cnic'] = ["Appears more than once in this file."]
+                self.seen_cnics.add(member.cnic)
+            if errors:
+                result.errors.append((number, row, errors))
+            else:
+                cleaned.append((number, row, member, fee))
+
+        taken = set(Member.objects.filter(cnic__in=[member.cnic for _, _, member, _ in cleaned])
+                    .values_list('cnic', flat=True))
+        valid = []
+        for number, row, member, fee in cleaned:
+            if member.cnic in taken:
+                result.errors.append((number, row, {'cnic': ["A member with this CNIC already exists."]}))
+            else:
+                valid.append((member, fee))
+        result.errors.sort(key=lambda error: error[0])
+
+        if not valid:
+            return
+        if self.dry_run:
+            result.created += len(valid)
+            result.fees += sum(fee is not None for _, fee in valid)
+            return
+
+        with transaction.atomic():
+            numbers = currency_association_ids.take(len(valid))
+            year = timezone.now().year
+            application_numbers = reserve_application_numbers(FEE_TYPE_CODES['new registration'], year, len(valid))
+            now = timezone.now()
+            users = User.objects.bulk_create([
+                User(username=format_currency_association_id(number),
+                     currency_association_id=format_currency_association_id(number), role='member')
+                for number in numbers
+            ])
+            members = []
+            for (member, fee), user, application_number in zip(valid, users, application_numbers):
+                member.user = user
+                member.application_id = format_application_id(FEE_TYPE_CODES['new registration'], year,
+                                                               application_number)
+                if self.approve:
+                    member.is_approved = True
+                    member.status = 'active'
+                    member.joined_at = now
+                    member.member_till = calculate_member_till(now).date()
+                members.append(member)
+            Member.objects.bulk_create(members)
+            record_member_transitions(members)
+            members_changed(member.pk for member in members)
+            fees = []
+            for member, fee in valid:
+                if fee is not None:
+                    fee.member = member
+                    fees.append(fee)
+            Fee.objects.bulk_create(fees)
+        result.created += len(members)
+        result.fees += len(fees)
+
+
@@ -0,0 +1,54 @@
+from django.shortcuts import redirect
+from django.utils.functional import SimpleLazyObject
+
+from .models import Member
+
+# Pages a member whose membership expired can still open: the dashboard with their read-only
+# details, and the renewal form with what it loads. Renewing is the way back to active.
+EXPIRED_MEMBER_URL_NAMES = frozenset({
+    'home', 'renew_membership', 'logout', 'member_form_fragment', 'get_tehsils', 'tehsil_index',
+})
+
+
+def get_member(request):
+    """
+    Return the Member of the logged-in user (or None), loading it at most once per request.
+    Views should call this instead of querying ``Member.objects.get(user=request.user)``.
+    """
+    if not hasattr(request, '_cached_member'):
+        member = None
+        if request.user.is_authenticated:
+            member = Member.objects.with_related().filter(user=request.user).first()
+        request._cached_member = member
+    return request._cached_member
+
+
+class MemberMiddleware:
+    """Set ``request.member``, a lazy accessor that only queries when something reads it."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.member = SimpleLazyObject(lambda: get_member(request))
+        return self.get_response(request)
+
+
+class ExpiredMemberMiddleware:
+    """Send members whose membership expired to the renewal form from every other page."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not request.user.is_authenticated or request.user.is_staff:
+            return None
+        if request.resolver_match.url_name in EXPIRED_MEMBER_URL_NAMES:
+            return None
+        member = get_member(request)
+        if member is not None and member.status == 'expired':
+            return redirect('renew_membership')
+        return None
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def seed_currency_association_sequence(apps, schema_editor):
+    User = apps.get_model('main_app', 'User')
+    IdSequence = apps.get_model('main_app', 'IdSequence')
+    last_number = 199  # The first generated ID is CEA-0200
+    for currency_association_id in User.objects.filter(currency_association_id__startswith='CEA-') \
+            .values_list('currency_association_id', flat=True).iterator():
+        number = currency_association_id[len('CEA-'):]
+        if number.isdigit():
+            last_number = max(last_number, int(number))
+    IdSequence.objects.update_or_create(name='currency_association_id', defaults={'last_value': last_number})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0036_alter_fee_member'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_currency_association_sequence, migrations.RunPython.noop),
+    ]
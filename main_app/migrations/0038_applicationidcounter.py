@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0037_idsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationIdCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fee_code', models.CharField(max_length=10)),
+                ('year', models.PositiveIntegerField()),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fee_code', 'year'), name='unique_application_counter')],
+            },
+        ),
+    ]
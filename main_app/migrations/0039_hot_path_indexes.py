@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0038_applicationidcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(fields=['member', 'fee_type'], name='fee_member_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(fields=['fee_type', 'is_approved'], name='fee_type_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['status', 'joined_at'], name='member_status_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['status', 'created_at'], name='member_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['status', 'tehsil'], name='member_status_tehsil_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='memberchangerequest',
+            index=models.Index(condition=models.Q(('is_approved', False), ('is_rejected', False)), fields=['submission_date'], name='changerequest_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0039_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('member_detail', 'Member Detail')], max_length=20)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('html', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('file', models.FileField(blank=True, null=True, upload_to='pdfs/')),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_jobs', to='main_app.member')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='pdfjob_status_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('member', 'kind', 'content_hash'), name='unique_pdf_job')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0041_cardexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpirySweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('expired', models.PositiveIntegerField(default=0)),
+                ('batches', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='member',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('pending', 'Pending'), ('suspended', 'Suspended'), ('expired', 'Expired')], default='pending', max_length=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['status', 'member_till'], name='member_status_till_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expirysweep',
+            index=models.Index(fields=['cutoff', 'status'], name='expirysweep_cutoff_idx'),
+        ),
+    ]
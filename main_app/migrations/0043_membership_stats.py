@@ -0,0 +1,54 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, When
+from django.db.models.functions import TruncDate
+
+# stats.STATUS_DATE_FIELDS when the rollup was introduced
+STATUS_DATE_FIELDS = {
+    'active': 'joined_at',
+    'pending': 'created_at',
+    'suspended': 'joined_at',
+    'expired': 'joined_at',
+}
+
+
+def populate_membership_stats(apps, schema_editor):
+    Member = apps.get_model('main_app', 'Member')
+    MembershipStats = apps.get_model('main_app', 'MembershipStats')
+    day = Case(*[When(status=status, then=TruncDate(field)) for status, field in STATUS_DATE_FIELDS.items()],
+               default=TruncDate('created_at'))
+    rows = (Member.objects.exclude(status=None).order_by().annotate(stats_day=day)
+            .values('stats_day', 'district_id', 'tehsil_id', 'status').annotate(count=Count('id')))
+    MembershipStats.objects.bulk_create([
+        MembershipStats(day=row['stats_day'], district_id=row['district_id'], tehsil_id=row['tehsil_id'],
+                        status=row['status'], count=row['count'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0042_member_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(null=True)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('pending', 'Pending'), ('suspended', 'Suspended'), ('expired', 'Expired')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('district', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='membership_stats', to='main_app.district')),
+                ('tehsil', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='membership_stats', to='main_app.tehsil')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'day'], name='membershipstats_status_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'district', 'tehsil', 'status'), name='unique_membership_stats')],
+            },
+        ),
+        migrations.RunPython(populate_membership_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0043_membership_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(fields=['fee_type', 'renewal_date'], name='fee_type_renewal_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['created_at'], name='member_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['joined_at'], name='member_joined_idx'),
+        ),
+    ]
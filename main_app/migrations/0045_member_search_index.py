@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# SQLite drops a table's triggers when a migration rebuilds the table, which most AlterField and
+# RemoveField operations on main_app_member or main_app_user do. search.py recreates missing
+# triggers after every migrate (post_migrate) and falls back to LIKE searches while any is
+# missing; keep its MEMBER_FTS_TRIGGERS in step with the statements here.
+
+COLUMNS = ('full_name', 'father_name', 'business_name', 'present_address', 'permanent_address', 'business_address', 'cnic')
+
+# currency_association_id comes from the member's user
+INDEXED = ', '.join(COLUMNS + ('currency_association_id',))
+NEW_VALUES = ', '.join(f'new.{column}' for column in COLUMNS)
+ASSOCIATION_ID = '(SELECT currency_association_id FROM main_app_user WHERE id = new.user_id)'
+
+CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE main_app_member_fts USING fts5(
+        {INDEXED}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    "CREATE VIRTUAL TABLE main_app_member_fts_vocab USING fts5vocab(main_app_member_fts, 'row')",
+    f"""CREATE TRIGGER main_app_member_fts_insert AFTER INSERT ON main_app_member BEGIN
+        INSERT INTO main_app_member_fts (rowid, {INDEXED}) VALUES (new.id, {NEW_VALUES}, {ASSOCIATION_ID});
+    END""",
+    # Only the indexed columns, status and date updates (the expiry sweep) leave the index alone
+    f"""CREATE TRIGGER main_app_member_fts_update AFTER UPDATE OF {', '.join(COLUMNS)}, user_id ON main_app_member BEGIN
+        DELETE FROM main_app_member_fts WHERE rowid = old.id;
+        INSERT INTO main_app_member_fts (rowid, {INDEXED}) VALUES (new.id, {NEW_VALUES}, {ASSOCIATION_ID});
+    END""",
+    """CREATE TRIGGER main_app_member_fts_delete AFTER DELETE ON main_app_member BEGIN
+        DELETE FROM main_app_member_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER main_app_user_fts_update AFTER UPDATE OF currency_association_id ON main_app_user BEGIN
+        UPDATE main_app_member_fts SET currency_association_id = new.currency_association_id
+        WHERE rowid IN (SELECT id FROM main_app_member WHERE user_id = new.id);
+    END""",
+    f"""INSERT INTO main_app_member_fts (rowid, {INDEXED})
+        SELECT member.id, {', '.join(f'member.{column}' for column in COLUMNS)}, user.currency_association_id
+        FROM main_app_member member JOIN main_app_user user ON user.id = member.user_id""",
+]
+
+DROP_STATEMENTS = [
+    'DROP TRIGGER IF EXISTS main_app_user_fts_update',
+    'DROP TRIGGER IF EXISTS main_app_member_fts_delete',
+    'DROP TRIGGER IF EXISTS main_app_member_fts_update',
+    'DROP TRIGGER IF EXISTS main_app_member_fts_insert',
+    'DROP TABLE IF EXISTS main_app_member_fts_vocab',
+    'DROP TABLE IF EXISTS main_app_member_fts',
+]
+
+
+def create_member_search_index(apps, schema_editor):
+    # FTS5 is SQLite's; other databases fall back to LIKE searches, see search.py
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_STATEMENTS:
+            schema_editor.execute(statement)
+
+
+def drop_member_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_STATEMENTS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0044_timeseries_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_member_search_index, drop_member_search_index),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:11
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+import main_app.models
+
+
+def move_to_private_storage(apps, schema_editor):
+    # PDFs and card export ZIPs written so far sit under MEDIA_ROOT with guessable names; they
+    # move to the private storage under random names and the public copies are deleted
+    for model_name in ('PdfJob', 'CardExport'):
+        model = apps.get_model('main_app', model_name)
+        for document in model.objects.exclude(file='').exclude(file=None).iterator():
+            old_name = document.file.name
+            if default_storage.exists(old_name):
+                with default_storage.open(old_name, 'rb') as content:
+                    document.file.save(old_name.rsplit('/', 1)[-1], content, save=False)
+                default_storage.delete(old_name)
+            else:
+                document.file = None
+            if document.file or model_name == 'CardExport':
+                document.save(update_fields=['file'])
+            else:
+                # Rendered again when it is next asked for
+                document.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0045_member_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cardexport',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=main_app.models.private_storage, upload_to=main_app.models.card_export_path),
+        ),
+        migrations.AlterField(
+            model_name='pdfjob',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=main_app.models.private_storage, upload_to=main_app.models.pdf_job_path),
+        ),
+        migrations.RunPython(move_to_private_storage, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,9 @@
+import os
+import secrets
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 from django.utils import timezone
 from django_countries import countries
@@ -15,6 +20,28 @@ class User(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     currency_association_id = models.CharField(max_length=20, unique=True)
 
+class IdSequence(models.Model):
+    """A named counter handed out atomically, see sequences.py."""
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
+class ApplicationIdCounter(models.Model):
+    """Last application number handed out per fee type code and year, see sequences.py."""
+    fee_code = models.CharField(max_length=10)
+    year = models.PositiveIntegerField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fee_code', 'year'], name='unique_application_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.fee_code}-{self.year}: {self.last_value}"
+
 # Tehsil and District models
 class District(models.Model):
     name = models.CharField(max_length=100)
@@ -75,10 +102,36 @@ class Fee(models.Model):
     is_approved = models.BooleanField(default=False)  # Approved by admin
     # application_id = models.CharField(max_length=100, default=None, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['member', 'fee_type'], name='fee_member_type_idx'),
+            models.Index(fields=['fee_type', 'is_approved'], name='fee_type_approved_idx'),
+            # Renewals per day in the time series, see timeseries.py
+            models.Index(fields=['fee_type', 'renewal_date'], name='fee_type_renewal_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.fee_type}"
 
 
+class MemberQuerySet(models.QuerySet):
+    # Columns shown by the member tables (dashboard, members page)
+    LISTING_FIELDS = (
+        'id', 'full_name', 'business_name', 'pri_mob', 'status', 'created_at', 'joined_at',
+        'user__id', 'user__currency_association_id',
+        'tehsil__id', 'tehsil__name', 'tehsil__district__id', 'tehsil__district__name',
+        'district__id', 'district__name',
+    )
+
+    def with_related(self):
+        """Join the user, tehsil (with its district) and district so rows don't query them one by one."""
+        return self.select_related('user', 'tehsil__district', 'district')
+
+    def for_listing(self):
+        """Members for a table: related rows joined in and only the listed columns loaded."""
+        return self.with_related().only(*self.LISTING_FIELDS)
+
+
 class Member(models.Model):
     application_id = models.CharField(max_length=25, unique=True, null=True, blank=True)  # Ensure uniqueness
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -134,6 +187,7 @@ class Member(models.Model):
         ('active', 'Active'),
         ('pending', 'Pending'),
         ('suspended', 'Suspended'),
+        ('expired', 'Expired'),  # set by the expiry sweep once member_till has passed, see expiry.py
     ]
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', null=True)  # Member status
     # Field to store the approval time
@@ -141,6 +195,22 @@ class Member(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     member_till = models.DateField(default=None, null=True, blank=True)  # Field to track membership expiry date
 
+    objects = MemberQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Dashboard counters and member table filters
+            models.Index(fields=['status', 'joined_at'], name='member_status_joined_idx'),
+            models.Index(fields=['status', 'created_at'], name='member_status_created_idx'),
+            # Active members per tehsil on the map
+            models.Index(fields=['status', 'tehsil'], name='member_status_tehsil_idx'),
+            # Active members whose membership has run out, for the expiry sweep
+            models.Index(fields=['status', 'member_till'], name='member_status_till_idx'),
+            # Signups and approvals of the current time series bucket
+            models.Index(fields=['created_at'], name='member_created_idx'),
+            models.Index(fields=['joined_at'], name='member_joined_idx'),
+        ]
+
     def __str__(self):
         return f"{self.full_name} ({self.cnic})"
 
@@ -201,28 +271,171 @@ class MemberChangeRequest(models.Model):
     rejection_reason = models.TextField(blank=True, null=True)
 
     fee = models.ForeignKey(Fee, on_delete=models.CASCADE, default=None)  # Link to Fee directly
+
+    class Meta:
+        indexes = [
+            # Only the pending requests are ever listed, so only they are indexed
+            models.Index(fields=['submission_date'], name='changerequest_pending_idx',
+                         condition=models.Q(is_approved=False, is_rejected=False)),
+        ]
+
     def __str__(self):
         return f"Change Request for {self.member.full_name} on {self.submission_date}"
 
-    def apply_changes(self):
-        """Apply changes to the original Member model when approved, and track changes."""
+    def stage_changes(self):
+        """
+        Copy the proposed values of the fields in ``changes`` onto the member without saving.
+        Only fields whose value really changes are touched; returns their column names.
+        """
         member = self.member
-        previous_values = {}
+        update_fields = []
+        for field in self.changes:
+            member_field = member._meta.get_field(field)
+            new_value = getattr(self, self._meta.get_field(f'new_{field}').attname)
+            if new_value is None or new_value == '':
+                continue
+            # Compared as stored, so a Country and its code or a date and its string are equal
+            old_value = getattr(member, member_field.attname)
+            if member_field.get_prep_value(new_value) != member_field.get_prep_value(old_value):
+                setattr(member, member_field.attname, new_value)
+                update_fields.append(member_field.attname)
+        return update_fields
+
+    def apply_changes(self):
+        """Apply ``stage_changes`` and save the changed columns. Returns their names."""
+        update_fields = self.stage_changes()
+        if update_fields:
+            self.member.save(update_fields=update_fields)
+        return update_fields
+
+
+class PrivateMediaStorage(FileSystemStorage):
+    """Files under PRIVATE_MEDIA_ROOT, which no URL serves; views stream them after checking access."""
+
+    @property
+    def base_location(self):
+        return settings.PRIVATE_MEDIA_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
 
-        # Apply changes based on the edited values
-        if self.changes:
-            for field, change in self.changes.items():
-                new_value = change['new']  # Get the edited value from the changes
-                old_value = getattr(member, field, None)  # Get the current value of the field
+private_media_storage = PrivateMediaStorage()
 
-                if new_value is not None and new_value != old_value:
-                    previous_values[field] = old_value  # Store the old value for tracking
-                    setattr(member, field, new_value)  # Update the member's field
 
-        # Save the updated member information
-        member.save()
+def private_storage():
+    return private_media_storage
 
-        # Log the previous values of changed fields
-        if previous_values:
-            self.changes = previous_values  # Update changes with previous values
-            self.save()
+
+def pdf_job_path(instance, filename):
+    # Random, so one member's file name tells nothing about another's
+    return f'pdfs/{instance.member_id}/{secrets.token_urlsafe(16)}.pdf'
+
+
+def card_export_path(instance, filename):
+    return f'card_exports/{secrets.token_urlsafe(16)}.zip'
+
+
+class PdfJob(models.Model):
+    """A queued PDF render and, once done, the cached file, see pdfs.py."""
+    KIND_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('member_detail', 'Member Detail'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='pdf_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    content_hash = models.CharField(max_length=64)  # sha256 of the rendered HTML
+    html = models.TextField(blank=True)  # cleared once the PDF is written
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField(upload_to=pdf_job_path, storage=private_storage, null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['member', 'kind', 'content_hash'], name='unique_pdf_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='pdfjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} PDF for member {self.member_id} ({self.status})"
+
+
+class CardExport(models.Model):
+    """A ZIP of member detail PDFs built by the PDF worker, see card_export.py."""
+    STATUS_CHOICES = PdfJob.STATUS_CHOICES
+    member_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)  # not approved or without an approved registration fee
+    file = models.FileField(upload_to=card_export_path, storage=private_storage, null=True, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Card export {self.id} ({self.status}, {self.done + self.skipped}/{self.total})"
+
+
+class ExpirySweep(models.Model):
+    """One run of the membership expiry sweep, see expiry.py."""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    cutoff = models.DateField()  # active members with member_till before this day are expired
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='running')
+    expired = models.PositiveIntegerField(default=0)
+    batches = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cutoff', 'status'], name='expirysweep_cutoff_idx'),
+        ]
+
+    def __str__(self):
+        return f"Expiry sweep {self.cutoff} ({self.status}, {self.expired} expired)"
+
+
+class MembershipStats(models.Model):
+    """
+    Number of members per status, district, tehsil and day, where the day is the member's
+    status date (see stats.STATUS_DATE_FIELDS). Kept up to date from the member signals,
+    rebuilt every day after the expiry sweep and by the rebuild_membership_stats command,
+    see stats.py.
+    """
+    day = models.DateField(null=True)
+    district = models.ForeignKey(District, on_delete=models.CASCADE, null=True, related_name='membership_stats')
+    tehsil = models.ForeignKey(Tehsil, on_delete=models.CASCADE, null=True, related_name='membership_stats')
+    status = models.CharField(max_length=10, choices=Member.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'district', 'tehsil', 'status'], name='unique_membership_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'day'], name='membershipstats_status_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.count} {self.status} members on {self.day} in tehsil {self.tehsil_id}"
@@ -0,0 +1,67 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page into an opaque cursor string."""
+    raw = json.dumps(values, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        raise InvalidCursor('Malformed cursor.')
+    # A sort value and an integer id; anything else was not made by encode_cursor
+    if (not isinstance(values, list) or len(values) != 2 or isinstance(values[0], (list, dict))
+            or type(values[1]) is not int):
+        raise InvalidCursor('Malformed cursor.')
+    return values
+
+
+def keyset_paginate(queryset, sort_field, cursor=None, limit=25, descending=False):
+    """
+    Return one page of ``queryset`` ordered by ``sort_field`` (with ``id`` as tie breaker)
+    and the cursor for the next page.
+
+    Instead of OFFSET, the page starts right after the row encoded in ``cursor``, so the
+    database seeks straight to it and the cost of a page does not grow with its position.
+    """
+    order = [f'-{sort_field}', '-id'] if descending else [sort_field, 'id']
+    queryset = queryset.order_by(*order)
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        if sort_field.endswith('_at'):
+            try:
+                last_value = parse_datetime(last_value) if isinstance(last_value, str) else None
+            except ValueError:
+                # Well formed but out of range
+                last_value = None
+            if last_value is None:
+                raise InvalidCursor('Malformed cursor.')
+        lookup = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{sort_field}__{lookup}': last_value}) |
+            Q(**{sort_field: last_value, f'id__{lookup}': last_id})
+        )
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:limit + 1])
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, sort_field), last.id])
+    return rows, next_cursor
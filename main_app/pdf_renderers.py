@@ -0,0 +1,417 @@
+"""
+PDF renderers turn the HTML of pdf.html into PDF bytes. The one used for the receipts and
+member details users download is chosen with the ``PDF_RENDERER`` setting, the one used
+for bulk card exports with ``CARD_EXPORT_PDF_RENDERER``, see ``get_renderer``.
+"""
+import multiprocessing
+import queue
+import textwrap
+import threading
+from html.parser import HTMLParser
+
+import pdfkit
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_WKHTMLTOPDF_OPTIONS = {
+    'encoding': 'UTF-8',
+    'javascript-delay': '10',
+    'enable-local-file-access': None,  # To be able to access CSS
+    'page-size': 'A4',
+    'orientation': 'portrait',
+    'custom-header': [
+        ('Accept-Encoding', 'gzip')
+    ],
+}
+
+
+class RendererError(Exception):
+    pass
+
+
+# setting name -> renderer, created once per process by get_renderer
+_renderers = {}
+
+
+class WkhtmltopdfRenderer:
+    """Starts one wkhtmltopdf process per PDF, renders the full CSS of pdf.html."""
+    full_layout = True
+    # A new external process per document, which ProcessPoolRenderer could not keep warm
+    process_per_document = True
+
+    def __init__(self, cmd=None, options=None):
+        self.cmd = cmd or settings.WKHTMLTOPDF_CMD
+        self.options = options or DEFAULT_WKHTMLTOPDF_OPTIONS
+
+    def render(self, html):
+        config = pdfkit.configuration(wkhtmltopdf=self.cmd)
+        return pdfkit.from_string(html, False, configuration=config, options=self.options)
+
+    def close(self):
+        pass
+
+
+def _serve(connection, renderer):
+    # Runs in a pool process: render every HTML document received until the pipe closes
+    while True:
+        try:
+            html = connection.recv()
+        except EOFError:
+            return
+        if html is None:
+            return
+        try:
+            connection.send((True, renderer.render(html)))
+        except Exception as exc:
+            connection.send((False, f'{type(exc).__name__}: {exc}'))
+
+
+class ProcessPoolRenderer:
+    """
+    Keeps up to ``processes`` long-lived Python processes and sends each document to an
+    idle one over a pipe; they render with ``backend``. Python and ``backend`` are set up
+    once per process instead of per PDF, and rendering runs next to the caller.
+
+    Only for bulk card exports (``CARD_EXPORT_PDF_RENDERER``): wkhtmltopdf cannot take several
+    documents per run, so a pool around it would still start one per PDF and save nothing,
+    and the in-process backends it can keep warm do not render the full layout.
+    """
+
+    def __init__(self, backend='main_app.pdf_renderers.CardLayoutRenderer', processes=2, options=None):
+        backend_class = import_string(backend)
+        if backend_class.process_per_document:
+            raise ImproperlyConfigured(
+                f"{backend} starts a process for every PDF, a ProcessPoolRenderer around it saves nothing."
+            )
+        self.renderer = backend_class(**(options or {}))
+        self.full_layout = self.renderer.full_layout
+        self.processes = processes
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._workers) < self.processes:
+                parent_end, child_end = self._context.Pipe()
+                process = self._context.Process(target=_serve, args=(child_end, self.renderer), daemon=True)
+                process.start()
+                child_end.close()
+                worker = (process, parent_end)
+                self._workers.append(worker)
+                return worker
+        return self._idle.get()
+
+    def _discard(self, worker):
+        process, connection = worker
+        connection.close()
+        process.kill()
+        process.join()
+        with self._lock:
+            self._workers.remove(worker)
+
+    def render(self, html):
+        worker = self._checkout()
+        try:
+            worker[1].send(html)
+            ok, result = worker[1].recv()
+        except (EOFError, OSError) as exc:
+            # The process died mid-document, the next render starts a fresh one
+            self._discard(worker)
+            raise RendererError(f'Renderer process exited: {exc}')
+        self._idle.put(worker)
+        if not ok:
+            raise RendererError(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        self._idle = queue.Queue()
+        for process, connection in workers:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.renderer.close()
+
+
+class _CardLayoutParser(HTMLParser):
+    """Reads the headings, info lines, label/value cards and rules of pdf.html into blocks."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._skip = 0
+        self._divs = []  # class set of every open div
+        self._text = None  # (kind, classes, parts) of the heading/paragraph/info being read
+        self._card = None  # [label parts, value parts, reading value]
+        self._columns = None
+        self._column = 0
+        self._signatures = None
+
+    def handle_starttag(self, tag, attrs):
+        classes = set((dict(attrs).get('class') or '').split())
+        if tag in ('style', 'script', 'title'):
+            self._skip += 1
+        elif tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p'):
+            self._text = (tag, classes, [])
+        elif tag == 'br':
+            if self._text is not None:
+                self._text[2].append('\n')
+        elif tag == 'hr':
+            if self._signatures is None:
+                self.blocks.append(('rule',))
+        elif tag == 'span':
+            if self._card is not None:
+                self._card[2] = True
+            elif self._signatures is not None:
+                self._signatures.append([])
+        elif tag == 'div':
+            self._divs.append(classes)
+            if 'business-info' in classes:
+                self._columns = ([], [])
+            elif 'left-info' in classes:
+                self._column = 0
+            elif 'right-info' in classes:
+                self._column = 1
+            elif classes & {'cea-card', 'receipt-card'}:
+                self._card = [[], [], False]
+            elif 'value' in classes and self._card is not None:
+                self._card[2] = True
+            elif 'application-info' in classes:
+                self._text = ('info', classes, [])
+            elif 'signatures' in classes:
+                self._signatures = []
+
+    def handle_endtag(self, tag):
+        if tag in ('style', 'script', 'title'):
+            self._skip -= 1
+        elif self._text is not None and tag == self._text[0]:
+            self._finish_text()
+        elif tag == 'div' and self._divs:
+            classes = self._divs.pop()
+            if classes & {'cea-card', 'receipt-card'} and self._card is not None:
+                field = (_clean(''.join(self._card[0])).rstrip(':'), _clean(''.join(self._card[1])))
+                self._card = None
+                if self._columns is not None:
+                    self._columns[self._column].append(field)
+                else:
+                    self.blocks.append(('columns', [field], []))
+            elif 'business-info' in classes and self._columns is not None:
+                self.blocks.append(('columns', *self._columns))
+                self._columns = None
+            elif 'application-info' in classes and self._text is not None:
+                self._finish_text()
+            elif 'signatures' in classes and self._signatures is not None:
+                self.blocks.append(('signatures', [_clean(''.join(parts)) for parts in self._signatures]))
+                self._signatures = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._card is not None:
+            self._card[1 if self._card[2] else 0].append(data)
+        elif self._signatures:
+            self._signatures[-1].append(data)
+        elif self._text is not None:
+            self._text[2].append(data)
+
+    def _finish_text(self):
+        kind, classes, parts = self._text
+        self._text = None
+        lines = [_clean(line) for line in ''.join(parts).split('\n')]
+        lines = [line for line in lines if line]
+        if lines:
+            self.blocks.append((kind, classes, lines))
+
+
+def _clean(text):
+    # The standard PDF fonts only cover Windows-1252, drop what they cannot show (Urdu)
+    text = text.encode('cp1252', errors='ignore').decode('cp1252')
+    return ' '.join(text.split())
+
+
+def _pdf_string(text):
+    data = text.encode('cp1252', errors='ignore')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+class _Canvas:
+    WIDTH, HEIGHT, MARGIN = 595, 842, 40  # A4 in points
+
+    def __init__(self):
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.ops = []
+        self.pages.append(self.ops)
+        self.y = self.HEIGHT - self.MARGIN
+
+    def ensure(self, height):
+        if self.y - height < self.MARGIN:
+            self.new_page()
+
+    def text(self, x, y, value, size=10, bold=False):
+        font = b'/F2' if bold else b'/F1'
+        self.ops.append(b'BT %s %d Tf %.2f %.2f Td %s Tj ET' % (font, size, x, y, _pdf_string(value)))
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.ops.append(b'%.2f w %.2f %.2f m %.2f %.2f l S' % (width, x1, y1, x2, y2))
+
+    def to_pdf(self):
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # page tree, filled in below
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        page_ids = []
+        for ops in self.pages:
+            stream = b'\n'.join(ops)
+            objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+            objects.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+                b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>' % (self.WIDTH, self.HEIGHT, len(objects))
+            )
+            page_ids.append(len(objects))
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids))
+
+        output = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(output)
+
+
+def _wrap(text, width, size):
+    # Helvetica averages about half an em per character
+    return textwrap.wrap(text, max(int(width / (size * 0.5)), 1)) or ['']
+
+
+class CardLayoutRenderer:
+    """
+    Pure-Python renderer for the card layout of pdf.html. It lays out the headings, info
+    lines and label/value cards with the standard PDF fonts and ignores the CSS, images and
+    Urdu text, in exchange for no external process and a few milliseconds per PDF. That is
+    only good enough for bulk card exports, so ``get_renderer`` refuses it for
+    ``PDF_RENDERER``.
+    """
+    full_layout = False
+    process_per_document = False
+
+    def render(self, html):
+        parser = _CardLayoutParser()
+        parser.feed(html)
+        parser.close()
+        canvas = _Canvas()
+        left, right = canvas.MARGIN, canvas.WIDTH - canvas.MARGIN
+        for block in parser.blocks:
+            kind = block[0]
+            if kind == 'rule':
+                canvas.ensure(12)
+                canvas.y -= 6
+                canvas.line(left, canvas.y, right, canvas.y)
+                canvas.y -= 6
+            elif kind in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'info'):
+                self._draw_text(canvas, kind, block[1], block[2])
+            elif kind == 'columns':
+                self._draw_columns(canvas, block[1], block[2])
+            elif kind == 'signatures':
+                canvas.ensure(50)
+                canvas.y -= 40
+                column_width = (right - left) / max(len(block[1]), 1)
+                for index, label in enumerate(block[1]):
+                    x = left + index * column_width
+                    canvas.line(x, canvas.y, x + column_width - 40, canvas.y)
+                    canvas.text(x, canvas.y - 12, label, size=9)
+                canvas.y -= 24
+        return canvas.to_pdf()
+
+    def _draw_text(self, canvas, kind, classes, lines):
+        size, bold = {'h1': (16, True), 'h2': (13, True), 'p': (9, False), 'info': (9, False)}.get(kind, (10, True))
+        centered = kind in ('h1', 'h2') and 'section-title' not in classes
+        if 'section-title' in classes:
+            size = 11 if kind != 'h6' else 8
+        width = canvas.WIDTH - 2 * canvas.MARGIN
+        for line in lines:
+            for wrapped in _wrap(line, width, size):
+                canvas.ensure(size + 6)
+                canvas.y -= size + 4
+                x = canvas.MARGIN
+                if centered:
+                    x = max((canvas.WIDTH - len(wrapped) * size * 0.5) / 2, canvas.MARGIN)
+                canvas.text(x, canvas.y, wrapped, size=size, bold=bold)
+        canvas.y -= 4
+
+    def _draw_columns(self, canvas, left_fields, right_fields):
+        gap = 20
+        column_width = (canvas.WIDTH - 2 * canvas.MARGIN - gap) / 2
+        for row in range(max(len(left_fields), len(right_fields))):
+            cells = []
+            for column, fields in enumerate((left_fields, right_fields)):
+                if row < len(fields):
+                    label, value = fields[row]
+                    cells.append((canvas.MARGIN + column * (column_width + gap), label, _wrap(value, column_width, 10)))
+            height = 12 + 12 * max(len(lines) for _, _, lines in cells) + 6
+            canvas.ensure(height)
+            top = canvas.y
+            for x, label, lines in cells:
+                canvas.text(x, top - 9, label, size=8, bold=True)
+                for index, line in enumerate(lines):
+                    canvas.text(x, top - 21 - 12 * index, line, size=10)
+                canvas.line(x, top - height + 3, x + column_width, top - height + 3, width=0.25)
+            canvas.y = top - height
+
+    def close(self):
+        pass
+
+
+def get_renderer(setting='PDF_RENDERER'):
+    """
+    The renderer configured by ``setting``, created once per process. ``PDF_RENDERER``
+    renders the documents users download and must render the full layout;
+    ``CARD_EXPORT_PDF_RENDERER`` (``PDF_RENDERER`` when unset) may be a plain one.
+    """
+    renderer = _renderers.get(setting)
+    if renderer is None:
+        config = getattr(settings, setting, None) or settings.PDF_RENDERER
+        renderer = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        if setting == 'PDF_RENDERER' and not renderer.full_layout:
+            renderer.close()
+            raise ImproperlyConfigured(
+                f"{config['BACKEND']} leaves out the CSS, images and Urdu text of pdf.html; it can only be "
+                f"used for CARD_EXPORT_PDF_RENDERER."
+            )
+        _renderers[setting] = renderer
+    return renderer
+
+
+@receiver(setting_changed)
+def reset_renderer(setting, **kwargs):
+    if setting in ('PDF_RENDERER', 'CARD_EXPORT_PDF_RENDERER', 'WKHTMLTOPDF_CMD'):
+        renderers = list(_renderers.values())
+        _renderers.clear()
+        for renderer in renderers:
+            renderer.close()
@@ -0,0 +1,206 @@
+import hashlib
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Fee, MemberChangeRequest, PdfJob
+from .pdf_renderers import get_renderer
+
+logger = logging.getLogger(__name__)
+
+# A job that failed this many times stays failed until the document content changes
+MAX_ATTEMPTS = 3
+
+
+class PdfNotAvailable(Exception):
+    """The member does not qualify for the requested document (yet)."""
+
+
+def receipt_context(member):
+    change_request = MemberChangeRequest.objects.filter(member=member).first()
+    if not change_request:
+        raise PdfNotAvailable("Cannot generate receipt. No MemberChangeRequest found for this member.")
+    if not change_request.is_approved:
+        raise PdfNotAvailable("Cannot generate receipt. Member change request is not approved.")
+    fee = Fee.objects.filter(member=member).first()
+    if not fee or not fee.is_approved:
+        raise PdfNotAvailable("Cannot generate receipt. Fee is not approved or does not exist.")
+    return {
+        'member': member,
+        'application_id': change_request.application_id,
+        'submission_date': change_request.submission_date,
+        'fee': fee,
+    }
+
+
+def registration_fee(member):
+    # Bulk exports prefetch the registration fees into registration_fees
+    if hasattr(member, 'registration_fees'):
+        return member.registration_fees[0] if member.registration_fees else None
+    return Fee.objects.filter(fee_type="new registration", member=member).first()
+
+
+def member_detail_context(member):
+    if not member.is_approved:
+        raise PdfNotAvailable("Cannot generate receipt. Member is not approved.")
+    fee = registration_fee(member)
+    if not fee or not fee.is_approved:
+        raise PdfNotAvailable("Cannot generate receipt. Fee is not approved or does not exist.")
+    return {
+        'member': member,
+        'application_id': member.application_id,
+        'submission_date': member.created_at,
+        'fee': fee,
+    }
+
+
+DOCUMENT_CONTEXTS = {
+    'receipt': receipt_context,
+    'member_detail': member_detail_context,
+}
+
+
+def render_html(member, kind):
+    return render_to_string('pdf.html', DOCUMENT_CONTEXTS[kind](member))
+
+
+def render_pdf(html, setting='PDF_RENDERER'):
+    return get_renderer(setting).render(html)
+
+
+def request_pdf(member, kind):
+    """
+    Return the job for the current content of ``member``'s ``kind`` document, queueing a
+    render only when this exact HTML has not been seen before.
+
+    Rendering the template is cheap, so it is done on every request and its hash decides
+    whether the cached PDF is still valid. Raises ``PdfNotAvailable`` when the member does
+    not qualify for the document.
+    """
+    html = render_html(member, kind)
+    # A different renderer makes a different PDF from the same HTML
+    content_hash = hashlib.sha256(f"{settings.PDF_RENDERER}\n{html}".encode()).hexdigest()
+    # The unique constraint makes concurrent requests for the same content share one job
+    job, created = PdfJob.objects.get_or_create(
+        member=member, kind=kind, content_hash=content_hash, defaults={'html': html},
+    )
+    if job.status == 'done' and not job.file.storage.exists(job.file.name):
+        # The cached file was removed from the media folder, render it again
+        PdfJob.objects.filter(id=job.id, status='done').update(status='pending', html=html, attempts=0)
+        job.refresh_from_db()
+    return job
+
+
+def render_unclaimed(job):
+    """
+    Render ``job`` in the calling process when no worker has picked it up within
+    ``PDF_WORKER_WAIT`` seconds of being queued, so documents are still produced when no
+    pdf_worker is running. Returns the job as it is now.
+    """
+    waited_since = timezone.now() - timedelta(seconds=settings.PDF_WORKER_WAIT)
+    if job.status != 'pending' or job.created_at > waited_since:
+        return job
+    # The same conditional UPDATE as claim_next_job, a worker may claim it at the same moment
+    claimed = PdfJob.objects.filter(id=job.id, status='pending').update(
+        status='running', started_at=timezone.now(), attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        job.refresh_from_db()
+        return job
+    return run_job(PdfJob.objects.get(id=job.id))
+
+
+def claim_next_job():
+    """
+    Mark the oldest pending job as running and return it, or None when the queue is empty.
+
+    Jobs left running for longer than ``PDF_JOB_TIMEOUT`` (a worker died) are handed out
+    again. The claim is a conditional UPDATE, so two workers never get the same job.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.PDF_JOB_TIMEOUT)
+    claimable = Q(status='pending') | Q(status='running', started_at__lt=stale)
+    candidates = list(PdfJob.objects.filter(claimable).order_by('created_at', 'id').values_list('id', flat=True)[:10])
+    for job_id in candidates:
+        claimed = PdfJob.objects.filter(claimable, id=job_id).update(
+            status='running', started_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PdfJob.objects.get(id=job_id)
+    return None
+
+
+def run_job(job):
+    try:
+        pdf = render_pdf(job.html)
+    except Exception as exc:
+        logger.exception("Rendering PDF job %s failed", job.id)
+        job.status = 'failed' if job.attempts >= MAX_ATTEMPTS else 'pending'
+        job.error = str(exc)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    # Stored under a random name in the private storage, see PdfJob.file
+    job.file.save(f'{job.kind}.pdf', ContentFile(pdf), save=False)
+    job.status = 'done'
+    job.html = ''
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['file', 'status', 'html', 'error', 'finished_at'])
+
+    # Older finished versions of the same document are outdated now. Jobs queued after this one
+    # hold newer content someone is waiting for, and failed ones keep their error for the admin
+    outdated = PdfJob.objects.filter(member_id=job.member_id, kind=job.kind, status='done',
+                                     created_at__lt=job.created_at).defer('html')
+    for old_job in outdated:
+        # One by one, so the post_delete signal removes each file
+        old_job.delete()
+    return job
+
+
+def delete_old_pdfs():
+    """Delete the cached PDFs finished more than ``PDF_MAX_AGE`` seconds ago; asking for one renders it again."""
+    cutoff = timezone.now() - timedelta(seconds=settings.PDF_MAX_AGE)
+    deleted = 0
+    # One by one, so the post_delete signal removes each file
+    for job in PdfJob.objects.filter(status='done', finished_at__lt=cutoff).defer('html'):
+        job.delete()
+        deleted += 1
+    return deleted
+
+
+# Seconds between the worker's clean-ups of old PDFs and card exports
+CLEANUP_INTERVAL = 60 * 60
+
+
+def work(poll_interval=1.0, burst=False):
+    """Run queued PDF jobs and card exports until interrupted, or with ``burst`` until none are left."""
+    from .card_export import claim_next_export, delete_expired_exports, run_card_export
+
+    processed = 0
+    cleaned_at = None
+    while True:
+        if cleaned_at is None or time.monotonic() - cleaned_at > CLEANUP_INTERVAL:
+            delete_old_pdfs()
+            delete_expired_exports()
+            cleaned_at = time.monotonic()
+        job = claim_next_job()
+        if job is not None:
+            run_job(job)
+            processed += 1
+            continue
+        # Single PDFs are waited on in the browser, bulk exports only run when none are queued
+        export = claim_next_export()
+        if export is not None:
+            run_card_export(export)
+            processed += 1
+            continue
+        if burst:
+            return processed
+        time.sleep(poll_interval)
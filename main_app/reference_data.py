@@ -0,0 +1,127 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+from django_countries import countries
+
+from .models import District, Payment, Tehsil
+
+REFERENCE_DATA_VERSION_KEY = 'reference_data_version'
+
+PAYMENT_FIELDS = ('id', 'submission_method', 'title', 'bank_name', 'account_number', 'iban')
+
+# (version, language) -> data of the last version this process built or read
+_local = {}
+
+
+def reference_data_version():
+    # A timestamp instead of a counter, so a version evicted from the cache is never reused
+    version = cache.get(REFERENCE_DATA_VERSION_KEY)
+    if version is None:
+        cache.add(REFERENCE_DATA_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(REFERENCE_DATA_VERSION_KEY)
+    return version
+
+
+def bump_reference_data_version():
+    """Make every process rebuild the reference data on its next request."""
+    cache.set(REFERENCE_DATA_VERSION_KEY, time.time_ns(), None)
+
+
+def _options(choices):
+    return format_html_join('', '<option value="{}">{}</option>', choices)
+
+
+def build_tehsil_index(tehsils_by_district):
+    """
+    The district -> tehsil mapping as compact JSON, ``{"<district id>": [[tehsil id, name], ...]}``,
+    with a fingerprint of its content for the URL it is served from.
+    """
+    body = json.dumps(
+        {str(district_id): [[tehsil['id'], tehsil['name']] for tehsil in tehsils]
+         for district_id, tehsils in tehsils_by_district.items()},
+        separators=(',', ':'), ensure_ascii=False,
+    ).encode()
+    return {'body': body, 'fingerprint': hashlib.sha256(body).hexdigest()[:16]}
+
+
+def build_reference_data():
+    districts = list(District.objects.order_by('name').values('id', 'name'))
+    tehsils = list(Tehsil.objects.order_by('name').values('id', 'name', 'district_id'))
+    # Country names depend on the active language
+    country_list = [(country.code, str(country.name)) for country in countries]
+    tehsils_by_district = {}
+    for tehsil in tehsils:
+        tehsils_by_district.setdefault(tehsil['district_id'], []).append({'id': tehsil['id'], 'name': tehsil['name']})
+    return {
+        'districts': districts,
+        'tehsils': tehsils,
+        'tehsils_by_district': tehsils_by_district,
+        'tehsil_index': build_tehsil_index(tehsils_by_district),
+        'payments': list(Payment.objects.order_by('id').values(*PAYMENT_FIELDS)),
+        'countries': country_list,
+        'district_options': _options((district['id'], district['name']) for district in districts),
+        'tehsil_options': _options((tehsil['id'], tehsil['name']) for tehsil in tehsils),
+        'country_options': _options(country_list),
+    }
+
+
+def get_reference_data():
+    """
+    Districts, tehsils, payment accounts and countries as plain lists, plus their
+    ``<option>`` lists pre-rendered and the tehsils grouped by district, also as the JSON
+    document of ``build_tehsil_index``. Built once per version and language and kept in the
+    cache; within a process the unpickled copy is reused while the version is unchanged,
+    so a request costs one cache read.
+    """
+    key = (reference_data_version(), get_language())
+    data = _local.get(key)
+    if data is None:
+        cache_key = f'reference_data:{key[0]}:{key[1]}'
+        data = cache.get(cache_key)
+        if data is None:
+            data = build_reference_data()
+            cache.set(cache_key, data, None)
+        _local.clear()
+        _local[key] = data
+    return data
+
+
+def select_option(options, value):
+    """Mark the option with ``value`` as selected in a pre-rendered option list."""
+    if value in (None, ''):
+        return options
+    marker = format_html('<option value="{}">', value)
+    return mark_safe(options.replace(marker, marker[:-1] + ' selected>', 1))
+
+
+def reference_context(member=None):
+    """
+    Template context for the forms with location, country and payment account inputs:
+    ``district_options``, ``tehsil_options``, ``country_options`` and
+    ``other_citizenship_options`` with ``member``'s values selected, ``payment_details`` and
+    ``tehsil_index_url``.
+    """
+    data = get_reference_data()
+    context = {
+        'payment_details': data['payments'],
+        'tehsil_index_url': reverse('tehsil_index', args=[data['tehsil_index']['fingerprint']]),
+        'district_options': data['district_options'],
+        'tehsil_options': data['tehsil_options'],
+        'country_options': data['country_options'],
+        'other_citizenship_options': data['country_options'],
+    }
+    if member is not None:
+        context.update({
+            'district_options': select_option(data['district_options'], member.district_id),
+            'tehsil_options': select_option(data['tehsil_options'], member.tehsil_id),
+            'country_options': select_option(data['country_options'], member.country_of_stay.code),
+            'other_citizenship_options': select_option(data['country_options'],
+                                                       member.other_citizenship.code if member.other_citizenship else None),
+        })
+    return context
@@ -1,16 +1,192 @@
 # resources.py
-from import_export import resources
+import hashlib
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from import_export import fields, resources
+from import_export.instance_loaders import BaseInstanceLoader
+from import_export.widgets import ForeignKeyWidget
+
+from .maps import invalidate_tehsils_map
 from .models import Tehsil, District
+from .reference_data import bump_reference_data_version
+
+# Changed rows listed one by one in the import summary
+SUMMARY_CHANGES = 20
+
+
+def natural_name(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+class NaturalKeyInstanceLoader(BaseInstanceLoader):
+    """Loads every existing instance once and finds rows by the resource's natural key."""
+
+    def __init__(self, resource, dataset=None):
+        super().__init__(resource, dataset)
+        self.instances = {}
+        for instance in resource.get_queryset():
+            instance._import_values = resource.content_values(instance)
+            instance._import_hash = resource.content_hash(instance._import_values)
+            self.instances[resource.natural_key(instance)] = instance
+
+    def get_instance(self, row):
+        return self.instances.get(self.resource.row_key(row))
+
 
+class NaturalKeyResource(resources.ModelResource):
+    """
+    Upserts by natural key in batches: existing rows are loaded once by
+    NaturalKeyInstanceLoader, rows whose content hash matches the stored one are skipped,
+    and new and changed rows are written with bulk_create/bulk_update. After the import
+    ``result.diff_summary`` holds the summary lines (see ``summarize``).
+
+    Subclasses implement ``natural_key(instance)``, ``row_key(row)`` and
+    ``content_values(instance)``.
+    """
 
-class TehsilResource(resources.ModelResource):
     class Meta:
+        use_bulk = True
+        batch_size = 500
+        # Unchanged rows are found by content hash, the per-row HTML diff is not built
+        skip_diff = True
+        instance_loader_class = NaturalKeyInstanceLoader
+
+    def content_hash(self, values):
+        return hashlib.sha1(repr(sorted(values.items())).encode()).hexdigest()
+
+    def get_bulk_update_fields(self):
+        # The natural key fields can still change in case or spacing
+        return list(self.fields)
+
+    def before_import(self, dataset, **kwargs):
+        self.seen_keys = set()
+        self.changes = []
+
+    def before_import_row(self, row, **kwargs):
+        key = self.row_key(row)
+        if key in self.seen_keys:
+            raise ValidationError({'name': "Appears more than once in this file."})
+        self.seen_keys.add(key)
+
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        if import_validation_errors or instance.pk is None:
+            return False
+        return self.content_hash(self.content_values(instance)) == instance._import_hash
+
+    def before_save_instance(self, instance, row, **kwargs):
+        if instance.pk is not None:
+            values = self.content_values(instance)
+            self.changes.append((instance, {
+                name: (old, values[name]) for name, old in instance._import_values.items() if values[name] != old
+            }))
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        result.diff_summary = self.summarize(result)
+
+    def summarize(self, result):
+        """
+        One line with the totals and the number of rows changed per field, then one line
+        per changed row (the first ``SUMMARY_CHANGES``) with its old and new values.
+        """
+        totals = result.totals
+        per_field = {}
+        for _, changed in self.changes:
+            for name in changed:
+                per_field[name] = per_field.get(name, 0) + 1
+        updated = f"{totals['update']} updated"
+        if per_field:
+            updated += f" ({', '.join(f'{name}: {count}' for name, count in per_field.items())})"
+        lines = [
+            f"{self._meta.model._meta.verbose_name_plural.capitalize()}: {totals['new']} new, {updated}, "
+            f"{totals['skip']} unchanged, {totals['invalid'] + totals['error']} failed."
+        ]
+        for instance, changed in self.changes[:SUMMARY_CHANGES]:
+            lines.append(f"{instance}: " + ', '.join(
+                f"{name} {'-' if old is None else old} → {'-' if new is None else new}"
+                for name, (old, new) in changed.items()
+            ))
+        if len(self.changes) > SUMMARY_CHANGES:
+            lines.append(f"… and {len(self.changes) - SUMMARY_CHANGES} more changed rows.")
+        return lines
+
+
+def _coordinate(value):
+    # Compare coordinates at the precision the database stores them with
+    return None if value is None else Decimal(value).quantize(Decimal('0.000001'))
+
+
+class DistrictNameWidget(ForeignKeyWidget):
+    """District by name, looked up in a table loaded once per import instead of a query per row."""
+
+    def __init__(self, **kwargs):
+        super().__init__(District, field='name', **kwargs)
+        self.districts = None
+
+    def clean(self, value, row=None, **kwargs):
+        if not value:
+            return None
+        if self.districts is None:
+            self.districts = {natural_name(district.name): district for district in District.objects.all()}
+        try:
+            return self.districts[natural_name(value)]
+        except KeyError:
+            raise ValueError(f"Unknown district '{value}'.")
+
+
+class TehsilResource(NaturalKeyResource):
+    district = fields.Field(attribute='district', column_name='district', widget=DistrictNameWidget())
+
+    class Meta(NaturalKeyResource.Meta):
         model = Tehsil
-        # You can specify fields to include or exclude here
-        # fields = ('id', 'name', 'district', 'latitude', 'longitude')  # Include only specified fields
+        # Tehsils are matched by district name + tehsil name, not by id
+        fields = ('name', 'district', 'latitude', 'longitude')
+        import_id_fields = ('district', 'name')
 
-class DistrictResource(resources.ModelResource):
-    class Meta:
+    def get_queryset(self):
+        return super().get_queryset().select_related('district')
+
+    def natural_key(self, instance):
+        return natural_name(instance.district.name), natural_name(instance.name)
+
+    def row_key(self, row):
+        return natural_name(row.get('district')), natural_name(row.get('name'))
+
+    def content_values(self, instance):
+        return {
+            'name': instance.name,
+            'district': instance.district.name if instance.district_id else None,
+            'latitude': _coordinate(instance.latitude),
+            'longitude': _coordinate(instance.longitude),
+        }
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        # bulk_create/bulk_update send no post_save signals
+        if not self._is_dry_run(kwargs) and (result.totals['new'] or result.totals['update']):
+            invalidate_tehsils_map()
+            bump_reference_data_version()
+
+
+class DistrictResource(NaturalKeyResource):
+    class Meta(NaturalKeyResource.Meta):
         model = District
-        # Optionally specify fields to include or exclude
-        # fields = ('id', 'name')  # Include only specified fields
\ No newline at end of file
+        fields = ('name',)
+        import_id_fields = ('name',)
+
+    def natural_key(self, instance):
+        return natural_name(instance.name)
+
+    def row_key(self, row):
+        return natural_name(row.get('name'))
+
+    def content_values(self, instance):
+        return {'name': instance.name}
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        if not self._is_dry_run(kwargs) and (result.totals['new'] or result.totals['update']):
+            bump_reference_data_version()
+            if result.totals['update']:
+                invalidate_tehsils_map()
@@ -0,0 +1,222 @@
+import logging
+import re
+
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Member
+
+# FTS5 table mirroring the searchable member columns, kept in sync by triggers (migration 0045_member_search_index)
+MEMBER_FTS_TABLE = 'main_app_member_fts'
+MEMBER_FTS_VOCAB_TABLE = 'main_app_member_fts_vocab'
+
+# Indexed columns in table order, with their bm25 weights
+MEMBER_FTS_COLUMNS = {
+    'full_name': 10.0,
+    'father_name': 3.0,
+    'business_name': 5.0,
+    'present_address': 1.0,
+    'permanent_address': 1.0,
+    'business_address': 1.0,
+    'cnic': 10.0,
+    'currency_association_id': 10.0,
+}
+
+# Member columns of the index, the last one comes from the member's user
+MEMBER_FTS_MEMBER_COLUMNS = tuple(MEMBER_FTS_COLUMNS)[:-1]
+_INDEXED = ', '.join(MEMBER_FTS_COLUMNS)
+_NEW_VALUES = ', '.join(f'new.{column}' for column in MEMBER_FTS_MEMBER_COLUMNS)
+_ASSOCIATION_ID = '(SELECT currency_association_id FROM main_app_user WHERE id = new.user_id)'
+
+# The triggers of migration 0045 that keep the index in sync. SQLite drops a table's triggers
+# when a migration rebuilds it (most AlterField/RemoveField operations do), so they are checked
+# before every search and recreated after every migrate, see repair_member_search_index.
+MEMBER_FTS_TRIGGERS = {
+    'main_app_member_fts_insert': f"""CREATE TRIGGER main_app_member_fts_insert AFTER INSERT ON main_app_member BEGIN
+        INSERT INTO {MEMBER_FTS_TABLE} (rowid, {_INDEXED}) VALUES (new.id, {_NEW_VALUES}, {_ASSOCIATION_ID});
+    END""",
+    'main_app_member_fts_update': f"""CREATE TRIGGER main_app_member_fts_update
+        AFTER UPDATE OF {', '.join(MEMBER_FTS_MEMBER_COLUMNS)}, user_id ON main_app_member BEGIN
+        DELETE FROM {MEMBER_FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {MEMBER_FTS_TABLE} (rowid, {_INDEXED}) VALUES (new.id, {_NEW_VALUES}, {_ASSOCIATION_ID});
+    END""",
+    'main_app_member_fts_delete': f"""CREATE TRIGGER main_app_member_fts_delete AFTER DELETE ON main_app_member BEGIN
+        DELETE FROM {MEMBER_FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    'main_app_user_fts_update': f"""CREATE TRIGGER main_app_user_fts_update
+        AFTER UPDATE OF currency_association_id ON main_app_user BEGIN
+        UPDATE {MEMBER_FTS_TABLE} SET currency_association_id = new.currency_association_id
+        WHERE rowid IN (SELECT id FROM main_app_member WHERE user_id = new.id);
+    END""",
+}
+
+_FILL_INDEX = f"""INSERT INTO {MEMBER_FTS_TABLE} (rowid, {_INDEXED})
+    SELECT member.id, {', '.join(f'member.{column}' for column in MEMBER_FTS_MEMBER_COLUMNS)}, user.currency_association_id
+    FROM main_app_member member JOIN main_app_user user ON user.id = member.user_id"""
+
+logger = logging.getLogger(__name__)
+
+# Used where the index does not exist (other databases)
+FALLBACK_SEARCH_FIELDS = ('full_name', 'father_name', 'business_name', 'cnic', 'user__currency_association_id')
+
+MAX_QUERY_TERMS = 8
+# Terms this long that match nothing are also looked up with one typo (two from TYPO_LENGTH_2 on)
+MIN_TYPO_LENGTH = 4
+TYPO_LENGTH_2 = 8
+MAX_TYPO_CANDIDATES = 5
+
+
+def _missing_index_objects(connection):
+    """The index table and triggers missing from ``connection``'s schema."""
+    expected = [MEMBER_FTS_TABLE, *MEMBER_FTS_TRIGGERS]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT name FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(expected))})", expected)
+        present = {name for name, in cursor.fetchall()}
+    return [name for name in expected if name not in present]
+
+
+def member_search_available():
+    """
+    Whether the FTS index exists and its triggers keep it current. Checked on every search
+    (one read of sqlite_master): without its triggers the index goes stale silently, so
+    searches fall back to LIKE until repair_member_search_index has run.
+    """
+    return connection.vendor == 'sqlite' and not _missing_index_objects(connection)
+
+
+def repair_member_search_index(using='default', **kwargs):
+    """
+    Recreate the triggers a table rebuild dropped and refill the index, which missed the
+    writes made without them. Connected to post_migrate; returns whether anything was missing.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    missing = _missing_index_objects(connection)
+    if not missing or MEMBER_FTS_TABLE in missing:
+        # Up to date, or before migration 0045 (or after reversing it)
+        return False
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for name in missing:
+            cursor.execute(MEMBER_FTS_TRIGGERS[name])
+        cursor.execute(f'DELETE FROM {MEMBER_FTS_TABLE}')
+        cursor.execute(_FILL_INDEX)
+    logger.warning("Recreated the member search triggers %s and rebuilt the index.", ', '.join(missing))
+    return True
+
+
+def query_terms(query):
+    """Lower-case words of ``query``; digit groups like ``12345-1234567-1`` are joined as CNICs are stored."""
+    query = re.sub(r'(?<=\d)[\s-]+(?=\d)', '', query)
+    return re.findall(r'\w+', query.casefold())[:MAX_QUERY_TERMS]
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between ``a`` and ``b``, or ``limit + 1`` once it
+    exceeds ``limit``. Only cells within ``limit`` of the diagonal are computed.
+    """
+    over = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return over
+    n = len(b)
+    previous2, previous = None, [j if j <= limit else over for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (n + 1)
+        if i <= limit:
+            current[0] = i
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(max(1, i - limit), min(n, i + limit) + 1):
+            # Plain comparisons, min() is noticeably slower over a few thousand vocabulary terms
+            value = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+def _typo_candidates(cursor, term):
+    """Indexed terms within one or two edits of ``term``, the closest first. Only terms with its first letter are tried."""
+    limit = 2 if len(term) >= TYPO_LENGTH_2 else 1
+    cursor.execute(
+        f'SELECT term FROM {MEMBER_FTS_VOCAB_TABLE} WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s',
+        [term[0], term[0] + '\U0010ffff', len(term) - limit, len(term) + limit],
+    )
+    scored = sorted((distance, candidate) for candidate, in cursor.fetchall()
+                    if (distance := edit_distance(term, candidate, limit)) <= limit)
+    return [candidate for _, candidate in scored[:MAX_TYPO_CANDIDATES]]
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for ``query``, or None if it has no words. Every word must match
+    as a prefix; a word that is no prefix of any indexed term matches its near spellings
+    instead.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+    parts = []
+    with connection.cursor() as cursor:
+        for term in terms:
+            options = [f'"{term}"*']
+            if len(term) >= MIN_TYPO_LENGTH:
+                cursor.execute(f'SELECT 1 FROM {MEMBER_FTS_VOCAB_TABLE} WHERE term >= %s AND term < %s LIMIT 1',
+                               [term, term + '\U0010ffff'])
+                if cursor.fetchone() is None:
+                    options += [f'"{candidate}"' for candidate in _typo_candidates(cursor, term)]
+            parts.append(f"({' OR '.join(options)})")
+    return ' AND '.join(parts)
+
+
+def _fallback_filter(terms):
+    condition = Q()
+    for term in terms:
+        condition &= Q(*[Q(**{f'{field}__icontains': term}) for field in FALLBACK_SEARCH_FIELDS], _connector=Q.OR)
+    return condition
+
+
+def filter_search(members, query):
+    """Narrow ``members`` to those matching ``query``; with the index this is one ``id IN (MATCH)`` subquery."""
+    if not member_search_available():
+        terms = query_terms(query)
+        return members.filter(_fallback_filter(terms)) if terms else members
+    expression = match_expression(query)
+    if expression is None:
+        return members
+    return members.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {MEMBER_FTS_TABLE} WHERE {MEMBER_FTS_TABLE} MATCH %s', [expression],
+    ))
+
+
+def search_members(query, limit=20):
+    """The ``limit`` best matches for ``query``, ranked by bm25 with names and IDs weighted highest."""
+    if not member_search_available():
+        terms = query_terms(query)
+        if not terms:
+            return []
+        return list(Member.objects.for_listing().filter(_fallback_filter(terms)).order_by('full_name')[:limit])
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    weights = ', '.join(str(weight) for weight in MEMBER_FTS_COLUMNS.values())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {MEMBER_FTS_TABLE} WHERE {MEMBER_FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({MEMBER_FTS_TABLE}, {weights}) LIMIT %s',
+            [expression, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    members = Member.objects.for_listing().in_bulk(ids)
+    return [members[member_id] for member_id in ids if member_id in members]
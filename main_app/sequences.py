@@ -0,0 +1,162 @@
+import re
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ApplicationIdCounter, IdSequence, Member, MemberChangeRequest, User
+
+CURRENCY_ASSOCIATION_SEQUENCE = 'currency_association_id'
+CURRENCY_ASSOCIATION_PREFIX = 'CEA-'
+CURRENCY_ASSOCIATION_FIRST_NUMBER = 200
+
+
+def parse_currency_association_number(currency_association_id):
+    """Return the numeric part of a ``CEA-0123`` style ID, or None if it doesn't have one."""
+    if not currency_association_id or not currency_association_id.startswith(CURRENCY_ASSOCIATION_PREFIX):
+        return None
+    number = currency_association_id[len(CURRENCY_ASSOCIATION_PREFIX):]
+    return int(number) if number.isdigit() else None
+
+
+def highest_currency_association_number():
+    """Highest number already used, compared as integers so CEA-10000 sorts after CEA-9999."""
+    ids = User.objects.filter(currency_association_id__startswith=CURRENCY_ASSOCIATION_PREFIX) \
+        .values_list('currency_association_id', flat=True)
+    numbers = [number for number in map(parse_currency_association_number, ids) if number is not None]
+    return max(numbers, default=CURRENCY_ASSOCIATION_FIRST_NUMBER - 1)
+
+
+def _advance(model, key, count, initial):
+    """
+    Atomically add ``count`` to the ``last_value`` of the counter row matching ``key`` and
+    return the reserved numbers as a range.
+
+    The UPDATE locks the row until the surrounding transaction ends, so concurrent callers
+    queue on that single row instead of racing on a read-then-write. If the row doesn't exist
+    yet it is created from ``initial()`` (the last value already in use).
+    """
+    counter = model.objects.filter(**key)
+    with transaction.atomic():
+        if not counter.update(last_value=F('last_value') + count):
+            try:
+                with transaction.atomic():
+                    model.objects.create(**key, last_value=(initial() if initial else 0) + count)
+            except IntegrityError:
+                # Another process created it first
+                counter.update(last_value=F('last_value') + count)
+        last_value = counter.values_list('last_value', flat=True).get()
+    return range(last_value - count + 1, last_value + 1)
+
+
+def reserve(name, count=1, initial=None):
+    """Atomically advance the IdSequence ``name`` by ``count``, see ``_advance``."""
+    return _advance(IdSequence, {'name': name}, count, initial)
+
+
+class BlockAllocator:
+    """
+    Hand out numbers from a sequence, reserving ``block_size`` of them per database round trip.
+
+    The numbers left over from a block are kept in this process and only once the reserving
+    transaction has committed, so a rollback can never leave two processes holding the same
+    number. Unused numbers are lost when the process exits, which leaves gaps but no duplicates.
+    """
+
+    def __init__(self, name, block_size=1, initial=None):
+        self.name = name
+        self.block_size = block_size
+        self.initial = initial
+        self._lock = threading.Lock()
+        self._numbers = iter(())
+
+    def _add_block(self, numbers):
+        with self._lock:
+            self._numbers = iter(list(self._numbers) + list(numbers))
+
+    def next(self):
+        with self._lock:
+            number = next(self._numbers, None)
+        if number is not None:
+            return number
+
+        numbers = reserve(self.name, self.block_size, initial=self.initial)
+        if len(numbers) > 1:
+            transaction.on_commit(lambda: self._add_block(numbers[1:]))
+        return numbers[0]
+
+    def take(self, count):
+        """Return ``count`` numbers reserved in one round trip (used by bulk imports)."""
+        return list(reserve(self.name, count, initial=self.initial))
+
+
+currency_association_ids = BlockAllocator(
+    CURRENCY_ASSOCIATION_SEQUENCE,
+    block_size=getattr(settings, 'CURRENCY_ASSOCIATION_ID_BLOCK_SIZE', 1),
+    initial=highest_currency_association_number,
+)
+
+
+def format_currency_association_id(number):
+    return f'{CURRENCY_ASSOCIATION_PREFIX}{number:04d}'  # Keep at least 4 digits
+
+
+FEE_TYPE_CODES = {
+    'new registration': 'NRG',
+    'renewal': 'RNW',
+    'change of information': 'ICG',
+    'transfer of ownership': 'TOO',
+    'transfer of ownership (DEATH OF ORIGINAL OWNER)': 'TOD',
+}
+
+APPLICATION_ID_PREFIX = 'PK-CEAAJK'
+APPLICATION_ID_PATTERN = re.compile(rf'^{APPLICATION_ID_PREFIX}-(?P<fee_code>[A-Z]+)-(?P<year>\d{{4}})-(?P<number>\d+)$')
+
+
+def format_application_id(fee_code, year, number):
+    return f"{APPLICATION_ID_PREFIX}-{fee_code}-{year}-{number:04d}"
+
+
+def parse_application_id(application_id):
+    """Split an application ID into ``(fee_code, year, number)``, or None if it isn't one."""
+    match = APPLICATION_ID_PATTERN.match(application_id or '')
+    if not match:
+        return None
+    return match['fee_code'], int(match['year']), int(match['number'])
+
+
+def application_ids_in_use():
+    """Every application ID stored on members and change requests."""
+    for model in (Member, MemberChangeRequest):
+        yield from model.objects.exclude(application_id__isnull=True) \
+            .values_list('application_id', flat=True).iterator()
+
+
+def highest_application_number(fee_code, year):
+    prefix = format_application_id(fee_code, year, 0).rsplit('-', 1)[0] + '-'
+    numbers = [0]
+    for model in (Member, MemberChangeRequest):
+        for application_id in model.objects.filter(application_id__startswith=prefix) \
+                .values_list('application_id', flat=True):
+            parsed = parse_application_id(application_id)
+            if parsed:
+                numbers.append(parsed[2])
+    return max(numbers)
+
+
+def reserve_application_numbers(fee_code, year, count):
+    """
+    Reserve ``count`` consecutive application numbers for ``fee_code`` in ``year`` with a
+    single-row update. A counter that doesn't exist yet starts after the highest number
+    already stored for that code and year (the backfill_application_counters command seeds
+    them all up front).
+    """
+    return _advance(
+        ApplicationIdCounter, {'fee_code': fee_code, 'year': year}, count,
+        initial=lambda: highest_application_number(fee_code, year),
+    )
+
+
+def next_application_number(fee_code, year):
+    return reserve_application_numbers(fee_code, year, 1)[0]
@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .autocomplete import AUTOCOMPLETE_FIELDS, members_changed
+from .maps import invalidate_tehsils_map
+from .models import CardExport, District, Fee, Member, MembershipStats, Payment, PdfJob, Tehsil, User
+from .reference_data import bump_reference_data_version
+from .stats import (NOT_LOADED, STATS_KEY_FIELDS, apply_stats_deltas, move_location_stats,
+                    rebuild_membership_stats, record_member_transitions, stored_stats_key, stats_key)
+from .timeseries import bump_timeseries_version, in_closed_bucket, renewal_day
+
+# Fields whose update_fields can move a member to another MembershipStats row
+STATS_UPDATE_FIELDS = frozenset(STATS_KEY_FIELDS) | {'district', 'tehsil'}
+
+
+def autocomplete_values(instance):
+    return tuple(instance.__dict__.get(field) for field in AUTOCOMPLETE_FIELDS)
+
+
+@receiver(post_init, sender=Member)
+def remember_member_location(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded just to remember them
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._loaded_tehsil_id = instance.__dict__.get('tehsil_id')
+    instance._loaded_joined_at = instance.__dict__.get('joined_at')
+    instance._loaded_autocomplete = autocomplete_values(instance) if instance.pk is not None else None
+    # Unsaved members are not counted anywhere yet
+    instance._stats_key = stats_key(instance.__dict__) if instance.pk is not None else None
+
+
+@receiver(pre_save, sender=Member)
+def read_member_stats_key(sender, instance, **kwargs):
+    # A partially loaded member's key has to be read before the save overwrites it
+    if instance._stats_key is NOT_LOADED:
+        instance._stats_key = stored_stats_key(instance)
+
+
+@receiver(post_save, sender=Member)
+def member_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or instance.status != instance._loaded_status or instance.tehsil_id != instance._loaded_tehsil_id:
+        invalidate_tehsils_map()
+    instance._loaded_status = instance.status
+    instance._loaded_tehsil_id = instance.tehsil_id
+    if created or update_fields is None or STATS_UPDATE_FIELDS.intersection(update_fields):
+        record_member_transitions([instance])
+    # Setting joined_at on approval only touches the current time series bucket, back-dating it rewrites history
+    joined_at = instance.__dict__.get('joined_at')
+    if joined_at != instance._loaded_joined_at and in_closed_bucket(joined_at, instance._loaded_joined_at):
+        bump_timeseries_version()
+    instance._loaded_joined_at = joined_at
+    if created or autocomplete_values(instance) != instance._loaded_autocomplete:
+        members_changed([instance.pk])
+    instance._loaded_autocomplete = autocomplete_values(instance)
+
+
+@receiver(pre_delete, sender=Member)
+def member_deleting(sender, instance, **kwargs):
+    # Before the row is gone, in case the key has to be read from the database
+    key = stored_stats_key(instance)
+    if key is not None:
+        apply_stats_deltas({key: -1})
+
+
+@receiver(post_delete, sender=Member)
+def member_deleted(sender, instance, **kwargs):
+    invalidate_tehsils_map()
+    if in_closed_bucket(instance.__dict__.get('created_at'), instance.__dict__.get('joined_at')):
+        bump_timeseries_version()
+    members_changed([instance.pk])
+
+
+@receiver(post_init, sender=Fee)
+def remember_renewal_day(sender, instance, **kwargs):
+    instance._loaded_renewal_day = renewal_day(instance.__dict__) if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Fee)
+def fee_saved(sender, instance, created, **kwargs):
+    # Covers new back-dated renewals and fees moved into or out of the renewal type too
+    day = renewal_day(instance.__dict__)
+    if day != instance._loaded_renewal_day and in_closed_bucket(day, instance._loaded_renewal_day):
+        bump_timeseries_version()
+    instance._loaded_renewal_day = day
+
+
+@receiver(post_delete, sender=Fee)
+def fee_deleted(sender, instance, **kwargs):
+    if in_closed_bucket(renewal_day(instance.__dict__)):
+        bump_timeseries_version()
+
+
+@receiver(post_save, sender=Tehsil)
+@receiver(post_delete, sender=Tehsil)
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+def location_changed(sender, instance, **kwargs):
+    invalidate_tehsils_map()
+
+
+def deleted_locations(origin):
+    """``(district ids, tehsil ids)`` a delete started from ``origin`` removes, None if it did not start from a location."""
+    if isinstance(origin, QuerySet):
+        model, ids = origin.model, set(origin.values_list('pk', flat=True))
+    else:
+        model, ids = type(origin), {origin.pk}
+    if model is District:
+        # Tehsils go with their district
+        return ids, set(Tehsil.objects.filter(district__in=ids).values_list('pk', flat=True))
+    if model is Tehsil:
+        return set(), ids
+    return None
+
+
+@receiver(pre_delete, sender=Tehsil)
+@receiver(pre_delete, sender=District)
+def location_deleting(sender, instance, origin=None, **kwargs):
+    # Members are moved off the location by an UPDATE (SET_NULL), which sends no signals, and
+    # the location's MembershipStats rows are deleted with it; their counts move to the rows
+    # the members end up in
+    locations = deleted_locations(origin)
+    if locations is None:
+        transaction.on_commit(rebuild_membership_stats)
+        return
+    district_ids, tehsil_ids = locations
+    if sender is District:
+        stats = MembershipStats.objects.filter(district=instance)
+    else:
+        # Rows of a district deleted as well are moved by the district
+        stats = MembershipStats.objects.filter(tehsil=instance).exclude(district__in=district_ids)
+    move_location_stats(stats, district_ids, tehsil_ids)
+
+
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+@receiver(post_save, sender=Tehsil)
+@receiver(post_delete, sender=Tehsil)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def reference_data_changed(sender, instance, **kwargs):
+    bump_reference_data_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # CustomBackend.get_user keeps users in the cache
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_init, sender=User)
+def remember_currency_association_id(sender, instance, **kwargs):
+    instance._loaded_currency_association_id = instance.__dict__.get('currency_association_id')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Logins save users too, only a new association ID changes what autocomplete lists
+    currency_association_id = instance.__dict__.get('currency_association_id')
+    if not created and currency_association_id != instance._loaded_currency_association_id:
+        members_changed(Member.objects.filter(user=instance).values_list('id', flat=True))
+    instance._loaded_currency_association_id = currency_association_id
+
+
+@receiver(post_delete, sender=PdfJob)
+@receiver(post_delete, sender=CardExport)
+def document_deleted(sender, instance, **kwargs):
+    # Also when a deleted member takes its PDF jobs along
+    if instance.file:
+        instance.file.delete(save=False)
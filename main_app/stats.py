@@ -0,0 +1,216 @@
+from collections import Counter
+from datetime import date, datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import Member, MembershipStats
+
+# Which date decides the month a member is counted in, per status
+STATUS_DATE_FIELDS = {
+    'active': 'joined_at',
+    'pending': 'created_at',
+    'suspended': 'joined_at',
+    'expired': 'joined_at',
+}
+
+# Member columns that decide the MembershipStats row a member is counted in
+STATS_KEY_FIELDS = ('status', 'joined_at', 'created_at', 'district_id', 'tehsil_id')
+
+# Marks a member loaded without one of STATS_KEY_FIELDS
+NOT_LOADED = object()
+
+MAX_MONTHS = 60
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def parse_month(value):
+    """Parse a ``YYYY-MM`` string into the first day of that month."""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def calculate_percentage_change(current, previous):
+    if previous == 0:
+        return 100 if current > 0 else 0
+    return round(((current - previous) / previous) * 100, 2)
+
+
+def stats_key(values):
+    """
+    The ``(day, district id, tehsil id, status)`` a member with these column ``values`` is
+    counted under, None for members without a status, NOT_LOADED if a column is missing.
+    """
+    if any(field not in values for field in STATS_KEY_FIELDS):
+        return NOT_LOADED
+    status = values['status']
+    if status is None:
+        return None
+    moment = values[STATUS_DATE_FIELDS.get(status, 'created_at')]
+    return timezone.localdate(moment) if moment else None, values['district_id'], values['tehsil_id'], status
+
+
+def _read_stats_key(member):
+    values = Member.objects.filter(pk=member.pk).values(*STATS_KEY_FIELDS).first()
+    return stats_key(values) if values is not None else None
+
+
+def stored_stats_key(member):
+    """The key ``member`` is counted under in the database, read again only if it was loaded partially."""
+    key = getattr(member, '_stats_key', NOT_LOADED)
+    return _read_stats_key(member) if key is NOT_LOADED else key
+
+
+def apply_stats_deltas(deltas):
+    """Add ``{key: change}`` to the MembershipStats rows, creating the rows that do not exist yet."""
+    for (day, district_id, tehsil_id, status), change in deltas.items():
+        if not change:
+            continue
+        rows = MembershipStats.objects.filter(day=day, district_id=district_id, tehsil_id=tehsil_id, status=status)
+        # One row only: keys with NULLs are not covered by the unique constraint
+        if MembershipStats.objects.filter(pk__in=rows.values('pk')[:1]).update(count=F('count') + change):
+            continue
+        try:
+            with transaction.atomic():
+                MembershipStats.objects.create(day=day, district_id=district_id, tehsil_id=tehsil_id,
+                                               status=status, count=change)
+        except IntegrityError:
+            # Created concurrently
+            MembershipStats.objects.filter(pk__in=rows.values('pk')[:1]).update(count=F('count') + change)
+
+
+def record_member_transitions(members):
+    """
+    Move each member's count from the key it was loaded with to its current one, after the
+    members were written. The member signals do this on save; code writing members with
+    bulk_create or bulk_update calls it itself.
+    """
+    deltas = Counter()
+    for member in members:
+        old, new = stored_stats_key(member), stats_key(member.__dict__)
+        if new is NOT_LOADED:
+            # Already written, so the database has the new values
+            new = _read_stats_key(member)
+        if old != new:
+            if old is not None:
+                deltas[old] -= 1
+            if new is not None:
+                deltas[new] += 1
+        member._stats_key = new
+    apply_stats_deltas(deltas)
+
+
+def move_location_stats(stats, district_ids, tehsil_ids):
+    """
+    Add the counts of the MembershipStats rows ``stats`` to the rows their members are
+    counted under once the districts ``district_ids`` and tehsils ``tehsil_ids`` are
+    deleted and the members' references set to NULL. The rows themselves are removed by
+    the cascade.
+    """
+    deltas = Counter()
+    for day, district_id, tehsil_id, status, count in stats.values_list('day', 'district_id', 'tehsil_id',
+                                                                      'status', 'count'):
+        deltas[day, None if district_id in district_ids else district_id,
+               None if tehsil_id in tehsil_ids else tehsil_id, status] += count
+    apply_stats_deltas(deltas)
+
+
+def stats_day():
+    """Expression for the day a member is counted under, the ORM version of ``stats_key``."""
+    return Case(
+        *[When(status=status, then=TruncDate(date_field)) for status, date_field in STATUS_DATE_FIELDS.items()],
+        default=TruncDate('created_at'),
+    )
+
+
+def member_stats_groups(members):
+    """``{key: count}`` of ``members`` grouped like MembershipStats, in one grouped query."""
+    rows = (members.exclude(status=None).order_by()
+            .annotate(stats_day=stats_day()).values('stats_day', 'district_id', 'tehsil_id', 'status')
+            .annotate(count=Count('id')))
+    return {(row['stats_day'], row['district_id'], row['tehsil_id'], row['status']): row['count'] for row in rows}
+
+
+def rebuild_membership_stats():
+    """Recompute every MembershipStats row from the members table in a single grouped pass."""
+    with transaction.atomic():
+        # Deleting first takes the write lock (SQLite), so no member changes between the count and the insert
+        MembershipStats.objects.all().delete()
+        groups = member_stats_groups(Member.objects.all())
+        MembershipStats.objects.bulk_create([
+            MembershipStats(day=day, district_id=district_id, tehsil_id=tehsil_id, status=status, count=count)
+            for (day, district_id, tehsil_id, status), count in groups.items()
+        ], batch_size=1000)
+    return len(groups)
+
+
+def membership_stats_drift():
+    """
+    ``{status: (rollup count, live count)}`` for the statuses whose MembershipStats total no
+    longer matches the members table. The signals miss update(), bulk_update and raw SQL
+    writes, so the rollup can drift from them; the live counts take one aggregate query.
+    """
+    live = Member.objects.aggregate(**{status: Count('pk', filter=Q(status=status)) for status in STATUS_DATE_FIELDS})
+    rollup = dict(MembershipStats.objects.order_by().values_list('status').annotate(total=Sum('count')))
+    return {
+        status: (rollup.get(status, 0), live[status])
+        for status in STATUS_DATE_FIELDS
+        if rollup.get(status, 0) != live[status]
+    }
+
+
+def monthly_status_totals(since, until):
+    """``{'month', 'status', 'count'}`` rows of the MembershipStats rollup for the days from ``since`` up to ``until``."""
+    return (MembershipStats.objects.filter(day__gte=since, day__lt=until)
+            .annotate(month=TruncMonth('day')).values('month', 'status')
+            .annotate(count=Sum('count')))
+
+
+def monthly_status_counts(first_month, last_month):
+    """
+    Count the members of every status for every month from ``first_month`` to
+    ``last_month`` (inclusive) from the MembershipStats rollup, in one grouped query.
+
+    Returns a list of ``{'month': 'YYYY-MM', 'active': n, 'pending': n, 'suspended': n, 'expired': n}``.
+    """
+    first_month = month_start(first_month)
+    last_month = month_start(last_month)
+    months = []
+    month = first_month
+    while month <= last_month:
+        months.append(month)
+        month = add_months(month, 1)
+    if not months:
+        return []
+    if len(months) > MAX_MONTHS:
+        raise ValueError(f'A range can cover at most {MAX_MONTHS} months.')
+
+    totals = {
+        (row['month'], row['status']): row['count']
+        for row in monthly_status_totals(months[0], add_months(months[-1], 1))
+    }
+    return [
+        {
+            'month': f'{month:%Y-%m}',
+            **{status: totals.get((month, status), 0) for status in STATUS_DATE_FIELDS},
+        }
+        for month in months
+    ]
+
+
+def monthly_status_changes(first_month, last_month):
+    """Same as ``monthly_status_counts`` with the percentage change against the month before."""
+    rows = monthly_status_counts(add_months(month_start(first_month), -1), last_month)
+    for previous, current in zip(rows, rows[1:]):
+        for status in STATUS_DATE_FIELDS:
+            current[f'{status}_percentage_change'] = calculate_percentage_change(current[status], previous[status])
+    return rows[1:]
@@ -1,3 +1,1213 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from tablib import Dataset
+
+from . import autocomplete, expiry
+from .card_export import delete_expired_exports
+from .approvals import approve_change_requests, reject_change_requests
+from .authentication import CustomBackend, _attempts_key, record_failed_login, user_cache_key
+from .change_requests import build_change_request, diff_member, edit_change
+from .exports import stream_csv
+from .pagination import encode_cursor, keyset_paginate
+from .pdf_renderers import ProcessPoolRenderer, get_renderer
+from .pdfs import claim_next_job, delete_old_pdfs, render_unclaimed, request_pdf, run_job
+from .maps import TEHSILS_MAP_CACHE_KEY
+from .member_import import MemberImporter, read_rows
+from .reference_data import get_reference_data, reference_data_version
+from .resources import DistrictResource, TehsilResource
+from .search import (edit_distance, match_expression, member_search_available, repair_member_search_index,
+                     search_members)
+from .sequences import (BlockAllocator, highest_currency_association_number, reserve,
+                        reserve_application_numbers)
+from .models import CardExport, District, ExpirySweep, Fee, Member, MemberChangeRequest, MembershipStats, Payment, PdfJob, Tehsil, User
+from .stats import membership_stats_drift, rebuild_membership_stats, record_member_transitions
+from .timeseries import timeseries, timeseries_version
+
+
+def create_member(number, **kwargs):
+    user = User.objects.create(username=f'CEA-{number:04d}', currency_association_id=f'CEA-{number:04d}',
+                               role='member')
+    district, _ = District.objects.get_or_create(name='Muzaffarabad')
+    tehsil, _ = Tehsil.objects.get_or_create(name='Muzaffarabad', district=district)
+    fields = {
+        'user': user,
+        'full_name': f'Member {number}',
+        'father_name': 'Father',
+        'cnic': f'{number:013d}',
+        'dob': datetime.date(1990, 1, 1),
+        'gender': 'male',
+        'nic_type': 'cnic',
+        'present_address': 'Present address',
+        'permanent_address': 'Permanent address',
+        'pri_mob': '03000000000',
+        'business_name': 'Exchange',
+        'business_address': 'Business address',
+        'employee_number': '1',
+        'tehsil': tehsil,
+        'district': district,
+        'status': 'active',
+    }
+    fields.update(kwargs)
+    return Member.objects.create(**fields)
+
+
+def create_fee(member, **kwargs):
+    payment, _ = Payment.objects.get_or_create(submission_method='cash', title='Cash')
+    fields = {
+        'member': member,
+        'fee_type': 'renewal',
+        'submission_method': 'cash',
+        'amount_submitted': 1000,
+        'amount_remaining': 0,
+        'payment': payment,
+    }
+    fields.update(kwargs)
+    return Fee.objects.create(**fields)
+
+
+def create_change_request(member, **new_values):
+    changes = {name: {'previous': None, 'new': str(value)} for name, value in new_values.items()}
+    return MemberChangeRequest.objects.create(member=member, fee=create_fee(member), changes=changes,
+                                              **{f'new_{name}': value for name, value in new_values.items()})
+
+
+def stored_stats():
+    return {(row.day, row.district_id, row.tehsil_id, row.status): row.count
+            for row in MembershipStats.objects.exclude(count=0)}
+
+
+class StatsAssertionsMixin:
+    def assertStatsMatchRebuild(self):
+        # The incrementally kept rollup against the one rebuilt from the members table
+        kept = stored_stats()
+        rebuild_membership_stats()
+        self.assertEqual(kept, stored_stats())
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.members = [create_member(number) for number in range(1, 6)]
+        self.now = timezone.now().replace(microsecond=0)
+
+    def pages(self, sort_field, limit=2, descending=False):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = keyset_paginate(Member.objects.all(), sort_field, cursor, limit, descending)
+            ids.append([member.pk for member in rows])
+            if cursor is None:
+                return ids
+
+    def test_datetime_cursor(self):
+        for offset, member in zip((3, 1, 4, 0, 2), self.members):
+            Member.objects.filter(pk=member.pk).update(created_at=self.now - datetime.timedelta(minutes=offset))
+        newest_first = [self.members[index].pk for index in (3, 1, 4, 0, 2)]
+        self.assertEqual(self.pages('created_at', descending=True),
+                         [newest_first[:2], newest_first[2:4], newest_first[4:]])
+        self.assertEqual(sum(self.pages('created_at'), []), newest_first[::-1])
+
+    def test_ties_are_broken_by_id(self):
+        Member.objects.update(created_at=self.now)
+        ids = [member.pk for member in self.members]
+        self.assertEqual(self.pages('created_at'), [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(sum(self.pages('created_at', limit=3, descending=True), []), ids[::-1])
+
+    def test_last_page_has_no_cursor(self):
+        self.assertIsNone(keyset_paginate(Member.objects.all(), 'id', limit=5)[1])
+        self.assertEqual(self.pages('full_name', limit=5), [[member.pk for member in self.members]])
+
+    def test_bad_cursors(self):
+        staff = User.objects.create(username='admin', currency_association_id='ADMIN', role='admin', is_staff=True)
+        self.client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('members_data'), {'limit': 5})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIsNone(response.json()['next_cursor'])
+        for cursor in ('not a cursor!', 'e30', encode_cursor(['2026-01-01T00:00:00+00:00']),
+                       encode_cursor(['yesterday', 1]), encode_cursor(['2026-13-45T00:00:00', 1]),
+                       encode_cursor([5, 1]), encode_cursor(['2026-01-01T00:00:00+00:00', [1]]),
+                       encode_cursor([None, {'id': 1}])):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('members_data'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class MemberListingQueryCountTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='admin', currency_association_id='ADMIN', role='admin',
+                                         is_staff=True, is_superuser=True)
+        create_member(9999, user=self.staff)
+        self.client.force_login(self.staff, backend='django.contrib.auth.backends.ModelBackend')
+        self.next_number = 1
+
+    def add_members(self, count):
+        for _ in range(count):
+            create_member(self.next_number)
+            self.next_number += 1
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_members(2)
+        few = self.count_queries(url)
+        self.add_members(10)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_members_page(self):
+        self.assertConstantQueries(reverse('members'))
+
+    def test_members_data(self):
+        self.assertConstantQueries(reverse('members_data'))
+
+    def test_member_admin_changelist(self):
+        self.assertConstantQueries(reverse('admin:main_app_member_changelist'))
+
+    def test_for_listing_loads_related_rows(self):
+        self.add_members(3)
+        members = list(Member.objects.for_listing())
+        with self.assertNumQueries(0):
+            for member in members:
+                str(member.tehsil)
+                member.user.currency_association_id
+                member.district.name
+
+
+class BulkReviewTests(StatsAssertionsMixin, TestCase):
+    def setUp(self):
+        self.member = create_member(1, member_till=datetime.date(2020, 1, 1), joined_at=timezone.now())
+        self.member_till = datetime.date(2030, 6, 30)
+
+    def test_approve_applies_changes_and_fees(self):
+        change_request = create_change_request(self.member, full_name='Renamed Member', pri_mob='03111111111')
+        result = approve_change_requests([change_request.id], self.member_till)
+        self.assertEqual(result.counts, {'approved': 1})
+        change_request.refresh_from_db()
+        self.member.refresh_from_db()
+        self.assertTrue(change_request.is_approved)
+        self.assertIsNotNone(change_request.admin_reviewed_at)
+        self.assertTrue(change_request.fee.is_approved)
+        self.assertEqual((self.member.full_name, self.member.pri_mob), ('Renamed Member', '03111111111'))
+        self.assertEqual(self.member.member_till, self.member_till)
+
+    def test_approve_reactivates_expired_members(self):
+        Member.objects.filter(pk=self.member.pk).update(status='expired')
+        rebuild_membership_stats()
+        change_request = create_change_request(self.member)
+        approve_change_requests([change_request.id], self.member_till)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.status, 'active')
+        self.assertStatsMatchRebuild()
+
+    def test_requests_of_one_member_apply_in_order(self):
+        first = create_change_request(self.member, full_name='First Name', designation='Owner')
+        second = create_change_request(self.member, full_name='Second Name')
+        approve_change_requests([first.id, second.id], self.member_till)
+        self.member.refresh_from_db()
+        self.assertEqual((self.member.full_name, self.member.designation), ('Second Name', 'Owner'))
+
+    def test_reviewed_and_unknown_requests(self):
+        approved = create_change_request(self.member)
+        approve_change_requests([approved.id], self.member_till)
+        pending = create_change_request(self.member)
+        result = reject_change_requests([approved.id, pending.id, pending.id + 1], 'Incomplete')
+        self.assertEqual([outcome['outcome'] for outcome in result.as_list()], ['skipped', 'rejected', 'not found'])
+        pending.refresh_from_db()
+        self.assertTrue(pending.is_rejected)
+        self.assertEqual(pending.rejection_reason, 'Incomplete')
+        self.assertFalse(pending.fee.is_approved)
+
+    def test_constant_queries_per_chunk(self):
+        def count_queries(count):
+            members = [create_member(number) for number in range(100 * count, 100 * count + count)]
+            ids = [create_change_request(member, full_name=f'Renamed {member.pk}').id for member in members]
+            with CaptureQueriesContext(connection) as queries:
+                result = approve_change_requests(ids, self.member_till)
+            self.assertEqual(result.counts, {'approved': count})
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(10))
+        self.assertStatsMatchRebuild()
+
+    def test_view_requires_staff(self):
+        change_request = create_change_request(self.member)
+        response = self.client.post(reverse('bulk_review_requests'), {'action': 'approve', 'ids': [change_request.id]})
+        self.assertEqual(response.status_code, 302)
+        staff = User.objects.create(username='admin', currency_association_id='ADMIN', role='admin', is_staff=True)
+        self.client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.post(reverse('bulk_review_requests'), {'action': 'approve', 'ids': [change_request.id]})
+        self.assertEqual(response.json()['counts'], {'approved': 1})
+
+
+@mock.patch.object(expiry, '_swept_on', None)
+class ExpirySweepTests(StatsAssertionsMixin, TestCase):
+    def setUp(self):
+        other_district = District.objects.create(name='Bagh')
+        other_tehsil = Tehsil.objects.create(name='Dhirkot', district=other_district)
+        self.cutoff = datetime.date(2024, 1, 1)
+        before = datetime.date(2023, 12, 31)
+        self.expiring = [
+            create_member(1, member_till=before, joined_at=timezone.now()),
+            create_member(2, member_till=before, joined_at=timezone.now() - datetime.timedelta(days=400)),
+            create_member(3, member_till=datetime.date(2020, 1, 1), joined_at=timezone.now(),
+                          district=other_district, tehsil=other_tehsil),
+            create_member(4, member_till=before, joined_at=timezone.now()),
+            create_member(5, member_till=before, joined_at=timezone.now()),
+        ]
+        self.kept = [
+            create_member(6, member_till=self.cutoff, joined_at=timezone.now()),
+            create_member(7, member_till=None, joined_at=timezone.now()),
+            create_member(8, member_till=before, status='pending'),
+            create_member(9, member_till=before, status='suspended', joined_at=timezone.now()),
+        ]
+
+    def test_sweep_expires_active_members_before_cutoff(self):
+        sweep = expiry.sweep_expired_members(self.cutoff, batch_size=2)
+        self.assertEqual((sweep.status, sweep.expired, sweep.batches), ('done', 5, 3))
+        self.assertEqual(set(Member.objects.filter(status='expired')), set(self.expiring))
+        self.assertEqual([member.status for member in Member.objects.filter(pk__in=[m.pk for m in self.kept])
+                          .order_by('pk')], ['active', 'active', 'pending', 'suspended'])
+        self.assertStatsMatchRebuild()
+
+    def test_stats_deltas_move_counts_to_expired(self):
+        statuses = {status: sum(count for key, count in stored_stats().items() if key[3] == status)
+                    for status in ('active', 'expired')}
+        expiry.sweep_expired_members(self.cutoff, batch_size=2)
+        moved = {status: sum(count for key, count in stored_stats().items() if key[3] == status)
+                 for status in ('active', 'expired')}
+        self.assertEqual(moved, {'active': statuses['active'] - 5, 'expired': statuses['expired'] + 5})
+        self.assertStatsMatchRebuild()
+
+    def test_second_sweep_expires_nothing(self):
+        expiry.sweep_expired_members(self.cutoff)
+        sweep = expiry.sweep_expired_members(self.cutoff)
+        self.assertEqual((sweep.status, sweep.expired, sweep.batches), ('done', 0, 0))
+        self.assertStatsMatchRebuild()
+
+    def test_stale_running_sweeps_are_closed(self):
+        stale = ExpirySweep.objects.create(cutoff=self.cutoff)
+        ExpirySweep.objects.filter(pk=stale.pk).update(started_at=timezone.now() - datetime.timedelta(hours=1))
+        running = ExpirySweep.objects.create(cutoff=self.cutoff)
+        expiry.sweep_expired_members(self.cutoff)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((stale.status, running.status), ('failed', 'running'))
+        self.assertIsNotNone(stale.finished_at)
+
+    def test_sweep_if_due_runs_once_a_day(self):
+        with mock.patch.object(timezone, 'localdate', return_value=self.cutoff):
+            sweep = expiry.sweep_if_due()
+            self.assertEqual(sweep.expired, 5)
+            self.assertIsNone(expiry.sweep_if_due())
+        self.assertEqual(ExpirySweep.objects.count(), 1)
+
+    def test_sweep_if_due_skips_a_running_sweep(self):
+        ExpirySweep.objects.create(cutoff=timezone.localdate())
+        self.assertIsNone(expiry.sweep_if_due())
+        self.assertEqual(ExpirySweep.objects.count(), 1)
+
+
+class MembershipStatsSignalTests(StatsAssertionsMixin, TestCase):
+    def setUp(self):
+        self.district = District.objects.create(name='Bagh')
+        self.tehsils = [Tehsil.objects.create(name=name, district=self.district) for name in ('Dhirkot', 'Harighel')]
+        self.members = [
+            create_member(number, district=self.district, tehsil=self.tehsils[number % 2], joined_at=timezone.now())
+            for number in range(1, 7)
+        ]
+        create_member(7, status='pending')
+
+    def test_created_members_are_counted(self):
+        self.assertEqual(sum(stored_stats().values()), 7)
+        self.assertStatsMatchRebuild()
+
+    def test_saves_move_members(self):
+        member = self.members[0]
+        member.status = 'suspended'
+        member.save()
+        member.tehsil = self.tehsils[1]
+        member.save(update_fields=['tehsil'])
+        member.joined_at = timezone.now() - datetime.timedelta(days=40)
+        member.save(update_fields=['joined_at'])
+        # Fields outside the key leave the rollup alone
+        member.full_name = 'Renamed'
+        member.save(update_fields=['full_name'])
+        self.assertStatsMatchRebuild()
+
+    def test_drift_is_found_and_rebuilt(self):
+        self.assertEqual(membership_stats_drift(), {})
+        # update() sends no signals
+        Member.objects.filter(pk__in=[self.members[0].pk, self.members[1].pk]).update(status='suspended')
+        self.assertEqual(membership_stats_drift(), {'active': (6, 4), 'suspended': (0, 2)})
+        with self.assertRaisesMessage(CommandError, 'active 6 counted, 4 members'):
+            call_command('rebuild_membership_stats', check=True, stdout=io.StringIO())
+
+        # The daily sweep rebuilds the rollup after expiring members
+        with mock.patch.object(expiry, '_swept_on', None), self.assertLogs('main_app.expiry', 'WARNING'):
+            expiry.sweep_if_due()
+        self.assertEqual(membership_stats_drift(), {})
+        self.assertStatsMatchRebuild()
+
+    def test_partially_loaded_member(self):
+        member = Member.objects.only('id', 'full_name').get(pk=self.members[1].pk)
+        member.status = 'expired'
+        member.save()
+        self.assertStatsMatchRebuild()
+
+    def test_deleted_members(self):
+        self.members[0].delete()
+        Member.objects.filter(pk__in=[self.members[1].pk, self.members[2].pk]).delete()
+        self.assertStatsMatchRebuild()
+
+    def test_deleted_tehsil(self):
+        self.tehsils[0].delete()
+        self.assertStatsMatchRebuild()
+
+    def test_deleted_tehsils_queryset(self):
+        Tehsil.objects.filter(district=self.district).delete()
+        self.assertStatsMatchRebuild()
+
+    def test_deleted_district(self):
+        self.district.delete()
+        self.assertEqual(sum(stored_stats().values()), 7)
+        self.assertStatsMatchRebuild()
+
+    def test_bulk_update_with_record_member_transitions(self):
+        members = list(Member.objects.filter(pk__in=[member.pk for member in self.members[:3]]))
+        for member in members:
+            member.status = 'suspended'
+        Member.objects.bulk_update(members, ['status'])
+        record_member_transitions(members)
+        self.assertStatsMatchRebuild()
+
+
+class TimeseriesInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.past = self.today - datetime.timedelta(days=10)
+        self.member = create_member(1, joined_at=timezone.now())
+
+    def renewals(self, day):
+        # Fills the cache for the closed buckets of the range on the first call
+        return {row['start']: row['renewals'] for row in timeseries('day', self.past, self.today)}[day.isoformat()]
+
+    def test_closed_buckets_are_cached(self):
+        self.assertEqual(self.renewals(self.past), 0)
+        with self.assertNumQueries(0):
+            # The current bucket is always counted, only closed pages come from the cache
+            timeseries('day', self.past, self.today - datetime.timedelta(days=1))
+
+    def test_back_dated_renewal(self):
+        self.renewals(self.past)
+        create_fee(self.member, renewal_date=self.past)
+        self.assertEqual(self.renewals(self.past), 1)
+
+    def test_renewal_today_keeps_the_cache(self):
+        version = timeseries_version()
+        create_fee(self.member)
+        self.assertEqual(timeseries_version(), version)
+        self.assertEqual(self.renewals(self.today), 1)
+
+    def test_retyped_renewal(self):
+        fee = create_fee(self.member, renewal_date=self.past)
+        self.assertEqual(self.renewals(self.past), 1)
+        fee.fee_type = 'change of information'
+        fee.save()
+        self.assertEqual(self.renewals(self.past), 0)
+
+    def test_moved_renewal(self):
+        fee = create_fee(self.member, renewal_date=self.past)
+        self.renewals(self.past)
+        fee.renewal_date = self.today
+        fee.save()
+        self.assertEqual((self.renewals(self.past), self.renewals(self.today)), (0, 1))
+
+    def test_deleted_renewal(self):
+        fee = create_fee(self.member, renewal_date=self.past)
+        self.renewals(self.past)
+        fee.delete()
+        self.assertEqual(self.renewals(self.past), 0)
+
+    def test_saving_an_unchanged_fee_keeps_the_cache(self):
+        fee = create_fee(self.member, renewal_date=self.past)
+        version = timeseries_version()
+        fee.amount_remaining = 0
+        fee.save()
+        self.assertEqual(timeseries_version(), version)
+
+    def test_back_dated_approval_and_deleted_member(self):
+        def approvals():
+            return {row['start']: row['approvals'] for row in timeseries('day', self.past, self.today)}[
+                self.past.isoformat()]
+
+        self.assertEqual(approvals(), 0)
+        self.member.joined_at = timezone.now() - datetime.timedelta(days=10)
+        self.member.save()
+        self.assertEqual(approvals(), 1)
+        self.member.delete()
+        self.assertEqual(approvals(), 0)
+
+
+class ChangeRequestDiffTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = create_member(1, country_of_stay='PK')
+        self.bagh = District.objects.create(name='Bagh')
+        self.dhirkot = Tehsil.objects.create(name='Dhirkot', district=self.bagh)
+
+    def test_diff_lists_changed_fields_only(self):
+        changes, proposed = diff_member(self.member, {
+            'new_full_name': 'Renamed Member',
+            'new_father_name': 'Father',
+            'new_dob': '1991-02-03',
+            'new_country_of_stay': 'pk',
+            'new_district': 'bagh',
+            'new_tehsil': str(self.dhirkot.pk),
+            'new_pri_mob': '',
+        })
+        self.assertEqual(changes, {
+            'full_name': {'previous': 'Member 1', 'new': 'Renamed Member'},
+            'dob': {'previous': '1990-01-01', 'new': '1991-02-03'},
+            'district': {'previous': 'Muzaffarabad', 'new': 'Bagh'},
+            'tehsil': {'previous': 'Muzaffarabad', 'new': 'Dhirkot'},
+        })
+        self.assertEqual(proposed['pri_mob'], self.member.pri_mob)
+        self.assertEqual(proposed['country_of_stay'], 'PK')
+
+    def test_invalid_values(self):
+        for field, raw in (('dob', '1990-13-01'), ('country_of_stay', 'XX'), ('district', 'Nowhere')):
+            with self.subTest(field=field), self.assertRaises(ValidationError):
+                diff_member(self.member, {f'new_{field}': raw})
+
+    def test_apply_writes_changed_columns(self):
+        change_request = build_change_request(self.member, create_fee(self.member), {
+            'new_full_name': 'Renamed Member',
+            'new_tehsil': 'Dhirkot',
+            'new_country_of_stay': 'PK',
+        })
+        change_request.save()
+        change_request = MemberChangeRequest.objects.select_related('member').get(pk=change_request.pk)
+        edit_change(change_request, 'full_name', 'Edited Name')
+        self.assertEqual(change_request.changes['full_name']['new'], 'Edited Name')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sorted(change_request.apply_changes()), ['full_name', 'tehsil_id'])
+        update = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "main_app_member"')]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn('country_of_stay', update[0])
+        self.member.refresh_from_db()
+        self.assertEqual((self.member.full_name, self.member.tehsil_id), ('Edited Name', self.dhirkot.pk))
+
+    def test_stage_without_changes(self):
+        change_request = build_change_request(self.member, create_fee(self.member), {'new_full_name': 'Member 1'})
+        self.assertEqual(change_request.changes, {})
+        self.assertEqual(change_request.stage_changes(), [])
+
+
+class MemberImportTests(TestCase):
+    HEADERS = ['Full Name', 'Father Name', 'CNIC', 'DOB', 'Gender', 'NIC Type', 'Country of Stay',
+               'Present Address', 'Permanent Address', 'Pri Mob', 'Designation', 'Business Name', 'Business Address',
+               'Employee Number', 'District', 'Tehsil', 'Submission Method', 'Amount Submitted',
+               'Amount Remaining']
+
+    def setUp(self):
+        district = District.objects.create(name='Bagh')
+        Tehsil.objects.create(name='Dhirkot', district=district)
+        self.payment = Payment.objects.create(submission_method='cash', title='Cash')
+        create_member(1, cnic='3000000000001')
+
+    def roster(self, *rows):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(self.HEADERS)
+        writer.writerows(rows)
+        return read_rows(io.BytesIO(text.getvalue().encode()), 'roster.csv')
+
+    def row(self, cnic, **values):
+        row = dict(zip(self.HEADERS, [
+            'Imported Member', 'Father', cnic, '1990-01-01', 'Male', 'CNIC', 'Pakistan', 'Address', 'Address',
+            '03000000000', 'Owner', 'Exchange', 'Address', '1', 'bagh', 'Dhirkot', 'Cash', '1000', '0',
+        ]))
+        row.update(values)
+        return list(row.values())
+
+    def rows(self):
+        return self.roster(
+            self.row('3000000000002'),
+            self.row('3000000000003', Gender='Other'),
+            self.row('3000000000004', Tehsil='Nowhere'),
+            self.row('3000000000001'),
+            self.row('3000000000002'),
+            self.row('3000000000005', **{'Amount Submitted': ''}),
+        )
+
+    def test_dry_run_writes_nothing(self):
+        result = MemberImporter(payment=self.payment, dry_run=True, chunk_size=4).run(self.rows())
+        self.assertEqual((result.created, result.fees, result.failed), (2, 1, 4))
+        self.assertEqual((Member.objects.count(), User.objects.count(), Fee.objects.count()), (1, 1, 0))
+
+    def test_import_matches_dry_run(self):
+        result = MemberImporter(payment=self.payment, approve=True, chunk_size=4).run(self.rows())
+        self.assertEqual((result.created, result.fees, result.failed), (2, 1, 4))
+        members = Member.objects.exclude(cnic='3000000000001').select_related('user', 'tehsil').order_by('cnic')
+        self.assertEqual([(member.cnic, member.status, member.tehsil.name, member.country_of_stay.code)
+                          for member in members],
+                         [('3000000000002', 'active', 'Dhirkot', 'PK'), ('3000000000005', 'active', 'Dhirkot', 'PK')])
+        self.assertEqual(len({member.user.currency_association_id for member in members}), 2)
+        self.assertTrue(Fee.objects.get().is_approved)
+
+    def test_error_report(self):
+        result = MemberImporter(payment=self.payment, dry_run=True, chunk_size=4).run(self.rows())
+        report = io.StringIO()
+        result.write_report(report)
+        report.seek(0)
+        rows = list(csv.DictReader(report))
+        self.assertEqual([row['row'] for row in rows], ['3', '4', '5', '6'])
+        self.assertEqual([row['errors'].split(':')[0] for row in rows], ['gender', 'tehsil', 'cnic', 'cnic'])
+        self.assertIn('already exists', rows[2]['errors'])
+        self.assertIn('more than once', rows[3]['errors'])
+        # As read, so the rows can be fixed and imported again
+        self.assertEqual((rows[0]['gender'], rows[1]['tehsil']), ('Other', 'Nowhere'))
+
+    def test_fees_need_a_payment_account(self):
+        result = MemberImporter(dry_run=True).run(self.roster(self.row('3000000000002')))
+        self.assertEqual(result.errors[0][2], {'amount_submitted': ["A payment account is needed to import fees."]})
+
+
+class Rollback(Exception):
+    pass
+
+
+class SequenceAllocationTests(TestCase):
+    def reserve_and_roll_back(self, reserve_numbers):
+        try:
+            with transaction.atomic():
+                numbers = reserve_numbers()
+                raise Rollback
+        except Rollback:
+            return numbers
+
+    def test_sequence_starts_after_the_highest_id(self):
+        create_member(250)
+        create_member(1000)
+        User.objects.create(username='ADMIN', currency_association_id='ADMIN', role='admin')
+        self.assertEqual(list(reserve('test', 2, initial=highest_currency_association_number)), [1001, 1002])
+
+    def test_rolled_back_reservation_is_reused(self):
+        rolled_back = self.reserve_and_roll_back(lambda: reserve('test'))
+        self.assertEqual(list(reserve('test')), list(rolled_back))
+        self.assertEqual(list(reserve('test', 3)), [2, 3, 4])
+
+    def test_block_is_kept_once_committed(self):
+        allocator = BlockAllocator('test', block_size=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(allocator.next(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([allocator.next() for _ in range(4)], [2, 3, 4, 5])
+        self.assertEqual(allocator.next(), 6)
+
+    def test_rolled_back_block_is_dropped(self):
+        allocator = BlockAllocator('test', block_size=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reserve_and_roll_back(allocator.next), 1)
+        # Neither the rest of the block nor the counter survived, so the numbers are handed out again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(allocator.next(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(allocator.next(), 2)
+
+    def test_application_numbers_per_fee_type_and_year(self):
+        member = create_member(1)
+        MemberChangeRequest.objects.create(member=member, fee=create_fee(member),
+                                           application_id='PK-CEAAJK-RNW-2024-0007')
+        self.assertEqual(list(reserve_application_numbers('RNW', 2024, 2)), [8, 9])
+        self.assertEqual(list(reserve_application_numbers('RNW', 2025, 1)), [1])
+        self.assertEqual(list(reserve_application_numbers('ICG', 2024, 1)), [1])
+        self.reserve_and_roll_back(lambda: reserve_application_numbers('RNW', 2024, 5))
+        self.assertEqual(list(reserve_application_numbers('RNW', 2024, 1)), [10])
+
+
+class MemberSearchTests(TestCase):
+    def setUp(self):
+        self.muhammad = create_member(1, full_name='Muhammad Ali Khan', cnic='8230112345671')
+        self.ahmed = create_member(2, full_name='Ahmed Raza', business_name='Kashmir Exchange')
+        self.ali = create_member(3, full_name='Ali Hassan')
+
+    def search(self, query):
+        return [member.pk for member in search_members(query)]
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('khan', 'khan', 1), 0)
+        self.assertEqual(edit_distance('khna', 'khan', 1), 1)
+        self.assertEqual(edit_distance('muhamad', 'muhammad', 2), 1)
+        self.assertEqual(edit_distance('mohamad', 'muhammad', 2), 2)
+        # Past the limit the distance is only known to be larger
+        self.assertEqual(edit_distance('ahmed', 'hassan', 1), 2)
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('muham kh'), [self.muhammad.pk])
+        self.assertEqual(set(self.search('ali')), {self.muhammad.pk, self.ali.pk})
+        self.assertEqual(self.search('kashm'), [self.ahmed.pk])
+
+    def test_ids_and_cnics(self):
+        self.assertEqual(self.search('82301-1234567-1'), [self.muhammad.pk])
+        self.assertEqual(self.search('CEA-0002'), [self.ahmed.pk])
+
+    def test_typos(self):
+        self.assertEqual(self.search('Muhamad'), [self.muhammad.pk])
+        self.assertEqual(self.search('muhamad khna'), [self.muhammad.pk])
+        self.assertEqual(self.search('Ahmde'), [self.ahmed.pk])
+        # Two edits only from TYPO_LENGTH_2 letters on
+        self.assertEqual(self.search('mohamad'), [])
+        self.assertEqual(self.search('mohammad'), [self.muhammad.pk])
+
+    def test_short_terms_match_prefixes_only(self):
+        self.assertEqual(self.search('aly'), [])
+        self.assertEqual(match_expression('aly'), '("aly"*)')
+
+    def test_index_follows_changes(self):
+        self.ahmed.full_name = 'Bilal Raza'
+        self.ahmed.save()
+        self.ali.delete()
+        self.assertEqual(self.search('bilal'), [self.ahmed.pk])
+        self.assertEqual(self.search('ahmed'), [])
+        self.assertEqual(self.search('hassan'), [])
+
+    def test_lost_triggers(self):
+        # What a migration rebuilding main_app_member leaves behind
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER main_app_member_fts_insert')
+            cursor.execute('DROP TRIGGER main_app_member_fts_update')
+        self.assertFalse(member_search_available())
+        bilal = create_member(4, full_name='Bilal Ahmed')
+        self.ali.full_name = 'Ali Hussain'
+        self.ali.save()
+        # Served by LIKE meanwhile, not by the stale index
+        self.assertEqual(self.search('bilal'), [bilal.pk])
+        self.assertEqual(self.search('hussain'), [self.ali.pk])
+
+        self.assertTrue(repair_member_search_index())
+        self.assertTrue(member_search_available())
+        self.assertFalse(repair_member_search_index())
+        self.assertEqual(self.search('bilal'), [bilal.pk])
+        self.assertEqual(self.search('hussain'), [self.ali.pk])
+        self.assertEqual(self.search('hassan'), [])
+        self.ahmed.full_name = 'Ahmed Qureshi'
+        self.ahmed.save()
+        self.assertEqual(self.search('qureshi'), [self.ahmed.pk])
+
+
+@mock.patch.object(autocomplete, '_index', None)
+@mock.patch.object(autocomplete, '_index_version', None)
+class AutocompleteJournalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.members = [create_member(number, full_name=name)
+                        for number, name in enumerate(['Ali Khan', 'Ali Raza', 'Bilal Ahmed'], start=1)]
+
+    def names(self, query):
+        return [row[1] for row in autocomplete.autocomplete_members(query)]
+
+    def change_elsewhere(self, change):
+        # Another process records the change; this one only sees it in the journal
+        with mock.patch.object(autocomplete, '_index', None), self.captureOnCommitCallbacks(execute=True):
+            change()
+
+    def rename(self, member, name):
+        member.full_name = name
+        member.save()
+
+    def test_lookup(self):
+        self.assertEqual(self.names('ali'), ['Ali Khan', 'Ali Raza'])
+        self.assertEqual(self.names('khan'), ['Ali Khan'])
+        self.assertEqual(self.names('CEA-0003'), ['Bilal Ahmed'])
+        self.assertEqual(self.names('3'), ['Bilal Ahmed'])
+        self.assertEqual(self.names(self.members[1].cnic), ['Ali Raza'])
+        with self.assertNumQueries(0):
+            self.names('bil')
+
+    def test_local_changes_apply_directly(self):
+        self.names('ali')
+        index = autocomplete._index
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rename(self.members[0], 'Zahid Khan')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('ali'), ['Ali Raza'])
+        self.assertIs(autocomplete._index, index)
+
+    def test_journal_replay(self):
+        self.names('ali')
+        index = autocomplete._index
+        self.change_elsewhere(lambda: self.rename(self.members[0], 'Zahid Khan'))
+        self.change_elsewhere(lambda: self.members[2].delete())
+        self.change_elsewhere(lambda: create_member(4, full_name='Alia Noor'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names('ali'), ['Ali Raza', 'Alia Noor'])
+        self.assertIs(autocomplete._index, index)
+        self.assertEqual(self.names('bil'), [])
+        self.assertEqual(self.names('zah'), ['Zahid Khan'])
+
+    def test_evicted_entry_rebuilds(self):
+        self.names('ali')
+        index = autocomplete._index
+        self.change_elsewhere(lambda: self.rename(self.members[0], 'Zahid Khan'))
+        cache.delete(autocomplete._journal_entry_key(autocomplete.journal_version()))
+        self.assertEqual(self.names('ali'), ['Ali Raza'])
+        self.assertIsNot(autocomplete._index, index)
+
+    def test_long_journal_rebuilds(self):
+        self.names('ali')
+        index = autocomplete._index
+        for number, member in enumerate(self.members):
+            self.change_elsewhere(lambda: self.rename(member, f'Renamed {number}'))
+        with mock.patch.object(autocomplete, 'MAX_JOURNAL_REPLAY', 2):
+            self.assertEqual(self.names('renamed'), ['Renamed 0', 'Renamed 1', 'Renamed 2'])
+        self.assertIsNot(autocomplete._index, index)
+
+    def test_bulk_change_rebuilds(self):
+        self.names('ali')
+        index = autocomplete._index
+
+        def suspend_all():
+            Member.objects.update(status='suspended')
+            autocomplete.members_changed()
+
+        self.change_elsewhere(suspend_all)
+        self.assertEqual({row[4] for row in autocomplete.autocomplete_members('ali')}, {'suspended'})
+        self.assertIsNot(autocomplete._index, index)
+
+
+class CsvExportTests(TestCase):
+    def test_formula_guard_covers_text_only(self):
+        rows = [('=SUM(A1:A9)', '+923001234567', '@cmd', -5, Decimal('-1500.00'), Decimal('250.50'), 'Ali')]
+        lines = ''.join(stream_csv(['a', 'b', 'c', 'd', 'e', 'f', 'g'], rows)).splitlines()
+        self.assertEqual(lines[1], "'=SUM(A1:A9),'+923001234567,'@cmd,-5,-1500.00,250.50,Ali")
+
+
+class NaturalKeyImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.district = District.objects.create(name='Muzaffarabad')
+        Tehsil.objects.create(name='Muzaffarabad', district=self.district, latitude='34.370000', longitude='73.470000')
+        Tehsil.objects.create(name='Pattika', district=self.district)
+
+    def import_tehsils(self, rows, dry_run=False):
+        dataset = Dataset(headers=['name', 'district', 'latitude', 'longitude'])
+        for row in rows:
+            dataset.append(row)
+        return TehsilResource().import_data(dataset, dry_run=dry_run)
+
+    def tehsils(self):
+        return set(Tehsil.objects.values_list('name', 'district__name', 'longitude'))
+
+    def test_rows_match_case_insensitively(self):
+        result = self.import_tehsils([
+            ['muzaffarabad', ' MUZAFFARABAD ', '34.37', '73.47'],
+            ['Pattika', 'muzaffarabad', '', ''],
+            ['Hattian', 'Muzaffarabad', '', ''],
+        ])
+        self.assertEqual([row.import_type for row in result.rows], ['update', 'skip', 'new'])
+        self.assertEqual(self.tehsils(), {('muzaffarabad', 'Muzaffarabad', Decimal('73.470000')),
+                                          ('Pattika', 'Muzaffarabad', None), ('Hattian', 'Muzaffarabad', None)})
+
+    def test_summary_lists_renames(self):
+        result = self.import_tehsils([['MUZAFFARABAD', 'Muzaffarabad', '34.37', '73.5'],
+                                      ['pattika', 'Muzaffarabad', '', '']])
+        self.assertEqual(result.diff_summary, [
+            'Tehsils: 0 new, 2 updated (name: 2, longitude: 1), 0 unchanged, 0 failed.',
+            'MUZAFFARABAD, Muzaffarabad: name Muzaffarabad → MUZAFFARABAD, longitude 73.470000 → 73.500000',
+            'pattika, Muzaffarabad: name Pattika → pattika',
+        ])
+
+    def test_unknown_district_is_invalid(self):
+        result = self.import_tehsils([['Leepa', 'Atlantis', '', ''], ['Hattian', 'Muzaffarabad', '', '']])
+        self.assertTrue(result.has_validation_errors())
+        self.assertEqual(result.invalid_rows[0].error_dict, {'district': ["Unknown district 'Atlantis'."]})
+        self.assertFalse(Tehsil.objects.filter(name='Leepa').exists())
+        self.assertEqual(result.diff_summary[0], 'Tehsils: 1 new, 0 updated, 0 unchanged, 1 failed.')
+
+    def test_dry_run_writes_nothing(self):
+        before = self.tehsils()
+        version = reference_data_version()
+        result = self.import_tehsils([['MUZAFFARABAD', 'Muzaffarabad', '34.37', '73.5'],
+                                      ['Hattian', 'Muzaffarabad', '', '']], dry_run=True)
+        self.assertEqual((result.totals['new'], result.totals['update']), (1, 1))
+        self.assertEqual(self.tehsils(), before)
+        self.assertEqual(reference_data_version(), version)
+
+        district_result = DistrictResource().import_data(Dataset(['BAGH'], headers=['name']), dry_run=True)
+        self.assertEqual(district_result.totals['new'], 1)
+        self.assertFalse(District.objects.filter(name__iexact='bagh').exists())
+
+
+class TehsilsMapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        district = District.objects.create(name='Muzaffarabad')
+        self.tehsils = [Tehsil.objects.create(name=name, district=district, latitude=latitude, longitude=73.47)
+                        for name, latitude in (('Muzaffarabad', 34.37), ('Pattika', 34.48))]
+        self.members = [create_member(number, tehsil=self.tehsils[number // 3], joined_at=timezone.now())
+                        for number in range(1, 4)]
+
+    def member_counts(self):
+        response = self.client.get(reverse('tehsils_map'))
+        self.assertEqual(response.status_code, 200)
+        return {feature['properties']['name']: feature['properties']['member_count']
+                for feature in response.json()['features']}
+
+    def test_not_modified(self):
+        response = self.client.get(reverse('tehsils_map'))
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        # Answered from the cached payload
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('tehsils_map'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            response = self.client.get(reverse('tehsils_map'), HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.client.get(reverse('tehsils_map'), HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_member_changes_invalidate_the_map(self):
+        self.assertEqual(self.member_counts(), {'Muzaffarabad': 2, 'Pattika': 1})
+        etag = self.client.get(reverse('tehsils_map'))['ETag']
+        member = self.members[0]
+        member.full_name = 'Renamed'
+        member.save()
+        self.assertIsNotNone(cache.get(TEHSILS_MAP_CACHE_KEY))
+
+        member.status = 'suspended'
+        member.save()
+        self.assertIsNone(cache.get(TEHSILS_MAP_CACHE_KEY))
+        self.assertEqual(self.client.get(reverse('tehsils_map'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.member_counts(), {'Muzaffarabad': 1, 'Pattika': 1})
+
+        self.members[1].tehsil = self.tehsils[1]
+        self.members[1].save()
+        self.assertEqual(self.member_counts(), {'Pattika': 2})
+
+
+class TehsilIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_member(1)
+        self.fingerprint = get_reference_data()['tehsil_index']['fingerprint']
+
+    def get(self, fingerprint, etag):
+        return self.client.get(reverse('tehsil_index', args=[fingerprint]), HTTP_IF_NONE_MATCH=f'"{etag}"')
+
+    def test_current_fingerprint_is_not_modified(self):
+        self.assertEqual(self.get(self.fingerprint, self.fingerprint).status_code, 304)
+
+    def test_old_fingerprint_redirects_before_the_etag_check(self):
+        old = self.fingerprint
+        Tehsil.objects.create(name='Dhirkot', district=District.objects.get())
+        current = get_reference_data()['tehsil_index']['fingerprint']
+        self.assertNotEqual(current, old)
+        for etag in (old, current):
+            with self.subTest(etag=etag):
+                self.assertRedirects(self.get(old, etag), reverse('tehsil_index', args=[current]),
+                                     fetch_redirect_response=False)
+
+
+@override_settings(LOGIN_ATTEMPT_LIMIT=3, LOGIN_ATTEMPT_WINDOW=900)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = create_member(1, is_approved=True)
+
+    def log_in(self, currency_association_id='CEA-0001', digits='0001'):
+        return self.client.post(reverse('login'), {'currency_association_id': currency_association_id,
+                                                    'last_4_cnic_digits': digits})
+
+    def test_counter_per_window(self):
+        with mock.patch('time.time', return_value=1800.0):
+            record_failed_login('CEA-0001')
+            record_failed_login('CEA-0001')
+            self.assertEqual(cache.get(_attempts_key('CEA-0001')), 2)
+        # The next window counts from a new key
+        with mock.patch('time.time', return_value=2700.0):
+            self.assertIsNone(cache.get(_attempts_key('CEA-0001')))
+            record_failed_login('CEA-0001')
+            self.assertEqual(cache.get(_attempts_key('CEA-0001')), 1)
+
+    def test_throttled_after_the_limit(self):
+        with mock.patch('time.time', return_value=1800.0 + 100):
+            for digits in ('1111', '2222'):
+                self.assertContains(self.log_in(digits=digits), 'Invalid ID or CNIC')
+            # Other spellings of the ID count against the same limit
+            self.assertContains(self.log_in(' cea-0001', '3333'), 'Invalid ID or CNIC')
+            response = self.log_in()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '800')
+            self.assertNotIn('_auth_user_id', self.client.session)
+        # Let in again in a later window
+        self.assertEqual(self.log_in().status_code, 302)
+
+    def test_success_resets_the_counter(self):
+        for digits in ('1111', '2222'):
+            self.log_in(digits=digits)
+        self.assertRedirects(self.log_in(), reverse('home'), fetch_redirect_response=False)
+        self.assertIsNone(cache.get(_attempts_key('CEA-0001')))
+
+    def test_id_is_looked_up_as_submitted(self):
+        self.assertContains(self.log_in('cea-0001'), 'Invalid ID or CNIC')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_cached_user_is_dropped_on_change(self):
+        backend = CustomBackend()
+        user = self.member.user
+        self.assertEqual(backend.get_user(user.pk), user)
+        self.assertIsNotNone(cache.get(user_cache_key(user.pk)))
+        user.role = 'admin'
+        user.save()
+        self.assertIsNone(cache.get(user_cache_key(user.pk)))
+        self.assertEqual(backend.get_user(user.pk).role, 'admin')
+        user_id = user.pk
+        self.member.delete()
+        user.delete()
+        self.assertIsNone(cache.get(user_cache_key(user_id)))
+        self.assertIsNone(backend.get_user(user_id))
+
+
+class ExpiredMemberAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = create_member(1, status='expired', is_approved=True, joined_at=timezone.now(),
+                                    member_till=datetime.date(2020, 1, 1))
+        self.fee = create_fee(self.member, fee_type='new registration', is_approved=True)
+
+    def test_expired_member_logs_in_to_renew(self):
+        response = self.client.post(reverse('login'), {'currency_association_id': 'CEA-0001',
+                                                        'last_4_cnic_digits': '0001'})
+        self.assertRedirects(response, reverse('renew_membership'))
+        self.assertEqual(self.client.get(reverse('renew_membership')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    def test_expired_member_is_kept_to_renewal(self):
+        self.client.force_login(self.member.user, backend='django.contrib.auth.backends.ModelBackend')
+        for url in (reverse('submit_fee'), reverse('view_member', args=[self.member.pk])):
+            with self.subTest(url=url):
+                self.assertRedirects(self.client.get(url), reverse('renew_membership'), fetch_redirect_response=False)
+        response = self.client.get(reverse('member_form_fragment', args=[self.member.pk]) + '?readonly=1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_suspended_member_cannot_log_in(self):
+        Member.objects.filter(pk=self.member.pk).update(status='suspended')
+        response = self.client.post(reverse('login'), {'currency_association_id': 'CEA-0001',
+                                                        'last_4_cnic_digits': '0001'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def edit(self, **switches):
+        staff = User.objects.create(username='admin', currency_association_id='ADMIN', role='admin', is_staff=True)
+        self.client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+        data = {
+            'full_name': 'Edited Name', 'father_name': 'Father', 'cnic': self.member.cnic, 'dob': '1990-01-01',
+            'gender': 'male', 'nic_type': 'cnic', 'country_of_stay': 'PK', 'present_address': 'Present address',
+            'permanent_address': 'Permanent address', 'dual_citizen': 'no', 'pri_mob': '03000000000',
+            'designation': 'Owner', 'business_name': 'Exchange', 'business_address': 'Business address',
+            'tehsil': self.member.tehsil_id, 'district': self.member.district_id, 'employee_number': '1',
+        }
+        data.update({name: 'on' for name, checked in switches.items() if checked})
+        response = self.client.post(reverse('view_member', args=[self.member.pk]), data,
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'success': True, 'message': 'Member updated successfully!'})
+        self.member.refresh_from_db()
+
+    def test_admin_edit_keeps_expired(self):
+        self.edit(approve_member=True, approve_payment=True)
+        self.assertEqual((self.member.full_name, self.member.status), ('Edited Name', 'expired'))
+
+    def test_admin_changing_an_approval_sets_the_status(self):
+        self.edit(approve_member=True, approve_payment=False)
+        self.assertEqual(self.member.status, 'pending')
+
+
+class PrivateDocumentTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(PRIVATE_MEDIA_ROOT=os.path.join(self.root, 'private'),
+                                     MEDIA_ROOT=os.path.join(self.root, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.member = create_member(1)
+
+    def create_export(self, **kwargs):
+        export = CardExport.objects.create(status='done', finished_at=timezone.now(), **kwargs)
+        export.file.save('member-cards.zip', ContentFile(b'PK'))
+        return export
+
+    def test_files_are_private_with_random_names(self):
+        export = self.create_export()
+        job = PdfJob.objects.create(member=self.member, kind='receipt', content_hash='a', status='done')
+        job.file.save('receipt.pdf', ContentFile(b'%PDF'))
+        for document in (export, job):
+            self.assertTrue(document.file.path.startswith(os.path.join(self.root, 'private')))
+            self.assertRegex(os.path.basename(document.file.name), r'^[\w-]{22}\.(zip|pdf)$')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'media')))
+
+    def test_download_is_staff_only(self):
+        export = self.create_export()
+        url = reverse('download_card_export', args=[export.id])
+        self.client.force_login(self.member.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        staff = User.objects.create(username='admin', currency_association_id='ADMIN', role='admin', is_staff=True)
+        self.client.force_login(staff, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'PK')
+        self.assertIn(f'member-cards-{export.id}.zip', response['Content-Disposition'])
+
+    def test_expired_exports_lose_their_file(self):
+        old = self.create_export()
+        CardExport.objects.filter(pk=old.pk).update(finished_at=timezone.now() - datetime.timedelta(days=8))
+        recent = self.create_export()
+        path = old.file.path
+        self.assertEqual(delete_expired_exports(), 1)
+        old.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertFalse(old.file)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(recent.file)
+
+    def test_old_pdfs_and_deleted_members_lose_their_files(self):
+        jobs = []
+        for kind in ('receipt', 'member_detail'):
+            job = PdfJob.objects.create(member=self.member, kind=kind, content_hash=kind, status='done',
+                                        finished_at=timezone.now())
+            job.file.save(f'{kind}.pdf', ContentFile(b'%PDF'))
+            jobs.append(job)
+        PdfJob.objects.filter(pk=jobs[0].pk).update(finished_at=timezone.now() - datetime.timedelta(days=31))
+        self.assertEqual(delete_old_pdfs(), 1)
+        self.assertFalse(os.path.exists(jobs[0].file.path))
+        self.member.delete()
+        self.assertFalse(os.path.exists(jobs[1].file.path))
+
+
+class PdfRendererTests(TestCase):
+    def test_pool_is_for_card_exports_only(self):
+        # Nothing to keep warm around wkhtmltopdf
+        with self.assertRaises(ImproperlyConfigured):
+            ProcessPoolRenderer(backend='main_app.pdf_renderers.WkhtmltopdfRenderer')
+        pool = {'BACKEND': 'main_app.pdf_renderers.ProcessPoolRenderer', 'OPTIONS': {'processes': 1}}
+        with override_settings(PDF_RENDERER=pool), self.assertRaises(ImproperlyConfigured):
+            get_renderer()
+        with override_settings(CARD_EXPORT_PDF_RENDERER=pool):
+            renderer = get_renderer('CARD_EXPORT_PDF_RENDERER')
+            self.assertIsInstance(renderer, ProcessPoolRenderer)
+            self.assertTrue(renderer.render('<h1>Member card</h1>').startswith(b'%PDF-'))
+
+
+class FakePdfRenderer:
+    full_layout = True
+
+    def render(self, html):
+        return b'%PDF-' + html.encode()[:20]
+
+    def close(self):
+        pass
+
+
+@override_settings(PDF_RENDERER={'BACKEND': 'main_app.tests.FakePdfRenderer'}, PDF_WORKER_WAIT=10)
+class PdfJobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(PRIVATE_MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.member = create_member(1, is_approved=True, joined_at=timezone.now())
+        create_fee(self.member, fee_type='new registration', is_approved=True)
+
+    def age(self, job, seconds=60):
+        PdfJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - datetime.timedelta(seconds=seconds))
+        job.refresh_from_db()
+        return job
+
+    def rename(self, name):
+        self.member.full_name = name
+        self.member.save()
+
+    def test_request_pdf_queues_each_content_once(self):
+        job = request_pdf(self.member, 'member_detail')
+        self.assertEqual(request_pdf(self.member, 'member_detail'), job)
+        self.rename('Renamed Member')
+        self.assertNotEqual(request_pdf(self.member, 'member_detail'), job)
+        self.assertEqual(PdfJob.objects.filter(status='pending').count(), 2)
+
+    def test_claim_next_job(self):
+        first = self.age(request_pdf(self.member, 'member_detail'))
+        self.rename('Renamed Member')
+        second = request_pdf(self.member, 'member_detail')
+        self.assertEqual(claim_next_job(), first)
+        self.assertEqual(claim_next_job(), second)
+        self.assertIsNone(claim_next_job())
+        # A job left running by a worker that died is handed out again
+        PdfJob.objects.filter(pk=first.pk).update(started_at=timezone.now() - datetime.timedelta(hours=1))
+        reclaimed = claim_next_job()
+        self.assertEqual((reclaimed, reclaimed.attempts), (first, 2))
+
+    def test_run_job_keeps_newer_jobs(self):
+        done = self.age(request_pdf(self.member, 'member_detail'), 120)
+        run_job(claim_next_job())
+        self.rename('Second Name')
+        self.age(request_pdf(self.member, 'member_detail'), 60)
+        self.rename('Third Name')
+        newer = request_pdf(self.member, 'member_detail')
+        current = run_job(claim_next_job())
+        self.assertEqual(current.status, 'done')
+        # The older finished version is gone, the newer pending one still waits for its render
+        self.assertFalse(PdfJob.objects.filter(pk=done.pk).exists())
+        self.assertEqual(PdfJob.objects.get(pk=newer.pk).status, 'pending')
+
+    def test_render_unclaimed(self):
+        job = request_pdf(self.member, 'member_detail')
+        self.assertEqual(render_unclaimed(job).status, 'pending')
+        job = render_unclaimed(self.age(job))
+        self.assertEqual(job.status, 'done')
+        with job.file.open('rb') as pdf:
+            self.assertTrue(pdf.read().startswith(b'%PDF-'))
+
+    def test_views(self):
+        url = reverse('generate_member_detail', args=[self.member.pk])
+        self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}", fetch_redirect_response=False)
+        other = create_member(2, is_approved=True)
+        self.client.force_login(other.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.member.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        job = PdfJob.objects.get()
+        status_url = reverse('pdf_job_status', args=[job.pk])
+        self.assertEqual(self.client.get(status_url).json(), {'status': 'pending'})
+        with override_settings(PDF_WORKER_WAIT=0):
+            self.assertEqual(self.client.get(status_url).json(), {'status': 'done'})
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        self.assertEqual(self.client.get(reverse('pdf_job_status', args=[job.pk + 1])).status_code, 404)
+
+        self.client.force_login(other.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(status_url).status_code, 403)
+
+    def test_unavailable_document(self):
+        self.client.force_login(self.member.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('generate_receipt', args=[self.member.pk]))
+        self.assertEqual(response.status_code, 400)
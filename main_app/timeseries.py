@@ -0,0 +1,176 @@
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from datetime import time as datetime_time
+
+from django.core.cache import cache
+from django.db.models import Count, DateField, DateTimeField
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Fee, Member
+from .stats import add_months
+
+TIMESERIES_VERSION_KEY = 'timeseries_version'
+
+# series -> (model, date column, extra filter)
+SERIES = {
+    'signups': (Member, 'created_at', {}),
+    'approvals': (Member, 'joined_at', {}),
+    'renewals': (Fee, 'renewal_date', {'fee_type': 'renewal'}),
+}
+
+TRUNC = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+
+# Longest series one request may ask for, per interval
+MAX_BUCKETS = {'day': 3660, 'week': 530, 'month': 120}
+
+
+def timeseries_version():
+    # A timestamp instead of a counter, so a version evicted from the cache is never reused
+    version = cache.get(TIMESERIES_VERSION_KEY)
+    if version is None:
+        cache.add(TIMESERIES_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(TIMESERIES_VERSION_KEY)
+    return version
+
+
+def bump_timeseries_version():
+    """Drop every cached bucket; for changes that rewrite history, like deleting a member."""
+    cache.set(TIMESERIES_VERSION_KEY, time.time_ns(), None)
+
+
+def in_closed_bucket(*moments):
+    """
+    Whether any of the dates or datetimes ``moments`` (None is skipped) is before today, so
+    in a bucket that may be cached. A change to one of them calls for bump_timeseries_version.
+    """
+    today = timezone.localdate()
+    for moment in moments:
+        if isinstance(moment, datetime):
+            moment = timezone.localdate(moment) if timezone.is_aware(moment) else moment.date()
+        if moment is not None and moment < today:
+            return True
+    return False
+
+
+def renewal_day(values):
+    """The day a fee with these column ``values`` is counted in the renewals series, None if it is not counted."""
+    if values.get('fee_type') != 'renewal':
+        return None
+    return values.get('renewal_date')
+
+
+def bucket_start(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start, interval):
+    if interval == 'week':
+        return start + timedelta(days=7)
+    if interval == 'month':
+        return add_months(start, 1)
+    return start + timedelta(days=1)
+
+
+def _ceil_bucket(day, interval):
+    start = bucket_start(day, interval)
+    return start if start == day else next_bucket(start, interval)
+
+
+def page_bounds(bucket, interval):
+    """
+    First and end bucket of the cache page holding ``bucket``: a calendar month of days,
+    or the weeks or months starting in one calendar year.
+    """
+    if interval == 'day':
+        return bucket.replace(day=1), add_months(bucket.replace(day=1), 1)
+    year = bucket.year
+    return _ceil_bucket(date(year, 1, 1), interval), _ceil_bucket(date(year + 1, 1, 1), interval)
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, datetime_time.min))
+
+
+def count_buckets(interval, start, end):
+    """``{bucket: Counter(series: n)}`` for the buckets from ``start`` up to ``end``, one grouped query per series."""
+    buckets = {}
+    for series, (model, field, filters) in SERIES.items():
+        # Datetime columns are bucketed by day in the current time zone
+        if isinstance(model._meta.get_field(field), DateTimeField):
+            since, until = _aware(start), _aware(end)
+        else:
+            since, until = start, end
+        rows = (model.objects.filter(**filters, **{f'{field}__gte': since, f'{field}__lt': until})
+                .order_by().annotate(bucket=TRUNC[interval](field, output_field=DateField()))
+                .values('bucket').annotate(count=Count('id')))
+        for row in rows:
+            buckets.setdefault(row['bucket'], Counter())[series] = row['count']
+    return buckets
+
+
+def timeseries(interval, first_day, last_day):
+    """
+    Signups, approvals and renewals per ``interval`` bucket from the bucket holding
+    ``first_day`` to the one holding ``last_day``, as a list of
+    ``{'start': 'YYYY-MM-DD', 'signups': n, 'approvals': n, 'renewals': n}``.
+
+    Closed buckets never change, so they are counted once and cached without expiry, one
+    cache entry per page (see ``page_bounds``) recording up to which bucket it is
+    complete. Only the current bucket, and buckets closed since the page was last
+    extended, are counted again.
+    """
+    if interval not in TRUNC:
+        raise ValueError(f"Unknown interval '{interval}', use one of {', '.join(TRUNC)}.")
+    first = bucket_start(first_day, interval)
+    last = bucket_start(last_day, interval)
+    if first > last:
+        raise ValueError("The range ends before it starts.")
+    starts = []
+    bucket = first
+    while bucket <= last:
+        starts.append(bucket)
+        if len(starts) > MAX_BUCKETS[interval]:
+            raise ValueError(f"A {interval} series can have at most {MAX_BUCKETS[interval]} buckets.")
+        bucket = next_bucket(bucket, interval)
+
+    current = bucket_start(timezone.localdate(), interval)
+    version = timeseries_version()
+    pages = {}
+    for bucket in starts:
+        page = page_bounds(bucket, interval)
+        if bucket < current:
+            pages[f'timeseries:{version}:{interval}:{page[0]}'] = page
+    cached = cache.get_many(pages.keys())
+
+    # Closed buckets not cached yet, counted together in one pass
+    missing = {}
+    for key, (page_start, page_end) in pages.items():
+        entry = cached.get(key, {'until': page_start, 'buckets': {}})
+        closed_until = min(page_end, current)
+        if entry['until'] < closed_until:
+            missing[key] = (entry, closed_until)
+        cached[key] = entry
+    if missing:
+        counted = count_buckets(interval, min(entry['until'] for entry, _ in missing.values()),
+                                max(closed_until for _, closed_until in missing.values()))
+        for key, (entry, closed_until) in missing.items():
+            entry['buckets'].update({bucket: dict(counts) for bucket, counts in counted.items()
+                                     if entry['until'] <= bucket < closed_until})
+            entry['until'] = closed_until
+        cache.set_many({key: entry for key, (entry, _) in missing.items()}, None)
+
+    counts = {}
+    for entry in cached.values():
+        counts.update(entry['buckets'])
+    if last >= current:
+        counts.update(count_buckets(interval, current, next_bucket(current, interval)))
+    return [
+        {'start': bucket.isoformat(), **{series: counts.get(bucket, {}).get(series, 0) for series in SERIES}}
+        for bucket in starts
+    ]
@@ -9,16 +9,27 @@ urlpatterns = [
     path('signup/', views.signup_view, name='signup'),  # Route for signup
     path('signup-success/', views.signup_success, name='signup_success'),  # Route for signup
     path('member-dashboard/', views.members, name='members'),  # Route for signup
+    path('members-data/', views.members_data, name='members_data'),
+    path('members-search/', views.member_search, name='member_search'),
+    path('members-autocomplete/', views.member_autocomplete, name='member_autocomplete'),
+    path('members-export/', views.export_members, name='export_members'),
+    path('member-stats/', views.member_stats, name='member_stats'),
+    path('member-stats/timeseries/', views.member_timeseries, name='member_timeseries'),
     path('submit-fee/', views.submit_fees, name='submit_fee'),
     path('renew-membership/', views.renew_membership, name='renew_membership'),
     path('member/<int:member_id>/', views.view_member, name='view_member'),
+    path('member/<int:member_id>/form/', views.member_form_fragment, name='member_form_fragment'),
     path('toggle-member-status/<int:member_id>/', views.toggle_member_status, name='toggle_member_status'),
     path('delete-member/<int:member_id>/', views.delete_member, name='delete_member'),
     path('tehsils-map/', views.tehsils_map, name='tehsils_map'),
     path('pending-renewal-requests/', views.pending_requests, name='pending_requests'),
     path('renewal-request/<int:request_id>/', views.view_change_request, name='view_change_request'),
+    path('renewal-requests/bulk-review/', views.bulk_review_requests, name='bulk_review_requests'),
     path('get-tehsil/<int:district_id>/', views.get_tehsils, name='get_tehsils'),
+    path('tehsil-index/<str:fingerprint>.json', views.tehsil_index, name='tehsil_index'),
     path('<int:order_id>/invoice/', views.generate_receipt_view, name='generate_receipt'),
     path('<int:order_id>/members-detail/', views.generate_member_detail, name='generate_member_detail'),
+    path('pdf-jobs/<int:job_id>/status/', views.pdf_job_status, name='pdf_job_status'),
+    path('card-exports/<int:export_id>/download/', views.download_card_export, name='download_card_export'),
 
 ]
\ No newline at end of file
@@ -1,153 +1,246 @@
+import logging
 import os
 import random
 import string
-import traceback
 from datetime import timedelta, date, datetime
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, get_user_model, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.db import transaction, IntegrityError
-from django.http import JsonResponse, Http404, HttpResponse
+from django.http import JsonResponse, Http404, HttpResponse, FileResponse
 from django.shortcuts import render, redirect, get_object_or_404
-import pdfkit
 # Create your views here.
 from django.template.loader import get_template
 from django.urls import reverse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django_countries import countries
+from django.views.decorators.http import condition
 
 from .decorator import anonymous_required
 from .forms import *
 from .models import *
+from .approvals import approve_change_requests, reject_change_requests
+from .autocomplete import AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT, autocomplete_members
+from .authentication import (login_retry_after, normalize_currency_association_id, record_failed_login,
+                             reset_login_attempts)
+from .change_requests import build_change_request, edit_change
+from .expiry import calculate_member_till
+from .exports import CONTENT_TYPES, member_export_response
+from .maps import get_tehsils_map
+from .middleware import get_member
+from .pagination import keyset_paginate
+from .pdfs import PdfNotAvailable, render_unclaimed, request_pdf
+from .reference_data import get_reference_data, reference_context
+from .search import filter_search, search_members
+from .sequences import FEE_TYPE_CODES, next_application_number, format_application_id
+from .stats import monthly_status_changes, parse_month, add_months, month_start
+from .timeseries import timeseries
+
+logger = logging.getLogger(__name__)
+
 
 @login_required(login_url='login')
 def dash(request):
-    city = District.objects.all()
-    tehsil = Tehsil.objects.all()
-    # Get today's date and calculate first day of current month and previous month
     today = date.today()
-    first_day_of_current_month = today.replace(day=1)
-    first_day_of_previous_month = (first_day_of_current_month - timedelta(days=1)).replace(day=1)
-
-    # Count active, pending, and suspended members for the current month
-    active_members_count = Member.objects.filter(status='active', joined_at__gte=first_day_of_current_month).count()
-    pending_members_count = Member.objects.filter(status='pending', created_at__gte=first_day_of_current_month).count()
-    suspended_members_count = Member.objects.filter(status='suspended',
-                                                    joined_at__gte=first_day_of_current_month).count()
-
-    # Count active, pending, and suspended members for the previous month
-    prev_active_members_count = Member.objects.filter(status='active', joined_at__gte=first_day_of_previous_month,
-                                                      joined_at__lt=first_day_of_current_month).count()
-    prev_pending_members_count = Member.objects.filter(status='pending', created_at__gte=first_day_of_previous_month,
-                                                       joined_at__lt=first_day_of_current_month).count()
-    prev_suspended_members_count = Member.objects.filter(status='suspended', joined_at__gte=first_day_of_previous_month,
-                                                         joined_at__lt=first_day_of_current_month).count()
-
-    # Calculate percentage changes
-    def calculate_percentage_change(current, previous):
-        if previous == 0:
-            return 100 if current > 0 else 0
-        return round(((current - previous) / previous) * 100, 2)
-
-    active_percentage_change = calculate_percentage_change(active_members_count, prev_active_members_count)
-    pending_percentage_change = calculate_percentage_change(pending_members_count, prev_pending_members_count)
-    suspended_percentage_change = calculate_percentage_change(suspended_members_count, prev_suspended_members_count)
-    members = Member.objects.all()
+
+    # All six counters (this month and last month) come from one aggregate query
+    current = monthly_status_changes(today, today)[0]
+    # The member table is filled page by page from members_data, see dashboard.html
     context = {
-        'active_members_count': active_members_count,
-        'pending_members_count': pending_members_count,
-        'suspended_members_count': suspended_members_count,
-        'active_percentage_change': active_percentage_change,
-        'pending_percentage_change': pending_percentage_change,
-        'suspended_percentage_change': suspended_percentage_change,
+        'active_members_count': current['active'],
+        'pending_members_count': current['pending'],
+        'suspended_members_count': current['suspended'],
+        'active_percentage_change': current['active_percentage_change'],
+        'pending_percentage_change': current['pending_percentage_change'],
+        'suspended_percentage_change': current['suspended_percentage_change'],
         'today': today,
-        'members': members,
-        'tehsil': tehsil,
-        'city': city,
-        'countries': countries,
+        'district_options': get_reference_data()['district_options'],
     }
     return render(request, 'dashboard.html', context)
 
 def members(request):
-    members = Member.objects.all()
+    members = Member.objects.for_listing()
     context = {'members': members}
     return render(request, 'members.html', context)
 
 
+@user_passes_test(lambda u: u.is_staff)  # Ensure only admins can access
+def member_stats(request):
+    """Monthly active/pending/suspended counters as JSON, ``?from=YYYY-MM&to=YYYY-MM``."""
+    today = date.today()
+    try:
+        last_month = parse_month(request.GET['to']) if request.GET.get('to') else today
+        first_month = parse_month(request.GET['from']) if request.GET.get('from') else add_months(month_start(last_month), -11)
+        months = monthly_status_changes(first_month, last_month)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'months': months})
+
+
+@user_passes_test(lambda u: u.is_staff)
+def member_timeseries(request):
+    """
+    Signups, approvals and renewals per day, week or month as JSON,
+    ``?interval=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD``.
+    """
+    interval = request.GET.get('interval', 'day')
+    today = date.today()
+    try:
+        last_day = date.fromisoformat(request.GET['to']) if request.GET.get('to') else today
+        if request.GET.get('from'):
+            first_day = date.fromisoformat(request.GET['from'])
+        elif interval == 'month':
+            first_day = add_months(month_start(last_day), -11)
+        elif interval == 'week':
+            first_day = last_day - timedelta(weeks=11)
+        else:
+            first_day = last_day - timedelta(days=29)
+        buckets = timeseries(interval, first_day, last_day)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'interval': interval, 'buckets': buckets})
+
+
+MEMBER_TABLE_SORT_FIELDS = ('created_at', 'full_name', 'id')
+MEMBER_TABLE_PAGE_SIZE = 25
+MEMBER_TABLE_MAX_PAGE_SIZE = 100
+
+
+def filter_members(members, params):
+    """Apply the member table filters in ``params``; bad ids or dates raise ValueError/ValidationError."""
+    status = params.get('status')
+    if status:
+        members = members.filter(status=status)
+    district_id = params.get('district')
+    if district_id:
+        members = members.filter(district_id=district_id)
+    tehsil_id = params.get('tehsil')
+    if tehsil_id:
+        members = members.filter(tehsil_id=tehsil_id)
+    created_from = params.get('created_from')
+    if created_from:
+        members = members.filter(created_at__date__gte=created_from)
+    created_to = params.get('created_to')
+    if created_to:
+        members = members.filter(created_at__date__lte=created_to)
+    query = params.get('q', '').strip()
+    if query:
+        members = filter_search(members, query)
+    return members
+
+
+def member_row(member):
+    """A member loaded with ``for_listing`` as a row of the dashboard member table."""
+    return {
+        'id': member.id,
+        'full_name': member.full_name,
+        'business_name': member.business_name,
+        'currency_association_id': member.user.currency_association_id,
+        'pri_mob': member.pri_mob,
+        'tehsil': str(member.tehsil) if member.tehsil else '',
+        'status': member.status,
+        'view_url': reverse('view_member', args=[member.id]),
+        'form_url': reverse('member_form_fragment', args=[member.id]),
+        'print_url': reverse('generate_member_detail', args=[member.id]),
+    }
 
-from datetime import datetime
-from django.utils import timezone
 
+@user_passes_test(lambda u: u.is_staff)  # Ensure only admins can access
+def members_data(request):
+    """JSON feed for the dashboard member table, paginated with a keyset cursor."""
+    sort = request.GET.get('sort', '-created_at')
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-')
+    if sort_field not in MEMBER_TABLE_SORT_FIELDS:
+        return JsonResponse({'error': f'Unsupported sort field: {sort_field}'}, status=400)
 
-def generate_application_id(fee_type):
-    # Get the current year
-    current_year = datetime.now().year
+    try:
+        limit = int(request.GET.get('limit', MEMBER_TABLE_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    limit = max(1, min(limit, MEMBER_TABLE_MAX_PAGE_SIZE))
 
-    # Get the prefix based on the fee type
-    prefix = 'PK-CEAAJK'
+    try:
+        members = filter_members(Member.objects.for_listing(), request.GET)
+        page, next_cursor = keyset_paginate(members, sort_field, cursor=request.GET.get('cursor'),
+                                            limit=limit, descending=descending)
+    except (ValueError, ValidationError) as e:
+        # Bad cursor, filter id or date
+        return JsonResponse({'error': str(e)}, status=400)
 
-    # Get the code for the selected fee type
-    fee_code = FEE_TYPE_CODES.get(fee_type, 'UNKNOWN')  # Default to 'UNKNOWN' if fee_type is not found
+    return JsonResponse({'results': [member_row(member) for member in page], 'next_cursor': next_cursor})
 
-    # Check if there are any existing entries in the Fee model
-    last_fee = Fee.objects.filter(fee_type=fee_type, is_approved=True).last()
 
-    # If no previous IDs exist, start from 0
-    last_number = 0
+MEMBER_SEARCH_LIMIT = 20
+MEMBER_SEARCH_MAX_LIMIT = 50
 
-    # Check if there's a previous application_id and if it's valid
-    if last_fee and last_fee.application_id:
-        try:
-            last_number_part = last_fee.application_id.split('-')[-1]
-            if last_number_part.isdigit():
-                last_number = int(last_number_part)
-            else:
-                print(f"Warning: Invalid application_id format '{last_fee.application_id}'")
-        except ValueError as e:
-            print(f"Error processing application_id: {e}")
 
-    # Increment to generate a new application ID
-    new_number = last_number + 1
+@user_passes_test(lambda u: u.is_staff)
+def member_search(request):
+    """Members matching ``?q=`` by name, father name, business, address, CNIC or association ID, best first."""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', MEMBER_SEARCH_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    limit = max(1, min(limit, MEMBER_SEARCH_MAX_LIMIT))
+    return JsonResponse({'results': [member_row(member) for member in search_members(query, limit)]})
+
+
+@user_passes_test(lambda u: u.is_staff)
+def member_autocomplete(request):
+    """Members whose association ID, CNIC or name starts with ``?q=``, answered from the in-memory prefix index."""
+    try:
+        limit = int(request.GET.get('limit', AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+    return JsonResponse({'results': [
+        {
+            'id': member_id,
+            'full_name': full_name,
+            'cnic': cnic,
+            'currency_association_id': currency_association_id,
+            'status': status,
+            'view_url': reverse('view_member', args=[member_id]),
+        }
+        for member_id, full_name, cnic, currency_association_id, status
+        in autocomplete_members(request.GET.get('q', ''), limit)
+    ]})
 
-    # Format the new application ID
-    new_application_id = f"{prefix}-{fee_code}-{current_year}-{new_number:04d}"
 
-    return new_application_id
+@user_passes_test(lambda u: u.is_staff)  # Ensure only admins can access
+def export_members(request):
+    """Stream the filtered members as ``?format=csv`` (default) or ``xlsx``."""
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in CONTENT_TYPES:
+        return JsonResponse({'error': f'Unsupported format: {file_format}'}, status=400)
+    try:
+        members = filter_members(Member.objects.all(), request.GET)
+    except (ValueError, ValidationError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return member_export_response(members, request.user, file_format)
 
 
-def calculate_member_till(joined_date):
-    # Convert to naive datetime for comparison if needed
-    if timezone.is_aware(joined_date):
-        joined_date = timezone.make_naive(joined_date)
 
-    current_year = joined_date.year
+def generate_application_id(fee_type):
+    # Get the current year
+    current_year = datetime.now().year
 
-    # Define the comparison date as naive datetime
-    cutoff_date = datetime(current_year, 9, 30)
+    # Get the code for the selected fee type
+    fee_code = FEE_TYPE_CODES.get(fee_type, 'UNKNOWN')  # Default to 'UNKNOWN' if fee_type is not found
 
-    if current_year % 2 == 0:
-        # If it's an even year
-        if joined_date <= cutoff_date:
-            member_till = datetime(current_year + 2, 10, 31)
-        else:
-            member_till = datetime(current_year + 2, 10, 31)
-    else:
-        # If it's an odd year
-        member_till = datetime(current_year + 1, 10, 31)
+    # Numbers restart every year and come from an atomically incremented counter per code and year
+    new_number = next_application_number(fee_code, current_year)
 
-    # Return the calculated member till date as a naive datetime
-    return member_till
+    return format_application_id(fee_code, current_year, new_number)
 
 
 @anonymous_required(redirect_url='home')  # Redirect logged-in users to 'home' page
 def signup_view(request):
-    city = District.objects.all()
-    tehsil = Tehsil.objects.all()
-    payment_details = Payment.objects.all()
-
     SIGNUP_FEE = 45000.00
 
     if request.method == 'POST':
@@ -187,8 +280,7 @@ def signup_view(request):
                 return redirect(reverse('success_url'))  # Replace with your success URL
 
             except Exception as e:
-                error_message = f"Error occurred: {str(e)}\nTraceback:\n{traceback.format_exc()}"
-                print(error_message)  # Print detailed error to console or log
+                logger.exception("Registration failed")
                 # Handle any exceptions that occur during the transaction
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                     return JsonResponse({'success': False, 'error': str(e)})
@@ -234,10 +326,7 @@ def signup_view(request):
         {
             'member_form': member_form,
             'fee_renewal_form': fee_renewal_form,
-            'city': city,
-            'tehsil': tehsil,
-            'countries': countries,
-            'payment_details': payment_details
+            **reference_context(),
         }
     )
 
@@ -254,28 +343,39 @@ def login_view(request):
         currency_association_id = request.POST.get('currency_association_id')
         last_4_cnic_digits = request.POST.get('last_4_cnic_digits')
 
+        # Four CNIC digits are cheap to guess, so failed attempts per ID are limited
+        throttled_id = normalize_currency_association_id(currency_association_id)
+        retry_after = login_retry_after(throttled_id)
+        if retry_after:
+            error_message = f'Too many failed attempts. Try again in {(retry_after + 59) // 60} minutes.'
+            response = render(request, 'sign-in.html', {'error': error_message}, status=429)
+            response['Retry-After'] = str(retry_after)
+            return response
+
         # Authenticate using the custom backend
         user = authenticate(request, currency_association_id=currency_association_id,
                             last_4_cnic_digits=last_4_cnic_digits)
 
         if user is not None:
-            try:
-                # Check if the user has an associated Member record
-                member = Member.objects.get(user=user)
-
-                # Check if the member is approved and active
-                if member.is_approved and member.status == 'active':
-                    login(request, user)
-                    return redirect('home')  # Redirect after successful login
-                else:
-                    # Handle case where the member is not approved or not active
-                    error_message = 'Your account is not active or not approved by admin.'
-                    return render(request, 'sign-in.html', {'error': error_message})
-
-            except Member.DoesNotExist:
-                # Handle case where no member record is found
-                return render(request, 'sign-in.html', {'error': 'Member record not found.'})
+            reset_login_attempts(throttled_id)
+            # Loaded together with the user by CustomBackend
+            member = user.member
+
+            # Check if the member is approved and active
+            if member.is_approved and member.status == 'active':
+                login(request, user)
+                return redirect('home')  # Redirect after successful login
+            if member.is_approved and member.status == 'expired':
+                # Renewing is the only way back to active, ExpiredMemberMiddleware keeps them to that
+                login(request, user)
+                messages.info(request, "Your membership has expired. Renew it to use the rest of the site.")
+                return redirect('renew_membership')
+            else:
+                # Handle case where the member is not approved or not active
+                error_message = 'Your account is not active or not approved by admin.'
+                return render(request, 'sign-in.html', {'error': error_message})
         else:
+            record_failed_login(throttled_id)
             # Handle invalid credentials
             return render(request, 'sign-in.html', {'error': 'Invalid ID or CNIC'})
 
@@ -289,15 +389,33 @@ def logout_view(request):
     return redirect('login')  # Assuming 'login' is the name of your login view
 
 def get_tehsils(request, district_id):
-    tehsils = Tehsil.objects.filter(district_id=district_id)
-    tehsil_list = [{"id": tehsil.id, "name": tehsil.name} for tehsil in tehsils]
+    # Served from the cached district -> tehsil index, no query
+    tehsil_list = get_reference_data()['tehsils_by_district'].get(district_id, [])
     return JsonResponse({"tehsils": tehsil_list})
 
+
+def _tehsil_index_etag(request, fingerprint):
+    # No ETag for an old fingerprint, so a matching If-None-Match cannot answer 304 before the redirect
+    current = get_reference_data()['tehsil_index']['fingerprint']
+    return current if fingerprint == current else None
+
+
+@condition(etag_func=_tehsil_index_etag)
+def tehsil_index(request, fingerprint):
+    # The whole district -> tehsil mapping, so the forms fill the tehsil select without a request per change
+    index = get_reference_data()['tehsil_index']
+    if fingerprint != index['fingerprint']:
+        # A page rendered before the tehsils changed
+        return redirect('tehsil_index', fingerprint=index['fingerprint'])
+    response = HttpResponse(index['body'], content_type='application/json')
+    # The URL changes with the content, so browsers can keep it for good
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @login_required
 def submit_fees(request):
-    try:
-        member = request.user.member  # Ensure the user has a member profile
-    except Member.DoesNotExist:
+    member = get_member(request)  # Ensure the user has a member profile
+    if member is None:
         messages.error(request, "You must be a member to submit fees.")
         return redirect('profile')  # Redirect to profile if not a member
 
@@ -324,26 +442,15 @@ def generate_transaction_id(length=16):
     characters = string.ascii_letters + string.digits  # Include letters and numbers
     return ''.join(random.choice(characters) for _ in range(length))
 
-FEE_TYPE_CODES = {
-    'new registration': 'NRG',
-    'renewal': 'RNW',
-    'change of information': 'ICG',
-    'transfer of ownership': 'TOO',
-    'transfer of ownership (DEATH OF ORIGINAL OWNER)': 'TOD',
-}
-
-
-
 
 @login_required
 def renew_membership(request):
     # Define the renewal fee amount
     RENEWAL_FEE = 7000.00  # Example fee amount
     # Get the member associated with the logged-in user
-    member = get_object_or_404(Member, user=request.user)
-    payment_details = Payment.objects.all()
-    city = District.objects.all()
-    tehsil = Tehsil.objects.all()
+    member = get_member(request)
+    if member is None:
+        raise Http404("Member not found.")
 
     # Initialize the form (you can keep this if you still want to show it in the GET request)
     form = FeeRenewalForm(initial={'total_amount': RENEWAL_FEE})  # Set initial total amount
@@ -351,16 +458,12 @@ def renew_membership(request):
     # Handle POST request for fee renewal and change request
     if request.method == 'POST':
         form = FeeRenewalForm(request.POST)
-        print(form)
         if form.is_valid():
-            print(form.is_valid())
             try:
                 with transaction.atomic():  # Start atomic transaction
                     # Handle fee renewal
                     fee = form.save(commit=False)
-                    print(f"Fee object created: {fee}")  # Print the fee object for debugging
                     fee.member = member  # Link fee to the logged-in member
-                    print(member, fee.member)
                     fee.fee_type = 'renewal'
                     fee.renewal_date = timezone.now()  # Set the renewal date to now
                     # Set total amount and calculate amount remaining
@@ -375,190 +478,10 @@ def renew_membership(request):
                     fee.save()  # Save the fee record
 
                     member.member_till = calculate_member_till(member.joined_at)  # Calculate the new membership till date
-                    member.save()
+                    member.save(update_fields=['member_till'])
 
-                    # Prepare change request data
-                    changes = {}
-                    new_full_name = request.POST.get('new_full_name', member.full_name)
-                    if new_full_name and new_full_name != member.full_name:
-                        changes['full_name'] = {
-                            'previous': member.full_name,
-                            'new': new_full_name
-                        }
-                    new_father_name = request.POST.get('new_father_name', member.father_name)
-                    if new_father_name and new_father_name != member.father_name:
-                        changes['father_name'] = {
-                            'previous': member.father_name,
-                            'new': new_father_name
-                        }
-                    new_cnic = request.POST.get('new_cnic', member.cnic)
-                    if new_cnic and new_cnic != member.cnic:
-                        changes['cnic'] = {
-                            'previous': member.cnic,
-                            'new': new_cnic
-                        }
-                    new_dob = request.POST.get('new_dob', member.dob)
-                    if new_dob and new_dob != member.dob:
-                        changes['dob'] = {
-                            'previous': member.dob,
-                            'new': new_dob
-                        }
-                    new_gender = request.POST.get('new_gender', member.gender)
-                    if new_gender and new_gender != member.gender:
-                        changes['gender'] = {
-                            'previous': member.gender,
-                            'new': new_gender
-                        }
-                    new_nic_type = request.POST.get('new_nic_type', member.nic_type)
-                    if new_nic_type and new_nic_type != member.nic_type:
-                        changes['nic_type'] = {
-                            'previous': member.nic_type,
-                            'new': new_nic_type
-                        }
-                    new_country_of_stay = request.POST.get('new_country_of_stay', member.country_of_stay)
-                    if new_country_of_stay and new_country_of_stay != member.country_of_stay:
-                        changes['country_of_stay'] = {
-                            'previous': str(member.country_of_stay),  # Convert previous country to string
-                            'new': str(new_country_of_stay)  # Convert new country to string
-                        }
-
-                    new_present_address = request.POST.get('new_present_address', member.present_address)
-                    if new_present_address and new_present_address != member.present_address:
-                        changes['present_address'] = {
-                            'previous': member.present_address,
-                            'new': new_present_address
-                        }
-                    new_permanent_address = request.POST.get('new_permanent_address', member.permanent_address)
-                    if new_permanent_address and new_permanent_address != member.permanent_address:
-                        changes['permanent_address'] = {
-                            'previous': member.permanent_address,
-                            'new': new_permanent_address
-                        }
-                    new_dual_citizen = request.POST.get('new_dual_citizen', member.dual_citizen)
-                    print(new_dual_citizen)
-                    if new_dual_citizen is not None and new_dual_citizen != member.dual_citizen:
-                        changes['dual_citizen'] = {
-                            'previous': member.dual_citizen,
-                            'new': new_dual_citizen
-                        }
-                    new_other_citizenship = request.POST.get('new_other_citizenship', member.other_citizenship)
-                    if new_other_citizenship and new_other_citizenship != member.other_citizenship:
-                        changes['other_citizenship'] = {
-                            'previous': member.other_citizenship,
-                            'new': new_other_citizenship
-                        }
-                    new_pri_mob = request.POST.get('new_pri_mob', member.pri_mob)
-                    if new_pri_mob and new_pri_mob != member.pri_mob:
-                        changes['pri_mob'] = {
-                            'previous': member.pri_mob,
-                            'new': new_pri_mob
-                        }
-                    new_sec_mob = request.POST.get('new_sec_mob', member.sec_mob)
-                    if new_sec_mob and new_sec_mob != member.sec_mob:
-                        changes['sec_mob'] = {
-                            'previous': member.sec_mob,
-                            'new': new_sec_mob
-                        }
-                    new_designation = request.POST.get('new_designation', member.designation)
-                    if new_designation and new_designation != member.designation:
-                        changes['designation'] = {
-                            'previous': member.designation,
-                            'new': new_designation
-                        }
-                    new_business_name = request.POST.get('new_business_name', member.business_name)
-                    if new_business_name and new_business_name != member.business_name:
-                        changes['business_name'] = {
-                            'previous': member.business_name,
-                            'new': new_business_name
-                        }
-                    new_business_address = request.POST.get('new_business_address', member.business_address)
-                    if new_business_address and new_business_address != member.business_address:
-                        changes['business_address'] = {
-                            'previous': member.business_address,
-                            'new': new_business_address
-                        }
-                    # Initialize new_tehsil_obj and new_district_obj to None
-                    new_tehsil_obj = None
-                    new_district_obj = None
-
-                    # Handle the new district change
-                    # Handle the new district change
-                    new_district_id = request.POST.get('new_district')
-                    if new_district_id and new_district_id != str(member.district.id if member.district else None):
-                        new_district_obj = get_object_or_404(District,
-                                                             id=new_district_id)  # Get the district object by ID
-                        changes['district'] = {
-                            'previous': member.district.name if member.district else None,
-                            'new': new_district_obj.name
-                        }
-                        member.district = new_district_obj  # Update the member's district
-
-                    # Handle the new tehsil change
-                    new_tehsil_id = request.POST.get('new_tehsil')
-                    if new_tehsil_id and new_tehsil_id != str(member.tehsil.id if member.tehsil else None):
-                        new_tehsil_obj = get_object_or_404(Tehsil, id=new_tehsil_id)  # Get the tehsil object by ID
-                        changes['tehsil'] = {
-                            'previous': member.tehsil.name if member.tehsil else None,
-                            'new': new_tehsil_obj.name
-                        }
-                        member.tehsil = new_tehsil_obj  # Update the member's tehsil
-
-                    print(f"District ID: {new_district_id}")
-                    print(f"New District Object: {new_district_obj}")
-                    new_pri_land = request.POST.get('new_pri_land', member.pri_land)
-                    if new_pri_land and new_pri_land != member.pri_land:
-                        changes['pri_land'] = {
-                            'previous': member.pri_land,
-                            'new': new_pri_land
-                        }
-                    new_sec_land = request.POST.get('new_sec_land', member.sec_land)
-                    if new_sec_land and new_sec_land != member.sec_land:
-                        changes['sec_land'] = {
-                            'previous': member.sec_land,
-                            'new': new_sec_land
-                        }
-                    new_employee_number = request.POST.get('new_employee_number', member.employee_number)
-                    if new_employee_number and new_employee_number != member.employee_number:
-                        changes['employee_number'] = {
-                            'previous': member.employee_number,
-                            'new': new_employee_number
-                        }
-                    print(changes)
-                    # Save change request if there are any changes
-                    change_request = MemberChangeRequest(
-                        member=member,
-                        fee=fee,
-                        changes=changes  # Store the changes
-                    )
-                    print(change_request)
-                    change_request.new_full_name = new_full_name
-                    change_request.new_father_name = new_father_name
-                    change_request.new_cnic = new_cnic
-                    change_request.new_dob = new_dob
-                    change_request.new_gender = new_gender
-                    change_request.new_nic_type = new_nic_type
-                    change_request.new_country_of_stay = new_country_of_stay
-                    change_request.new_present_address = new_present_address
-                    change_request.new_permanent_address = new_permanent_address
-                    change_request.new_dual_citizen = new_dual_citizen
-                    change_request.new_other_citizenship = new_other_citizenship
-                    change_request.new_pri_mob = new_pri_mob
-                    change_request.new_sec_mob = new_sec_mob
-                    change_request.new_designation = new_designation
-                    change_request.new_business_name = new_business_name
-                    change_request.new_business_address = new_business_address
-                    # Only assign new_tehsil and new_district if they were updated
-                    if new_tehsil_obj:
-                        change_request.new_tehsil = new_tehsil_obj
-                    else:
-                        change_request.new_tehsil = member.tehsil  # Keep current tehsil if no new tehsil is set
-                    if new_district_obj:
-                        change_request.new_district = new_district_obj
-                    else:
-                        change_request.new_district = member.district  # Keep current tehsil if no new tehsil is set
-                    change_request.new_pri_land = new_pri_land
-                    change_request.new_sec_land = new_sec_land
-                    change_request.new_employee_number = new_employee_number
+                    # Every new_* field is compared with the member in one pass, see change_requests.py
+                    change_request = build_change_request(member, fee, request.POST)
 
                     # Generate the application ID based on fee type
                     application_id = generate_application_id(fee.fee_type)
@@ -576,8 +499,7 @@ def renew_membership(request):
                     'message': "An application with your ID already exists."
                 })
             except Exception as e:
-                error_message = f"Error occurred: {str(e)}\nTraceback:\n{traceback.format_exc()}"
-                print(error_message)  # Print detailed error to console or log
+                logger.exception("Renewal of member %s failed", member.pk)
                 return JsonResponse({
                     'status': 'error',
                     'message': f"An error occurred: {str(e)}"
@@ -592,22 +514,43 @@ def renew_membership(request):
     # Render the template with the form
     return render(request, 'renew_membership.html', {
         'form': form,
-        'payment_details': payment_details,
-        'city': city,
-        'tehsil': tehsil,
-        'countries': countries
+        **reference_context(member),
     })
 
 @user_passes_test(lambda u: u.is_staff)  # Ensure only admins can access
 def pending_requests(request):
     # Query all unapproved/unrejected change requests
-    pending_requests = MemberChangeRequest.objects.filter(is_approved=False, is_rejected=False)
+    pending_requests = MemberChangeRequest.objects.filter(is_approved=False, is_rejected=False).select_related('member')
 
     return render(request, 'admin_pending_requests.html', {
         'pending_requests': pending_requests,
     })
 
 
+@user_passes_test(lambda u: u.is_staff)
+def bulk_review_requests(request):
+    # Approve or reject the selected change requests with their fees; one result per request
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': "Invalid request method."}, status=405)
+    action = request.POST.get('action')
+    ids = request.POST.getlist('ids')
+    if action not in ('approve', 'reject') or not ids:
+        return JsonResponse({'status': 'error', 'message': "Select requests and approve or reject them."}, status=400)
+    if not all(request_id.isdigit() for request_id in ids):
+        return JsonResponse({'status': 'error', 'message': "Invalid request ids."}, status=400)
+
+    if action == 'approve':
+        result = approve_change_requests(ids, calculate_member_till(timezone.now()).date())
+    else:
+        result = reject_change_requests(ids, request.POST.get('rejection_reason', ''))
+    return JsonResponse({
+        'status': 'success',
+        'message': result.summary(),
+        'counts': result.counts,
+        'results': result.as_list(),
+    })
+
+
 @user_passes_test(lambda u: u.is_staff)  # Ensure only admins can access
 def view_change_request(request, request_id):
     change_request = get_object_or_404(MemberChangeRequest, id=request_id)
@@ -634,11 +577,12 @@ def view_change_request(request, request_id):
                 if change_request.changes:
                     for field, values in change_request.changes.items():
                         new_value = request.POST.get(f'changes[{field}]')
-                        print(new_value)
-                        if new_value:
-                            # Assuming change_request.changes is a dictionary
-                            change_request.changes[field]['new'] = new_value
-                            print(change_request.changes[field]['new'])
+                        if new_value and new_value != values['new']:
+                            try:
+                                edit_change(change_request, field, new_value)
+                            except ValidationError as e:
+                                messages.error(request, e.messages[0])
+                                return redirect('view_change_request', request_id=change_request.id)
                 change_request.save()
 
             elif 'reject_change_request' in request.POST:
@@ -668,7 +612,12 @@ def view_change_request(request, request_id):
                 # Calculate and update member till date
                 member = change_request.member  # Get the member instance
                 member.member_till = calculate_member_till(timezone.now())  # Use the reusable function
-                member.save()  # Save the updated member instance
+                update_fields = ['member_till']
+                if member.status == 'expired':
+                    # The renewed membership runs again
+                    member.status = 'active'
+                    update_fields.append('status')
+                member.save(update_fields=update_fields)
                 messages.success(request, 'Changes have been applied successfully.')
                 return redirect('home')
             else:
@@ -686,42 +635,33 @@ def view_change_request(request, request_id):
     })
 
 
-def apply_changes(self):
-    """Apply changes to the original Member model when approved, and track changes."""
-    member = self.member
-    previous_values = {}
+def get_member_by_id(request, member_id):
+    """Look up a member by id, reusing the request's own member when that is the one asked for."""
+    if not request.user.is_staff:
+        member = get_member(request)
+        if member is not None and member.id == member_id:
+            return member
+    return get_object_or_404(Member, id=member_id)
 
-    # Apply changes based on the edited values
-    if self.changes:
-        for field, change in self.changes.items():
-            new_value = change['new']  # Get the edited value from the changes
-            old_value = getattr(member, field, None)  # Get the current value of the field
 
-            if new_value is not None and new_value != old_value:
-                previous_values[field] = old_value  # Store the old value for tracking
-                setattr(member, field, new_value)  # Update the member's field
+def can_view_member(user, member):
+    """Staff can view or edit any member, everyone else only their own record."""
+    return user.is_staff or member.user_id == user.id
 
-    # Save the updated member information
-    member.save()
 
-    # Log the previous values of changed fields
-    if previous_values:
-        self.changes = previous_values  # Update changes with previous values
-        self.save()
 @login_required
 def view_member(request, member_id):
     try:
         # Retrieve the member by their ID
-        member = get_object_or_404(Member, id=member_id)
-        city = District.objects.all()
-        tehsil = Tehsil.objects.all()
+        member = get_member_by_id(request, member_id)
         fee = Fee.objects.filter(fee_type="new registration", member=member).first()
-        print(fee)
         # Check if the logged-in user has permission to view or edit the member
-        if not request.user.is_staff and member.user != request.user:
+        if not can_view_member(request.user, member):
             raise PermissionDenied("You do not have permission to view or edit this member's details.")
 
         if request.method == 'POST':
+            # Approvals as stored, to tell whether the admin changed them
+            approvals_before = (member.is_approved, fee.is_approved if fee else False)
             form = MemberDetailForm(request.POST, instance=member)  # Bind the form to the existing member instance
             if form.is_valid():
                 form.save()  # This will save changes to the existing member, not create a new one.
@@ -746,8 +686,11 @@ def view_member(request, member_id):
 
                     fee.save()
 
-                # Set status to 'active' if both approved, else 'pending' or 'suspended'
-                if member_approved and payment_approved:
+                # Set status to 'active' if both approved, else 'pending' or 'suspended'. An expired
+                # membership stays expired unless the admin changed an approval; renewing reactivates it
+                if member.status == 'expired' and (member_approved, payment_approved) == approvals_before:
+                    pass
+                elif member_approved and payment_approved:
                     member.status = 'active'
                 elif not member_approved and not payment_approved:
                     member.status = 'suspended'
@@ -767,7 +710,7 @@ def view_member(request, member_id):
                     return JsonResponse({'success': False, 'errors': form.errors})
 
                 # If form is invalid, display errors in the template
-                return render(request, 'member_detail.html',{'form': form, 'fee':fee, 'member': member, 'city': city, 'tehsil': tehsil, 'countries': countries})
+                return render(request, 'member_detail.html',{'form': form, 'fee':fee, 'member': member, **reference_context(member)})
 
         else:
             form = MemberDetailForm(instance=member)  # Prepopulate the form with the existing member's data
@@ -776,15 +719,46 @@ def view_member(request, member_id):
         raise Http404("Member not found.")
     except PermissionDenied as e:
         return render(request, 'errors/403.html', {'message': str(e)})
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+    except Exception:
+        logger.exception("Viewing member %s failed", member_id)
         return render(request, 'errors/500.html', {'message': 'An unexpected error occurred.'})
 
     return render(request, 'member_detail.html',
-                  {'form': form, 'fee':fee, 'member': member, 'city': city, 'tehsil': tehsil, 'countries': countries})
+                  {'form': form, 'fee':fee, 'member': member, **reference_context(member)})
 
 
 
+@login_required
+def member_form_fragment(request, member_id):
+    """
+    Render the edit form of a single member as an HTML fragment, so pages can ship one
+    empty modal and fill it on demand instead of rendering a form per member.
+    Pass ``?readonly=1`` to get the same form with every field disabled.
+    """
+    member = get_member_by_id(request, member_id)
+    if not can_view_member(request.user, member):
+        raise PermissionDenied("You do not have permission to view or edit this member's details.")
+
+    readonly = request.GET.get('readonly') == '1'
+    # A page can hold both fragments next to member_detail's memberForm, so the form and its
+    # field ids get their own prefix
+    form_id = 'memberDetailsForm' if readonly else 'memberEditForm'
+    form = MemberDetailForm(instance=member, auto_id=f'{form_id}_%s')
+    form.fields['tehsil'].queryset = Tehsil.objects.select_related('district')
+    if readonly:
+        for field in form.fields.values():
+            field.disabled = True
+
+    fee = Fee.objects.filter(fee_type="new registration", member=member).first()
+    return render(request, 'member_form_fragment.html', {
+        'form': form,
+        'member': member,
+        'fee': fee,
+        'readonly': readonly,
+        'form_id': form_id,
+    })
+
+
 @csrf_exempt
 @user_passes_test(lambda u: u.is_staff or u.is_superuser)
 def toggle_member_status(request, member_id):
@@ -825,166 +799,74 @@ def delete_member(request, member_id):
     return JsonResponse({'message': 'Invalid request.'}, status=400)
 
 
-def tehsils_map(request):
-    tehsils = Tehsil.objects.all()
-    data = []
-    for tehsil in tehsils:
-        # Count the number of members in the current Tehsil
-        member_count = Member.objects.filter(status='active', tehsil=tehsil).count()
-
-        if tehsil.latitude and tehsil.longitude and member_count > 0:  # Check if members > 0
-            data.append({
-                'name': tehsil.name,
-                'district': tehsil.district.name,
-                'latitude': float(tehsil.latitude),
-                'longitude': float(tehsil.longitude),
-                'member_count': member_count,  # Add member count to the data
-            })
-    return JsonResponse(data, safe=False)
-
-
-def generate_receipt_view(request, order_id):
-    # Get the Member object
-    member = get_object_or_404(Member, id=order_id)
-
-    # Check if a MemberChangeRequest exists for the member
-    change_request = MemberChangeRequest.objects.filter(member=member).first()
-    if not change_request:
-        return HttpResponse("Cannot generate receipt. No MemberChangeRequest found for this member.", status=400)
-
-    # Check if the change request is approved
-    if not change_request.is_approved:
-        return HttpResponse("Cannot generate receipt. Member change request is not approved.", status=400)
-
-    # Get the associated Fee for the member (handling the case where Fee doesn't exist)
-    fee = Fee.objects.filter(member=member).first()
-    if not fee or not fee.is_approved:
-        return HttpResponse("Cannot generate receipt. Fee is not approved or does not exist.", status=400)
-    # Prepare the context
-    context = {
-        'member': member,
-        'application_id': change_request.application_id,
-        'submission_date': change_request.submission_date,
-        'fee': fee,
-    #     'customer': customer,
-    #     'car': car,
-    #     'car_detail': car_detail,  # Single instance
-    #     'company': company,
-    #     'payment': payment,  # Single instance
-    #     'duration': duration,  # Duration in days
-    }
-
-    # The name of your PDF file
-    filename = '{}.pdf'.format(member.id)
-
-    # HTML FIle to be converted to PDF - inside your Django directory
-    template = get_template('pdf.html')
-
-    # Render the HTML
-    html = template.render(context)
-
-    # Options - Very Important [Don't forget this]
-    options = {
-        'encoding': 'UTF-8',
-        'javascript-delay': '10',  # Optional
-        'enable-local-file-access': None,  # To be able to access CSS
-        'page-size': 'A4',
-        'orientation': 'portrait',
-        'custom-header': [
-            ('Accept-Encoding', 'gzip')
-        ],
-    }
-    # Javascript delay is optional
+def _tehsils_map_etag(request):
+    return get_tehsils_map()['etag']
 
-    # Remember that location to wkhtmltopdf
-    # For windows os
-    config = pdfkit.configuration(wkhtmltopdf='C:/Program Files/wkhtmltopdf/bin/wkhtmltopdf.exe')
 
-    # For linux
-    # config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
+def _tehsils_map_last_modified(request):
+    return get_tehsils_map()['last_modified']
 
-    # IF you have CSS to add to template
-    css1 = os.path.join(settings.CSS_LOCATION, 'libraries', 'assets', 'css', 'style.css')
-    # css2 = os.path.join(settings.CSS_LOCATION, 'assets', 'css', 'dashboard.css')
 
-    # Create the file
-    file_content = pdfkit.from_string(html, False, configuration=config, options=options)
-
-    # Create the HTTP Response
-    response = HttpResponse(file_content, content_type='application/pdf')
-    response['Content-Disposition'] = 'inline; filename = {}'.format(filename)
-
-    # Return
+@condition(etag_func=_tehsils_map_etag, last_modified_func=_tehsils_map_last_modified)
+def tehsils_map(request):
+    # GeoJSON of tehsils with active members; cached until a member's status or tehsil changes
+    response = HttpResponse(get_tehsils_map()['body'], content_type='application/geo+json')
+    # Let the browser keep it but revalidate with If-None-Match / If-Modified-Since every time
+    response['Cache-Control'] = 'no-cache'
     return response
 
 
+def _pdf_member(request, member_id):
+    member = get_object_or_404(Member.objects.with_related(), id=member_id)
+    # Staff see every member's documents, members only their own
+    if not request.user.is_staff and member.user_id != request.user.id:
+        raise PermissionDenied
+    return member
 
-def generate_member_detail(request, order_id):
-    # Get the Member object
-    member = get_object_or_404(Member, id=order_id)
 
+def _pdf_response(request, member, kind):
+    # Rendering happens in the pdf_worker processes; serve the cached file once it exists
+    try:
+        job = request_pdf(member, kind)
+    except PdfNotAvailable as exc:
+        return HttpResponse(str(exc), status=400)
+    # Without a worker picking it up in time, render it here
+    job = render_unclaimed(job)
 
-    # Check if the change request is approved
-    if not member.is_approved:
-        return HttpResponse("Cannot generate receipt. Member is not approved.", status=400)
+    if job.status != 'done':
+        return render(request, 'pdf_pending.html', {'job': job}, status=202)
 
-    # Get the associated Fee for the member (handling the case where Fee doesn't exist)
-    fee = Fee.objects.filter(fee_type="new registration", member=member).first()
-    if not fee or not fee.is_approved:
-        return HttpResponse("Cannot generate receipt. Fee is not approved or does not exist.", status=400)
-    # Prepare the context
-    context = {
-        'member': member,
-        'application_id': member.application_id,
-        'submission_date': member.created_at,
-        'fee': fee,
-    #     'customer': customer,
-    #     'car': car,
-    #     'car_detail': car_detail,  # Single instance
-    #     'company': company,
-    #     'payment': payment,  # Single instance
-    #     'duration': duration,  # Duration in days
-    }
+    response = FileResponse(job.file.open('rb'), content_type='application/pdf')
+    response['Content-Disposition'] = 'inline; filename = {}.pdf'.format(member.id)
+    return response
 
-    # The name of your PDF file
-    filename = '{}.pdf'.format(member.id)
-
-    # HTML FIle to be converted to PDF - inside your Django directory
-    template = get_template('pdf.html')
-
-    # Render the HTML
-    html = template.render(context)
-
-    # Options - Very Important [Don't forget this]
-    options = {
-        'encoding': 'UTF-8',
-        'javascript-delay': '10',  # Optional
-        'enable-local-file-access': None,  # To be able to access CSS
-        'page-size': 'A4',
-        'orientation': 'portrait',
-        'custom-header': [
-            ('Accept-Encoding', 'gzip')
-        ],
-    }
-    # Javascript delay is optional
 
-    # Remember that location to wkhtmltopdf
-    # For windows os
-    config = pdfkit.configuration(wkhtmltopdf='C:/Program Files/wkhtmltopdf/bin/wkhtmltopdf.exe')
+@login_required(login_url='login')
+def generate_receipt_view(request, order_id):
+    return _pdf_response(request, _pdf_member(request, order_id), 'receipt')
+
 
-    # For linux
-    # config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
+@login_required(login_url='login')
+def generate_member_detail(request, order_id):
+    return _pdf_response(request, _pdf_member(request, order_id), 'member_detail')
 
-    # IF you have CSS to add to template
-    css1 = os.path.join(settings.CSS_LOCATION, 'libraries', 'assets', 'css', 'style.css')
-    # css2 = os.path.join(settings.CSS_LOCATION, 'assets', 'css', 'dashboard.css')
 
-    # Create the file
-    file_content = pdfkit.from_string(html, False, configuration=config, options=options)
+@user_passes_test(lambda u: u.is_staff)
+def download_card_export(request, export_id):
+    # The ZIP holds every selected member's CNIC and address, so it is only served here
+    export = get_object_or_404(CardExport, id=export_id, status='done')
+    if not export.file:
+        raise Http404("This export has expired.")
+    return FileResponse(export.file.open('rb'), as_attachment=True, filename=f'member-cards-{export.id}.zip')
 
-    # Create the HTTP Response
-    response = HttpResponse(file_content, content_type='application/pdf')
-    response['Content-Disposition'] = 'inline; filename = {}'.format(filename)
 
-    # Return
-    return response
\ No newline at end of file
+@login_required(login_url='login')
+def pdf_job_status(request, job_id):
+    job = PdfJob.objects.defer('html').select_related('member').filter(id=job_id).first()
+    if job is None:
+        return JsonResponse({'status': 'missing'}, status=404)
+    if not request.user.is_staff and job.member.user_id != request.user.id:
+        raise PermissionDenied
+    job = render_unclaimed(job)
+    # Only the state is exposed, the error text stays in the admin
+    return JsonResponse({'status': job.status})